@@ -1,9 +1,11 @@
 import logging
 import sys
+from heapq import heapify, heappop, heapreplace
 from typing import List
 
-from game import TrashDecision, DiscardDecision, DEFAULT_HAND_SIZE
+from game import TrashDecision, DiscardDecision, HandCache, DEFAULT_HAND_SIZE
 from players import AIPlayer, BigMoney
+from handvalues import cached_exact_hands, expected_value
 from cards import Card, Copper, Estate, Silver, Duchy, Province, Gold, Smithy, Witch, Moat, Militia, Chapel, NO_CARD
 
 class Terminal_Draw_Big_Money(BigMoney):
@@ -54,9 +56,12 @@ class Terminal_Draw_Big_Money(BigMoney):
         except IndexError:
             return NO_CARD
 
+    def make_buy_decision(self, game, decision) -> Card:
+        return self.buy_priority_order(game, decision)
+
     def make_act_decision(self, decision):
         try:
-            return [card for card in decision.state().all_cards() if card in self.terminal_draws][0]
+            return [card for card in decision.choices() if card in self.terminal_draws][0]
         except IndexError:
             return NO_CARD
 
@@ -91,30 +96,76 @@ ChapelBot = lambda cutoff1=3, cutoff2=6: Terminal_Draw_Big_Money(
 )
 
 class HillClimbBot(BigMoney):
-    def __init__(self, cutoff1=2, cutoff2=3, simulation_steps=100):
+    def __init__(self, cutoff1=2, cutoff2=3, simulation_steps=100, cache_size=1024):
         self.simulation_steps = simulation_steps
+        # the hands simulated for the decks this bot considered, reused
+        # across turns and games (no cache with cache_size=0)
+        self.hand_cache = HandCache(cache_size) if cache_size else None
         if not hasattr(self, 'name'):
             self.name = 'HillClimbBot(%d, %d, %d)' % (cutoff1, cutoff2,
             simulation_steps)
         BigMoney.__init__(self, cutoff1, cutoff2)
 
     def buy_priority(self, decision, card):
+        return self.buy_priorities(decision, [card])[card]
+
+    def buy_priorities(self, decision, cards):
+        """
+        The buy_priority of each of the cards: the value of the hands the
+        deck makes with the card bought, over simulation_steps hands.
+
+        Decks whose hands can be worked out exactly are, while there is time
+        left (and the ones in the cache always are). The others are sampled
+        one hand at a time, always for the card with the fewest hands so far,
+        so that when time runs out they all have about as many. Their hands
+        are then scaled up to simulation_steps; a card with no hands at all
+        is worth nothing.
+        """
         state = decision.state()
-        total = 0
-        if card is NO_CARD:
-            add = ()
-        else:
-            add = (card,)
-        for (coins, buys) in state.simulate_hands(self.simulation_steps, add):
-            total += buying_value(coins, buys)
-
-        # Gold is better than it seems
-        if card == Gold:
-            total += self.simulation_steps / 2
-        self.log.debug("%s: %s" % (card, total))
-        return total
-
-    def make_buy_decision(self, decision):
+        steps = self.simulation_steps
+        priority = self.exact_priority()
+        totals = {}
+        samples = []
+        for card in cards:
+            add = () if card is NO_CARD else (card,)
+            distribution = cached_exact_hands(state, add, priority, self.hand_cache, compute=self.time_left() > 0)
+            if distribution is not None:
+                # on the same scale as the simulated hands
+                totals[card] = expected_value(distribution, buying_value) * steps
+            else:
+                samples.append((card, add, state.hand_sample(steps, add, self.hand_cache)))
+
+        queue = [(sample.count, i) for i, (card, add, sample) in enumerate(samples) if not sample.complete()]
+        heapify(queue)
+        while queue and self.time_left() > 0:
+            i = queue[0][1]
+            card, add, sample = samples[i]
+            sample.simulate(state, add)
+            if sample.complete():
+                heappop(queue)
+            else:
+                heapreplace(queue, (sample.count, i))
+        for card, add, sample in samples:
+            totals[card] = sample.total(buying_value) * steps / sample.count if sample.count else 0
+
+        for card in cards:
+            # Gold is better than it seems
+            if card == Gold:
+                totals[card] += steps / 2
+            self.log.debug("%s: %s" % (card, totals[card]))
+        return totals
+
+    def exact_priority(self):
+        """
+        The order this bot plays vanilla actions in, for working out its
+        hands exactly, or None if it decides in some other way.
+        """
+        cls = type(self)
+        if cls.make_act_decision is BigMoney.make_act_decision and cls.act_priority is BigMoney.act_priority:
+            return lambda card: self.act_priority(None, card)
+        return None
+
+    def make_buy_decision(self, game, decision):
         choices = decision.choices()
         provinces_left = decision.game.card_counts[Province]
 
@@ -124,7 +175,11 @@ class HillClimbBot(BigMoney):
             return Duchy
         if Estate in choices and provinces_left <= self.cutoff1:
             return Estate
-        return BigMoney.make_buy_decision(self, decision)
+        # like BigMoney.make_buy_decision, with the priorities of all the
+        # choices worked out together
+        priorities = self.buy_priorities(decision, choices)
+        choices.sort(key=lambda card: priorities[card])
+        return choices[-1]
 
 def buying_value(coins: int, buys: int) -> int:
     if coins > buys * Province.cost:
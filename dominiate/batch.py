@@ -0,0 +1,423 @@
+"""
+A lockstep batch engine for the Big Money family of bots.
+
+BigMoney and Terminal_Draw_Big_Money (SmithyBot, WitchBot, MoatBot,
+MilitiaBot...) decide everything from card counts: what is in the hand, how
+many Provinces are left and how dense their deck is in actions. BatchGames
+plays thousands of independent games between such bots at once, keeping every
+pile of every player as a count vector in a NumPy array, and expressing the
+decisions of the bots as vectorized policies over those arrays.
+
+All the games of a batch take the same turn at the same time: turn t belongs
+to seat t % players in every game, and finished games are masked out. The
+rules follow Game.run and the decisions follow the bots exactly, but the
+random numbers come from NumPy, so batch games only match Game.run in
+distribution; validate() compares the two.
+
+Bots whose decisions come from simulations (HillClimbBot, DerivBot...) cannot
+be expressed as count policies and are not supported.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from game import Game, Card, VICTORY_CARDS, STARTING_HAND, DEFAULT_HAND_SIZE
+from game import CARD_COST, CARD_TREASURE, CARD_VP, CARD_COINS, CARD_CARDS, CARD_ACTIONS, CARD_BUYS
+from game import IS_ACTION, IS_VANILLA, IS_PURE_VICTORY, IS_CURSE, IS_DEFENSE
+from game import Curse, Estate, Duchy, Province, Copper, Silver, Gold
+from players import BigMoney
+from basic_ai import Terminal_Draw_Big_Money
+from cards import Witch, Militia
+
+BASE_CARDS = [Curse, Estate, Duchy, Province, Copper, Silver, Gold]
+
+class BatchPolicy(NamedTuple):
+    """
+    The decisions of a Big Money bot: the cutoffs of its buy priorities, and
+    the action card it buys while its deck is short of actions and plays
+    whenever it can.
+    """
+    action: Optional[Card]
+    cutoff1: int
+    cutoff2: int
+
+    @staticmethod
+    def of(bot) -> 'BatchPolicy':
+        "Get the policy of a bot, or raise ValueError if it has none."
+        if type(bot) is BigMoney:
+            return BatchPolicy(None, bot.cutoff1, bot.cutoff2)
+        if type(bot) is not Terminal_Draw_Big_Money:
+            raise ValueError('{0} is not a Big Money bot'.format(bot))
+        if len(bot.terminal_draws) > 1:
+            raise ValueError('{0} buys more than one action card'.format(bot))
+        if not bot.terminal_draws:
+            return BatchPolicy(None, bot.cutoff1, bot.cutoff2)
+        action = bot.terminal_draws[0]
+        if not (IS_VANILLA[action.id] or action in (Witch, Militia)):
+            raise ValueError('{0} has an effect the batch engine does not play'.format(action))
+        return BatchPolicy(action, bot.cutoff1, bot.cutoff2)
+
+class BatchResult(NamedTuple):
+    """
+    The outcome of a batch: scores[game, bot] and seats[game, bot] are given
+    in the order of the bots, turns[game] counts the turns played and
+    finished[game] is False for games stopped at max_rounds.
+    """
+    scores: np.ndarray
+    seats: np.ndarray
+    turns: np.ndarray
+    finished: np.ndarray
+
+    def wins(self) -> np.ndarray:
+        """
+        Count the wins of each bot over the finished games. Ties go to the
+        earliest seat, as in compare_bots.
+        """
+        scores = self.scores[self.finished]
+        seats = self.seats[self.finished]
+        best = scores == scores.max(axis=1, keepdims=True)
+        winners = np.where(best, seats, seats.shape[1]).argmin(axis=1)
+        return np.bincount(winners, minlength=seats.shape[1])
+
+class BatchGames(object):
+    """
+    Plays n_games games between the bots in lockstep. Every game seats the
+    bots in a random order, like Game.setup, and uses the kingdom var_cards,
+    which must hold the action cards the bots buy.
+
+    Piles are int64 arrays indexed [seat, game, column], where the columns
+    are the base cards followed by the action cards of the bots.
+    """
+    def __init__(self, bots: Sequence[Any], n_games: int, var_cards: Sequence[Card] = (), seed: Any = None, max_rounds: int = 300) -> None:
+        policies = [BatchPolicy.of(bot) for bot in bots]
+        self.bots = list(bots)
+        self.n_games = n_games
+        self.max_rounds = max_rounds
+        self.rng = np.random.default_rng(seed)
+        players = self.players = len(bots)
+
+        actions = []
+        for policy in policies:
+            if policy.action is not None and policy.action not in actions:
+                if policy.action not in var_cards:
+                    raise ValueError('{0} is not in the kingdom'.format(policy.action))
+                actions.append(policy.action)
+        self.cards = cards = BASE_CARDS + actions
+        ids = [card.id for card in cards]
+        self.column = {card: column for column, card in enumerate(cards)}
+        self.cost = np.array([CARD_COST[i] for i in ids])
+        self.treasure = np.array([CARD_TREASURE[i] for i in ids])
+        self.vp = np.array([CARD_VP[i] for i in ids])
+        self.is_action = np.array([IS_ACTION[i] for i in ids])
+        self.plus_actions = np.array([CARD_ACTIONS[i] for i in ids])
+        self.plus_buys = np.array([CARD_BUYS[i] for i in ids])
+        self.plus_coins = np.array([CARD_COINS[i] for i in ids])
+        self.plus_cards = np.array([CARD_CARDS[i] for i in ids])
+        self.is_defense = np.array([IS_DEFENSE[i] for i in ids])
+        self.discard_rank = self._discard_ranks()
+
+        # seats[game, bot] is the seat of each bot; the policies of the bots
+        # are spread into [seat, game] arrays
+        self.seats = self.rng.random((n_games, players)).argsort(axis=1).argsort(axis=1)
+        bot_at = self.seats.argsort(axis=1).T
+        self.action = np.array([-1 if p.action is None else self.column[p.action] for p in policies])[bot_at]
+        self.cutoff1 = np.array([p.cutoff1 for p in policies])[bot_at]
+        self.cutoff2 = np.array([p.cutoff2 for p in policies])[bot_at]
+
+        shape = (players, n_games, len(cards))
+        self.hand = np.zeros(shape, dtype=np.int64)
+        self.pile = np.zeros(shape, dtype=np.int64)
+        self.discard = np.zeros(shape, dtype=np.int64)
+        self.inplay = np.zeros(shape, dtype=np.int64)
+
+        counts = {
+            Estate: VICTORY_CARDS[players],
+            Duchy: VICTORY_CARDS[players],
+            Province: VICTORY_CARDS[players],
+            Copper: 60 - 7 * players,
+            Silver: 40,
+            Gold: 30,
+            Curse: 10 * (players - 1),
+        }
+        supply = np.array([counts.get(card, 10) for card in cards], dtype=np.int64)
+        self.supply = np.tile(supply, (n_games, 1))
+        # Only the piles of the batch can run out; the rest of the kingdom
+        # never empties.
+        self.pile_limit = 4 if players > 4 else 3
+
+        self.active = np.ones(n_games, dtype=bool)
+        self.turns = np.zeros(n_games, dtype=np.int64)
+        self.turn = 0
+
+        for card in STARTING_HAND:
+            self.discard[:, :, self.column[card]] += 1
+        everyone = np.full(n_games, DEFAULT_HAND_SIZE)
+        for seat in range(players):
+            self.draw(seat, everyone)
+
+    def _discard_ranks(self) -> np.ndarray:
+        """
+        Rank the cards in the order BigMoney discards them to an attack:
+        pure victory cards from the cheapest, then Copper, then the rest by
+        how little they do. (Surplus terminal actions go first of all; see
+        discard_to_attack.)
+        """
+        def key(card):
+            i = card.id
+            if IS_PURE_VICTORY[i]:
+                return (0, CARD_COST[i])
+            if card is Copper:
+                return (1,)
+            return (2, CARD_ACTIONS[i], CARD_CARDS[i], CARD_COINS[i], CARD_TREASURE[i],
+                    not IS_CURSE[i], not IS_PURE_VICTORY[i], CARD_COST[i])
+        order = sorted(range(len(self.cards)), key=lambda column: key(self.cards[column]))
+        ranks = np.empty(len(self.cards), dtype=np.int64)
+        ranks[order] = np.arange(len(self.cards))
+        return ranks
+
+    def draw(self, seat: int, n: np.ndarray) -> None:
+        """
+        Draw n[game] cards into the hand of a seat, reshuffling its discard
+        pile when its draw pile runs out.
+        """
+        hand, pile, discard = self.hand[seat], self.pile[seat], self.discard[seat]
+        games = np.flatnonzero(n > 0)
+        if not len(games):
+            return
+        need = n[games]
+        size = pile[games].sum(axis=1)
+        # Games that draw their whole pile, and reshuffle if they need more
+        emptying = need >= size
+        if emptying.any():
+            rows = games[emptying]
+            hand[rows] += pile[rows]
+            pile[rows] = 0
+            need[emptying] -= size[emptying]
+            size[emptying] = 0
+            reshuffling = emptying & (need > 0)
+            rows = games[reshuffling]
+            pile[rows] = discard[rows]
+            discard[rows] = 0
+            size[reshuffling] = pile[rows].sum(axis=1)
+        need = np.minimum(need, size)
+        drawing = need > 0
+        self.sample(hand, pile, games[drawing], need[drawing], size[drawing])
+
+    def sample(self, hand: np.ndarray, pile: np.ndarray, games: np.ndarray, need: np.ndarray, size: np.ndarray) -> None:
+        """
+        Move need[i] cards, drawn at random without replacement, from the
+        pile to the hand of each game games[i] whose pile holds size[i] cards.
+        The drawn counts follow the multivariate hypergeometric distribution,
+        sampled one column at a time.
+        """
+        if not len(games):
+            return
+        piles = pile[games]
+        drawn = np.zeros_like(piles)
+        columns = np.flatnonzero(piles.any(axis=0))
+        # the cards left for the last column are all drawn from it
+        for column in columns[:-1]:
+            good = piles[:, column]
+            size = size - good
+            drawn[:, column] = self.rng.hypergeometric(good, size, need)
+            need = need - drawn[:, column]
+        drawn[:, columns[-1]] = need
+        pile[games] -= drawn
+        hand[games] += drawn
+
+    def deck(self, seat: int) -> np.ndarray:
+        return self.hand[seat] + self.pile[seat] + self.discard[seat] + self.inplay[seat]
+
+    def over(self) -> np.ndarray:
+        provinces = self.supply[:, self.column[Province]]
+        empty = (self.supply == 0).sum(axis=1)
+        return (provinces == 0) | (empty >= self.pile_limit)
+
+    def run(self) -> BatchResult:
+        games = np.arange(self.n_games)
+        while True:
+            self.active &= ~self.over()
+            if not self.active.any() or self.turn >= self.max_rounds * self.players:
+                break
+            self.take_turn(self.turn % self.players)
+            self.turns[self.active] += 1
+            self.turn += 1
+
+        seat_scores = np.stack([self.deck(seat) @ self.vp for seat in range(self.players)], axis=1)
+        scores = seat_scores[games[:, None], self.seats]
+        return BatchResult(scores, self.seats, self.turns, ~self.active)
+
+    def take_turn(self, seat: int) -> None:
+        active = self.active
+        hand, inplay = self.hand[seat], self.inplay[seat]
+        games = np.arange(self.n_games)
+        action = self.action[seat]
+        has_action = action >= 0
+        action_column = np.where(has_action, action, 0)
+
+        actions = np.ones(self.n_games, dtype=np.int64)
+        buys = np.ones(self.n_games, dtype=np.int64)
+        coins = np.zeros(self.n_games, dtype=np.int64)
+
+        # Action phase: play the action card while there are actions left
+        while True:
+            playing = active & has_action & (actions > 0) & (hand[games, action_column] > 0)
+            if not playing.any():
+                break
+            columns = action_column[playing]
+            hand[playing, columns] -= 1
+            inplay[playing, columns] += 1
+            actions[playing] += self.plus_actions[columns] - 1
+            buys[playing] += self.plus_buys[columns]
+            coins[playing] += self.plus_coins[columns]
+            self.draw(seat, np.where(playing, self.plus_cards[action_column], 0))
+            for card, attack in ((Witch, self.witch_attack), (Militia, self.militia_attack)):
+                if card in self.column:
+                    attacking = playing & (action_column == self.column[card])
+                    if attacking.any():
+                        attack(seat, attacking)
+
+        # Buy phase
+        buying = active & (buys > 0)
+        while buying.any():
+            choice = self.buy_choice(seat, coins + hand @ self.treasure)
+            buying &= choice >= 0
+            games_buying = np.flatnonzero(buying)
+            columns = choice[buying]
+            self.supply[games_buying, columns] -= 1
+            self.discard[seat][games_buying, columns] += 1
+            coins[buying] -= self.cost[columns]
+            buys[buying] -= 1
+            buying &= buys > 0
+
+        # Clean up and draw the next hand
+        discard = self.discard[seat]
+        discard[active] += hand[active] + inplay[active]
+        hand[active] = 0
+        inplay[active] = 0
+        self.draw(seat, np.where(active, DEFAULT_HAND_SIZE, 0))
+
+    def buy_choice(self, seat: int, hand_value: np.ndarray) -> np.ndarray:
+        """
+        Choose the column each game buys, or -1 to stop buying, like
+        Terminal_Draw_Big_Money.buy_priority_order.
+        """
+        column = self.column
+        provinces = self.supply[:, column[Province]]
+        endgame = provinces <= self.cutoff1[seat]
+        midgame = ~endgame & (provinces <= self.cutoff2[seat])
+        wanted = np.zeros(self.supply.shape, dtype=bool)
+        wanted[:, column[Silver]] = True
+        wanted[:, column[Province]] = True
+        wanted[:, column[Estate]] = endgame
+        wanted[:, column[Duchy]] = endgame | midgame
+        wanted[:, column[Gold]] = ~endgame
+
+        # action_density() < 1.0
+        deck = self.deck(seat)
+        action = self.action[seat]
+        short = (action >= 0) & (deck @ self.is_action * DEFAULT_HAND_SIZE < deck.sum(axis=1))
+        games = np.flatnonzero(short)
+        wanted[games, action[games]] = True
+
+        allowed = wanted & (self.cost <= hand_value[:, None]) & (self.supply > 0)
+        # the action card first, then the most expensive card
+        priority = np.where(allowed, self.cost + 1, 0)
+        priority[games, action[games]] += 100 * allowed[games, action[games]]
+        best = priority.argmax(axis=1)
+        return np.where(priority.max(axis=1) > 0, best, -1)
+
+    def others(self, seat: int) -> List[int]:
+        "The other seats, in turn order."
+        return [(seat + i) % self.players for i in range(1, self.players)]
+
+    def defended(self, seat: int) -> np.ndarray:
+        return (self.hand[seat] @ self.is_defense) > 0
+
+    def witch_attack(self, seat: int, attacking: np.ndarray) -> None:
+        "Every other undefended player gains a Curse while there are any."
+        curse = self.column[Curse]
+        for other in self.others(seat):
+            gaining = attacking & ~self.defended(other) & (self.supply[:, curse] > 0)
+            self.supply[gaining, curse] -= 1
+            self.discard[other][gaining, curse] += 1
+
+    def militia_attack(self, seat: int, attacking: np.ndarray) -> None:
+        "Every other undefended player discards two cards."
+        for other in self.others(seat):
+            discarding = attacking & ~self.defended(other)
+            for _ in range(2):
+                self.discard_to_attack(other, discarding)
+
+    def discard_to_attack(self, seat: int, discarding: np.ndarray) -> None:
+        """
+        Discard one card from the hands of a seat, the way
+        BigMoney.make_discard_decision_incremental does when it may not pass.
+        """
+        hand = self.hand[seat]
+        ranks = np.where(hand > 0, self.discard_rank, len(self.cards))
+        # Terminal actions the player could not play next turn (with its one
+        # action) go first.
+        action = self.action[seat]
+        has_action = action >= 0
+        action_column = np.where(has_action, action, 0)
+        games = np.arange(self.n_games)
+        held = hand[games, action_column]
+        wasted = has_action & (held - held * self.plus_actions[action_column] - 1 > 0)
+        ranks[wasted, action_column[wasted]] = -1
+        columns = ranks.argmin(axis=1)
+        discarding = discarding & (hand.sum(axis=1) > 0)
+        hand[discarding, columns[discarding]] -= 1
+        self.discard[seat][discarding, columns[discarding]] += 1
+
+def validate(bots: Sequence[Any], n_games: int = 400, var_cards: Sequence[Card] = (), seed: Any = 0) -> Dict[str, Any]:
+    """
+    Play n_games with Game.run and with BatchGames, and compare the win rates
+    and mean scores of the bots. Returns, per bot, the two win rates and mean
+    scores and the z-score of each difference; |z| well above 3 means the
+    engines disagree.
+    """
+    wins = np.zeros(len(bots))
+    scores = np.zeros((n_games, len(bots)))
+    for i in range(n_games):
+        game = Game.setup(bots, var_cards, in_place=True, seed=seed, game_index=i)
+        results = game.run()
+        maxscore = max(score for (bot, score) in results)
+        for (bot, score) in results:
+            if score == maxscore:
+                wins[bots.index(bot)] += 1
+                break
+        for (bot, score) in results:
+            scores[i, bots.index(bot)] = score
+
+    batch = BatchGames(bots, n_games, var_cards, seed=seed).run()
+    batch_scores = batch.scores[batch.finished]
+    batch_wins = batch.wins()
+    report = {}
+    for b, bot in enumerate(bots):
+        p1, p2 = wins[b] / n_games, batch_wins[b] / len(batch_scores)
+        p = (wins[b] + batch_wins[b]) / (n_games + len(batch_scores))
+        se = np.sqrt(max(p * (1 - p), 1e-9) * (1 / n_games + 1 / len(batch_scores)))
+        m1, m2 = scores[:, b].mean(), batch_scores[:, b].mean()
+        score_se = np.sqrt(scores[:, b].var() / n_games + batch_scores[:, b].var() / len(batch_scores))
+        report[bot.name] = dict(
+            engine_win_rate=float(p1),
+            batch_win_rate=float(p2),
+            win_z=float((p2 - p1) / se),
+            engine_mean_score=float(m1),
+            batch_mean_score=float(m2),
+            score_z=float((m2 - m1) / max(score_se, 1e-9)),
+        )
+    return report
+
+if __name__ == '__main__':
+    from time import perf_counter
+    from basic_ai import SmithyBot, WitchBot, MoatBot, MilitiaBot
+    from cards import BASE_ACTIONS
+
+    for bots in ([SmithyBot(), WitchBot()], [MoatBot(), MilitiaBot()], [WitchBot(), MoatBot(), Terminal_Draw_Big_Money()]):
+        for name, line in validate(bots, 400, BASE_ACTIONS).items():
+            print(name, ' '.join('%s=%.3f' % item for item in line.items()))
+        start = perf_counter()
+        BatchGames(bots, 20000, BASE_ACTIONS, seed=1).run()
+        print('%.0f batch games/s' % (20000 / (perf_counter() - start)))
@@ -0,0 +1,219 @@
+"""
+Micro-benchmarks of the engine primitives.
+
+Every benchmark times one operation on a fixed state: drawing with and
+without a reshuffle, playing an action, taking a card from the supply, listing
+the choices of a buy, performing each action of BASE_ACTIONS, checking the
+end of the game, simulating hands (with and without a HandCache) and working
+them out exactly. States are persistent (not in-place), so every run of an
+operation starts from the same state, and all the random streams are seeded,
+so runs are comparable between engine versions.
+
+After a warm-up, an operation is timed in a number of runs of `number` calls
+each; the best run gives the ops/sec, and the median shows the noise.
+Allocations are measured with tracemalloc: the memory blocks and bytes that
+one call leaves allocated (mostly the new states it returns), and the peak of
+its temporary allocations.
+
+Run `python benchmarks.py --output results.json` to save the results, and
+`--compare results.json` to show the speedup of each benchmark over saved
+results.
+"""
+import json
+import platform
+import sys
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from statistics import median
+from timeit import Timer
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from game import Game, PlayerState, BuyDecision, HandCache, random_stream
+from game import Copper, Silver, Gold, Estate, Duchy, Province, Curse
+from cards import BASE_ACTIONS, Smithy
+from basic_ai import Terminal_Draw_Big_Money
+from handvalues import exact_hands
+from memory import reset_peak
+
+SEED = 'benchmarks'
+
+class Benchmark(NamedTuple):
+    """
+    An operation to time. setup() builds its fixture once, and run(fixture)
+    performs the operation once.
+    """
+    name: str
+    setup: Callable[[], Any]
+    run: Callable[[Any], Any]
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    number: int
+    runs: List[float]
+    retained_blocks: float
+    retained_bytes: float
+    peak_bytes: int
+
+    def ops_per_sec(self) -> float:
+        return self.number / min(self.runs)
+
+    def median_ops_per_sec(self) -> float:
+        return self.number / median(self.runs)
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(
+            number=self.number,
+            runs=self.runs,
+            ops_per_sec=self.ops_per_sec(),
+            median_ops_per_sec=self.median_ops_per_sec(),
+            retained_blocks=self.retained_blocks,
+            retained_bytes=self.retained_bytes,
+            peak_bytes=self.peak_bytes,
+        )
+
+DECK = {Copper: 7, Silver: 4, Gold: 2, Estate: 3, Duchy: 1, Smithy: 1}
+
+def player_state(hand: Tuple = (), drawpile: Tuple = (), discard: Optional[Dict] = None, shuffled: Optional[Dict] = None, actions: int = 1) -> PlayerState:
+    return PlayerState(
+        Terminal_Draw_Big_Money([Smithy]), hand, drawpile, discard or {}, {}, actions, 1, 0,
+        rng=random_stream(SEED, 'draw'), sim_rng=random_stream(SEED, 'simulation'),
+        shuffled_counts=shuffled,
+    )
+
+def game_with_hand(hand: Tuple) -> Game:
+    """
+    A two-player game between Big Money bots, where the current player holds
+    the given hand and has the usual deck to draw from.
+    """
+    bots = [Terminal_Draw_Big_Money([Smithy]), Terminal_Draw_Big_Money([Smithy])]
+    game = Game.setup(bots, BASE_ACTIONS, seed=SEED, shuffle_seats=False)
+    state = game.state()
+    state = PlayerState(
+        state.player, hand, (), DECK, {}, 1, 1, 0,
+        rng=state.rng, sim_rng=state.sim_rng,
+    )
+    return game.replace_current_state(state)
+
+def draw_setup(reshuffle: bool) -> PlayerState:
+    if reshuffle:
+        return player_state(discard=DECK)
+    return player_state(shuffled=DECK)
+
+def buy_setup() -> BuyDecision:
+    return BuyDecision(game_with_hand((Gold, Silver, Copper, Estate, Estate)))
+
+def end_setup() -> Game:
+    game = game_with_hand(())
+    for card in (Province, Province, Curse):
+        game = game.remove_card(card)
+    return game
+
+def benchmarks() -> List[Benchmark]:
+    suite = [
+        Benchmark('PlayerState.draw(5)', lambda: draw_setup(False), lambda state: state.draw(5)),
+        Benchmark('PlayerState.draw(5) with reshuffle', lambda: draw_setup(True), lambda state: state.draw(5)),
+        Benchmark('PlayerState.play_action', lambda: player_state(hand=(Smithy, Copper, Copper, Estate, Silver)), lambda state: state.play_action(Smithy)),
+        Benchmark('Game.remove_card', lambda: game_with_hand(()), lambda game: game.remove_card(Silver)),
+        Benchmark('BuyDecision.choices', buy_setup, lambda decision: decision.choices()),
+    ]
+    for card in BASE_ACTIONS:
+        suite.append(Benchmark(
+            'Card.perform_action({0})'.format(card.name),
+            lambda card=card: game_with_hand((card, Copper, Copper, Estate, Curse)),
+            lambda game, card=card: card.perform_action(game),
+        ))
+    suite.extend([
+        Benchmark('Game.over', end_setup, lambda game: game.over()),
+        Benchmark('PlayerState.simulate_hands(10)', lambda: player_state(discard=DECK), lambda state: list(state.simulate_hands(10))),
+        Benchmark('exact_hands with a Smithy', lambda: dict(DECK), lambda counts: exact_hands(counts, (Gold,), lambda card: 1)),
+        Benchmark('PlayerState.simulate_hands(10) cached', lambda: (player_state(discard=DECK), HandCache()), lambda fixture: list(fixture[0].simulate_hands(10, (), fixture[1]))),
+    ])
+    return suite
+
+def measure_allocations(run: Callable[[Any], Any], fixture: Any, calls: int = 100) -> Tuple[float, float, int]:
+    """
+    The blocks and bytes left allocated by one call (keeping the results
+    alive), and the peak of the temporary allocations of one call.
+    """
+    tracemalloc.start()
+    try:
+        run(fixture)
+        results = []
+        before = tracemalloc.take_snapshot()
+        for _ in range(calls):
+            results.append(run(fixture))
+        after = tracemalloc.take_snapshot()
+        stats = after.compare_to(before, 'filename')
+        retained_blocks = sum(stat.count_diff for stat in stats) / calls
+        retained_bytes = sum(stat.size_diff for stat in stats) / calls
+        reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        run(fixture)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return retained_blocks, retained_bytes, peak - current
+
+def run_benchmark(benchmark: Benchmark, repeat: int = 5, duration: float = 0.2) -> BenchmarkResult:
+    fixture = benchmark.setup()
+    run = benchmark.run
+    timer = Timer(lambda: run(fixture))
+    # autorange picks a number of calls that takes at least 0.2 seconds,
+    # and warms the caches up on the way
+    number, _ = timer.autorange()
+    number = max(1, int(number * duration / 0.2))
+    timer.timeit(number)
+    runs = timer.repeat(repeat, number)
+    retained_blocks, retained_bytes, peak = measure_allocations(run, fixture)
+    return BenchmarkResult(benchmark.name, number, runs, retained_blocks, retained_bytes, peak)
+
+def run_suite(name_filter: str = '', repeat: int = 5, duration: float = 0.2) -> List[BenchmarkResult]:
+    return [
+        run_benchmark(benchmark, repeat, duration)
+        for benchmark in benchmarks()
+        if name_filter in benchmark.name
+    ]
+
+def report(results: List[BenchmarkResult], baseline: Optional[Dict[str, Any]] = None) -> str:
+    lines = ['{0:<45} {1:>12} {2:>12} {3:>8} {4:>10} {5:>10}{6}'.format(
+        'benchmark', 'ops/sec', 'median', 'blocks', 'bytes', 'peak', '  speedup' if baseline else '',
+    )]
+    for result in results:
+        speedup = ''
+        if baseline and result.name in baseline['results']:
+            speedup = '  {0:7.2f}x'.format(result.ops_per_sec() / baseline['results'][result.name]['ops_per_sec'])
+        lines.append('{0:<45} {1:>12,.0f} {2:>12,.0f} {3:>8.1f} {4:>10.0f} {5:>10}{6}'.format(
+            result.name, result.ops_per_sec(), result.median_ops_per_sec(),
+            result.retained_blocks, result.retained_bytes, result.peak_bytes, speedup,
+        ))
+    return '\n'.join(lines)
+
+def to_json(results: List[BenchmarkResult]) -> Dict[str, Any]:
+    return dict(
+        python=sys.version,
+        platform=platform.platform(),
+        results={result.name: result.to_json() for result in results},
+    )
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+
+    parser.add_argument('--filter', default='', help='Only run the benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+    parser.add_argument('--duration', type=float, default=0.2, help='Approximate seconds per timed run')
+    parser.add_argument('--output', default=None, help='Save the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='Show the speedup over the results in this JSON file')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    results = run_suite(args.filter, args.repeat, args.duration)
+    print(report(results, baseline))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(to_json(results), output_file, indent=2)
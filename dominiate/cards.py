@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Generator
 
 from game import Curse, Estate, Duchy, Province, Copper, Silver, Gold, NO_CARD
 from game import Card, TrashDecision, VoluntaryTrashDecision, DiscardDecision, GainDecision, Game
@@ -11,37 +11,32 @@ Festival = Card('Festival', 5, coins=2, actions=2, buys=1)
 Market = Card('Market', 5, coins=1, cards=1, actions=1, buys=1)
 Laboratory = Card('Laboratory', 5, cards=2, actions=1)
 
-def chapel_action(game: Game) -> Game:
-    newgame = game.current_player().make_decision(
-        game,
-        TrashDecision(game, minimum=0, maximum=4)
-    )
+# Effects that involve decisions are step generators: they yield each
+# decision and are sent back the resulting game.
+
+def chapel_action(game: Game) -> Generator[Any, Game, Game]:
+    newgame = yield TrashDecision(game, minimum=0, maximum=4)
     return newgame
 
-def cellar_action(game: Game) -> Game:
-    newgame = game.current_player().make_decision(
-        game,
-        DiscardDecision(game)
-    )
-    card_diff = game.state().hand_size() - newgame.state().hand_size()
+def cellar_action(game: Game) -> Generator[Any, Game, Game]:
+    hand_size = game.state().hand_size()
+    newgame = yield DiscardDecision(game)
+    card_diff = hand_size - newgame.state().hand_size()
     return newgame.replace_current_state(newgame.state().draw(card_diff))
 
-def warehouse_action(game: Game) -> Game:
-    newgame = game.current_player().make_decision(
-        game,
-        DiscardDecision(game, minimum=3, maximum=3)
-    )
+def warehouse_action(game: Game) -> Generator[Any, Game, Game]:
+    newgame = yield DiscardDecision(game, minimum=3, maximum=3)
     return newgame
 
 def council_room_action(game: Game) -> Game:
     return game.change_other_states(delta_cards=1)
 
-def militia_attack(game: Game) -> Game:
+def militia_attack(game: Game) -> Generator[Any, Game, Game]:
     return game.attack_with_decision(
         lambda game: DiscardDecision(game, minimum=2, maximum=2)
     )
 
-def witch_attack(game: Game) -> Game:
+def witch_attack(game: Game) -> Generator[Any, Game, Game]:
     return game.attack_with_decision(
         lambda game: GainDecision(game, card=Curse)
     )
@@ -58,7 +58,7 @@ class IdealistComboBot(BigMoney):
         BigMoney.__init__(self, 1, 2)
 
     def before_turn(self, game):
-        current_cards = game.state().all_cards()
+        current_counts = game.state().deck_counts
         priority = []
         needed = {}
         pending = False
@@ -69,7 +69,7 @@ class IdealistComboBot(BigMoney):
             else:
                 pending = True
         for card in needed:
-            needed[card] -= current_cards.count(card)
+            needed[card] -= current_counts.get(card, 0)
             if needed[card] > 0: priority.append(card)
 
         priority.sort(key=lambda card: (needed[card], card.cost))
@@ -84,11 +84,6 @@ class IdealistComboBot(BigMoney):
         else:
             return [None, Silver, Gold, Province] + self.strategy_priority
 
-    def make_buy_decision(self, decision):
-        choices = decision.choices()
-        choices.sort(key=lambda x: self.buy_priority(decision, x))
-        return choices[-1]
-
     def test(self):
         improvements = np.zeros((30,))
         counts = np.zeros((30,), dtype='int32')
@@ -99,7 +94,7 @@ class IdealistComboBot(BigMoney):
             # about to be shuffled
             while not (game.card_counts[Province] <= 1 or
                        (game.current_player().strategy_complete and
-                        len(game.state().drawpile) < 5)):
+                        game.state().draw_pile_size() < 5)):
                 game = game.take_turn()
                 turn_count += 1
                 assert game.round == turn_count
@@ -1,8 +1,9 @@
 from collections import defaultdict
 
-from game import BuyDecision, ActDecision, Game
-from players import Player
+from game import BuyDecision, ActDecision, Game, DEFAULT_HAND_SIZE, expand_counts
+from players import Player, BigMoney
 from basic_ai import HillClimbBot
+from handvalues import known_turn
 from cards import Province
 
 class DerivBot(HillClimbBot):
@@ -29,6 +30,41 @@ class DerivBot(HillClimbBot):
                     value += cardval
                     break
         return value
+    def substitutions(self, state, hand, cards):
+        """
+        Play out the hands made by putting each card in place of each card
+        of a hand, yielding the card, how many places it was put in, and the
+        (coins, buys) one of those hands ended with.
+
+        This is done in bulk, sharing what the hands have in common. The
+        order of the first DEFAULT_HAND_SIZE cards does not matter, so a card
+        put in place of any of the copies of a card among them makes the same
+        hand, played out once. Putting a card in its own place changes nothing,
+        and is skipped. The cards drawn after the hand come from one shuffle of
+        the deck, shared by all the hands, so each turn is worked out directly
+        from known cards (see handvalues.known_turn). Only the turns that play
+        actions with custom effects are simulated.
+        """
+        top = hand[:DEFAULT_HAND_SIZE]
+        places = defaultdict(list)
+        for i, replaced in enumerate(top):
+            places[replaced].append(i)
+        groups = [(indices[0], len(indices)) for indices in places.values()]
+        groups += [(i, 1) for i in range(len(top), len(hand))]
+        deck = list(expand_counts(state.deck_counts))
+        state.sim_rng.shuffle(deck)
+        deck = tuple(deck)
+        priority = self.exact_priority()
+        for card in cards:
+            for i, weight in groups:
+                if hand[i] == card:
+                    continue
+                newhand = hand[:i] + (card,) + hand[i+1:]
+                outcome = known_turn(newhand + deck, priority)
+                if outcome is None:
+                    for outcome in state.simulate_hands(1, newhand):
+                        pass
+                yield card, weight, outcome
     def update_values(self, game):
         # 0th order and initialization
         for card in game.card_choices():
@@ -47,6 +83,7 @@ class DerivBot(HillClimbBot):
                     game.card_counts,
                     turn=0,
                     simulated=True,
+                    rng=game.state().sim_rng,
                 )
                 state = game.simulate_partial_turn()
                 hand = state.tableau + state.hand
@@ -60,35 +97,29 @@ class DerivBot(HillClimbBot):
 
                 n = len(hand)
                 avg_hand_size += float(n) / self.k / 2
-                for card in game.card_choices():
-                    for i in range(len(hand)):
-                        newhand = hand[:i] + (card,) + hand[i+1:]
-
-                        # Only one simulation step will be necessary, most of the time.
-                        # The only variance comes in if we draw extra cards.
-                        for coins, buys in state.simulate_hands(1, newhand):
-                            value = self.buy_value(coins, buys, prev_order) - actual_value
-                            self.values[deriv][card] += float(value) / self.k / n
+                for card, weight, (coins, buys) in self.substitutions(state, hand, game.card_choices()):
+                    value = self.buy_value(coins, buys, prev_order) - actual_value
+                    self.values[deriv][card] += weight * float(value) / self.k / n
                 # TODO: take into account cards you gain/trash
 
         # turns_left = provinces_left / (provinces/turn)
         if avg_provinces == 0.0: avg_provinces = 0.1
         turns_left_in_game = (game.card_counts[Province] /
           ((avg_provinces+0.5) * game.num_players()))
-        print("Estimated turns left:", turns_left_in_game)
+        self.log.debug("Estimated turns left: %s" % turns_left_in_game)
 
         # reshuffles = (cards/turn) / (cards/deck) * turns_left
-        reshuffles_left = (avg_hand_size / len(game.state().all_cards()) *
+        reshuffles_left = (avg_hand_size / game.state().deck_size() *
           turns_left_in_game)
 
         # compensate for cards in deck
         reshuffles_left -= \
-          float(len(game.state().drawpile)) / game.state().deck_size()
+          float(game.state().draw_pile_size()) / game.state().deck_size()
 
         factors = [1.0, 0.0, 0.0]
         factors[1] = max(reshuffles_left, 0)
         factors[2] = max(reshuffles_left * (reshuffles_left-1)/2, 0)
-        print("%12s  % 7.3f % 7.3f % 7.3f" % (('',) + tuple(factors)))
+        self.log.debug("%12s  % 7.3f % 7.3f % 7.3f" % (('',) + tuple(factors)))
         for card in game.card_choices():
             weighted_values = [0, 0, 0]
             for order in range(3):
@@ -110,7 +141,7 @@ class DerivBot(HillClimbBot):
                 # So add another 12 for good measure.
                 totalvalue += 12.0
             self.current_values[card] = totalvalue
-            print("%12s: % 7.3f % 7.3f % 7.3f  % 7.3f % 7.3f % 7.3f % 7.3f" %\
+            self.log.debug("%12s: % 7.3f % 7.3f % 7.3f  % 7.3f % 7.3f % 7.3f % 7.3f" %\
               (card, self.values[0][card], self.values[1][card],
                self.values[2][card], self.averages[0][card],
                self.averages[1][card], self.averages[2][card], totalvalue))
@@ -120,14 +151,12 @@ class DerivBot(HillClimbBot):
         if card is None: return 0.0
         else: return self.current_values[card]
 
-    def make_buy_decision(self, decision):
-        print("BuyDecision (%d coins): hand is %s" % (
+    def make_buy_decision(self, game, decision):
+        self.log.debug("BuyDecision (%d coins): hand is %s" % (
           decision.state().hand_value(), decision.state().hand
         ))
-        print("Deck is now:", sorted(decision.game.state().all_cards()))
-        choices = decision.choices()
-        choices.sort(key=lambda x: self.buy_priority(decision, x))
-        return choices[-1]
+        self.log.debug("Deck is now: %s" % sorted(decision.game.state().all_cards(), key=str))
+        return BigMoney.make_buy_decision(self, game, decision)
 
     def before_turn(self, game):
         self.update_values(game)
@@ -5,6 +5,7 @@ from players import *
 from basic_ai import *
 from combobot import *
 from cards import BASE_ACTIONS
+from events import EventLogger
 
 def human_game():
     player1 = smithyComboBot
@@ -18,4 +19,5 @@ def human_game():
     return game.run()
 
 if __name__ == '__main__':
+    EventLogger().attach()
     human_game()
@@ -0,0 +1,172 @@
+"""
+The engine's event bus.
+
+The engine publishes typed events (a turn starts, a card is played, bought,
+gained, trashed or discarded, an attack hits, the game ends) to the EventBus
+of the game. Logging, profiling and replay tools subscribe to the events they
+need. The engine only builds an event when some handler is subscribed to its
+type, so an idle bus costs a dictionary lookup per event.
+"""
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+class TurnStart(NamedTuple):
+    game: Any
+
+class Play(NamedTuple):
+    game: Any
+    player: Any
+    card: Any  # NO_CARD when the player stops playing actions
+
+class Buy(NamedTuple):
+    game: Any
+    player: Any
+    card: Any  # NO_CARD when the player stops buying
+    coins: int
+    buys: int
+    hand: Tuple[Any, ...]
+
+class Gain(NamedTuple):
+    game: Any
+    player: Any
+    cards: Sequence[Any]  # empty when the player gains nothing
+
+class Trash(NamedTuple):
+    game: Any
+    player: Any
+    cards: Sequence[Any]
+
+class Discard(NamedTuple):
+    game: Any
+    player: Any
+    cards: Sequence[Any]
+
+class Attack(NamedTuple):
+    game: Any
+    attacker: Any
+    target: Any
+    defended: bool
+
+class GameEnd(NamedTuple):
+    game: Any
+    scores: List[Tuple[Any, int]]
+
+EVENT_TYPES = (TurnStart, Play, Buy, Gain, Trash, Discard, Attack, GameEnd)
+
+class EventBus(object):
+    """
+    Dispatches engine events to the handlers subscribed to their type.
+
+    Publishers check `EventType in bus.handlers` before building an event, so
+    that nothing is built when nobody listens. Types without handlers are
+    removed from `handlers` to keep that check cheap.
+    """
+    def __init__(self) -> None:
+        self.handlers: Dict[type, List[Callable[[Any], None]]] = {}
+
+    def subscribe(self, event_type: type, handler: Callable[[Any], None]) -> None:
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def unsubscribe(self, event_type: type, handler: Callable[[Any], None]) -> None:
+        handlers = self.handlers[event_type]
+        handlers.remove(handler)
+        if not handlers:
+            del self.handlers[event_type]
+
+    def publish(self, event: Any) -> None:
+        for handler in self.handlers.get(type(event), ()):
+            handler(event)
+
+# The bus of real games, and the bus of simulated games (see Game.simulated).
+EVENTS = EventBus()
+SIMULATION_EVENTS = EventBus()
+
+class EventLogger(object):
+    """
+    Writes engine events to the 'Game' log at the INFO level, the way the
+    engine itself used to log games.
+    """
+    def __init__(self, log: Optional[logging.Logger] = None) -> None:
+        self.log = logging.getLogger('Game') if log is None else log
+        self.log.setLevel(logging.INFO)
+
+    def subscriptions(self) -> List[Tuple[type, Callable[[Any], None]]]:
+        return [
+            (TurnStart, self.turn_start),
+            (Play, self.play),
+            (Buy, self.buy),
+            (Gain, self.gain),
+            (Trash, self.trash),
+            (Discard, self.discard),
+            (Attack, self.attack),
+            (GameEnd, self.game_end),
+        ]
+
+    def attach(self, bus: EventBus = EVENTS) -> 'EventLogger':
+        for event_type, handler in self.subscriptions():
+            bus.subscribe(event_type, handler)
+        return self
+
+    def detach(self, bus: EventBus = EVENTS) -> None:
+        for event_type, handler in self.subscriptions():
+            bus.unsubscribe(event_type, handler)
+
+    def turn_start(self, event: TurnStart) -> None:
+        game = event.game
+        state = game.state()
+        self.log.info("")
+        self.log.info("Round %d / player %d: %s (vp=%d, money_density=%.1f, action_density=%.1f, mean_money=%.1f)" % (
+            game.round + 1,
+            game.player_turn + 1,
+            game.current_player().name,
+            state.score(),
+            state.money_density(),
+            state.action_density(),
+            state.mean_money_per_turn(),
+        ))
+
+    def play(self, event: Play) -> None:
+        self.log.info("%s plays %s" % (event.player.name, event.card))
+
+    def buy(self, event: Buy) -> None:
+        self.log.info(
+            "{player} buys {cards} (coins={coins}, buys={buys}, hand={hand})".format(
+                player=event.player.name,
+                cards=event.card,
+                coins=event.coins,
+                buys=event.buys,
+                hand=event.hand,
+            ),
+        )
+
+    def gain(self, event: Gain) -> None:
+        if not event.cards:
+            return
+        self.log.info('Player {0} gains {1}'.format(event.player, ','.join(map(str, event.cards))))
+
+    def trash(self, event: Trash) -> None:
+        self.log.info("%s trashes %s" % (event.player.name, event.cards))
+
+    def discard(self, event: Discard) -> None:
+        self.log.info("%s discards %s" % (event.player.name, event.cards))
+
+    def attack(self, event: Attack) -> None:
+        if event.defended:
+            self.log.info('Player {0} is defended'.format(event.target))
+
+    def game_end(self, event: GameEnd) -> None:
+        game = event.game
+        self.log.info(
+            "End of game (finished_piles: {0})".format(
+                [card for (card, count) in game.card_counts.items() if count == 0],
+            )
+        )
+        self.log.info(
+            'Finish decks: {0}'.format(
+                {
+                    state.player: state.card_counts()
+                    for state in game.playerstates
+                }
+            ),
+        )
+        self.log.info("Scores: %s" % event.scores)
@@ -1,22 +1,139 @@
 import random
 import logging
-from typing import List, Optional, Union, Callable, Union, Sequence, Any, Dict
+from typing import List, Optional, Union, Callable, Union, Sequence, Any, Dict, Tuple, NamedTuple, Generator
 from sys import maxsize
-from itertools import groupby
+from bisect import bisect_right
+from collections import OrderedDict
+
+from persistent import PVector, PList, EMPTY_PLIST
+from events import EventBus, EVENTS, SIMULATION_EVENTS, TurnStart, Play, Buy, Gain, Trash, Discard, Attack, GameEnd
 
-mainLog = logging.getLogger(__name__)
 logging.basicConfig(level=logging.WARN, format='%(levelname)s: %(message)s')
 
 INF = maxsize
 
-EFFECT = Callable[['Game'], 'Game']
+# Set to True to recompute the running deck statistics of every new
+# PlayerState from scratch and check them against the maintained totals.
+CHECK_DECK_STATS = False
+
+class RandomStream(random.Random):
+    """
+    A random generator that also hands out uniform integers from a buffer of
+    pre-generated random words, for drawing cards one at a time (see
+    PlayerState.draw).
+
+    below(n) scales a word to range(n) (rejecting the few words that would
+    make some results likelier than others), so the same word gives nearby
+    results for nearby values of n. Games that share a stream (see
+    paired.py) therefore draw alike even when their decks differ a little.
+    """
+    BUFFER_SIZE = 256
+    BITS = 32
+    WORD = 1 << BITS
+
+    def seed(self, *args, **kwargs) -> None:
+        super().seed(*args, **kwargs)
+        self.buffer: List[int] = []
+
+    def refill(self) -> None:
+        "Fill the buffer with BUFFER_SIZE random words."
+        getrandbits = self.getrandbits
+        self.buffer.extend([getrandbits(32) for _ in range(self.BUFFER_SIZE)])
+
+    def below(self, n: int) -> int:
+        "Return a uniformly random integer in range(n)."
+        buffer = self.buffer
+        while True:
+            if not buffer:
+                self.refill()
+            scaled = buffer.pop() * n
+            # reject the words whose low part falls in the first
+            # WORD % n values, so that every index is equally likely
+            if (scaled & (self.WORD - 1)) < n and (scaled & (self.WORD - 1)) < (self.WORD - n) % n:
+                continue
+            return scaled >> self.BITS
+
+# Randomness comes from per-game streams (see random_stream), so that a game
+# is reproducible from its seed and game index alone. States and games built
+# without a stream share GLOBAL_STREAM.
+GLOBAL_STREAM = RandomStream()
+
+def random_stream(seed: Any, *path: Any) -> RandomStream:
+    """
+    Get the random generator identified by a master seed and a path, such as
+    (game_index, 'seat', 0). Streams with different paths are independent,
+    and the same seed and path give the same stream on any machine or worker.
+    """
+    return RandomStream(':'.join(map(str, (seed,) + path)))
+
+# A step generator yields the Decisions to be made, is sent the Game that
+# results from each of them, and finally returns the resulting Game.
+STEPS = Generator['Decision', 'Game', 'Game']
+
+# An effect returns the resulting Game, or a step generator if it involves
+# decisions.
+EFFECT = Callable[['Game'], Union['Game', STEPS]]
+
+# The card registry. Every Card gets a small integer id when it is defined,
+# and its attributes are copied into flat tables indexed by that id, so hot
+# loops can look up CARD_TREASURE[card.id] or IS_ACTION[card.id] instead of
+# calling methods.
+CARDS: List['Card'] = []
+CARD_COST: List[int] = []
+CARD_TREASURE: List[int] = []
+CARD_VP: List[int] = []
+CARD_COINS: List[int] = []
+CARD_CARDS: List[int] = []
+CARD_ACTIONS: List[int] = []
+CARD_BUYS: List[int] = []
+IS_ACTION: List[bool] = []
+IS_VANILLA: List[bool] = []  # actions without an effect, resolved in one step
+IS_VICTORY: List[bool] = []
+IS_PURE_VICTORY: List[bool] = []
+IS_CURSE: List[bool] = []
+IS_TREASURE: List[bool] = []
+IS_ATTACK: List[bool] = []
+IS_DEFENSE: List[bool] = []
+
+def register_card(card: 'Card') -> int:
+    """
+    Give a card the next free id and record its attributes in the card
+    tables. Returns the id.
+    """
+    card_id = len(CARDS)
+    is_action = any((card.coins, card.cards, card.actions, card.buys, card.effect))
+    CARDS.append(card)
+    CARD_COST.append(card.cost)
+    CARD_TREASURE.append(card.treasure)
+    CARD_VP.append(card.vp)
+    CARD_COINS.append(card.coins)
+    CARD_CARDS.append(card.cards)
+    CARD_ACTIONS.append(card.actions)
+    CARD_BUYS.append(card.buys)
+    IS_ACTION.append(is_action)
+    IS_VANILLA.append(is_action and not card.effect)
+    IS_VICTORY.append(card.vp > 0)
+    IS_PURE_VICTORY.append(card.vp > 0 and not is_action and not card.treasure > 0)
+    IS_CURSE.append(card.vp < 0)
+    IS_TREASURE.append(card.treasure > 0)
+    IS_ATTACK.append(card._isAttack)
+    IS_DEFENSE.append(card._isDefense)
+    return card_id
+
+def card_id(card: 'Card') -> int:
+    return card.id
+
+def registered_card(card_id: int) -> 'Card':
+    "Get a card from its id."
+    return CARDS[card_id]
 
 class Card(object):
     """
     Represents a class of card.
 
     To save computation, only one of each card should be constructed. Decks can
-    contain many references to the same Card object.
+    contain many references to the same Card object. Each card is registered
+    on construction (see register_card) and identified by its integer id.
     """
     def __init__(
         self,
@@ -58,48 +175,56 @@ class Card(object):
             self.effect = effect
         self.reaction = reaction
         self.duration = duration
+        self.id = register_card(self)
+
+    def __reduce__(self):
+        # Cards are compared by identity, so a pickled card (sent to a worker
+        # process, say) must come back as the registered card, not a copy.
+        return (registered_card, (self.id,))
 
     def is_victory(self) -> bool:
-        return self.vp > 0
+        return IS_VICTORY[self.id]
 
     def is_pure_victory(self) -> bool:
-        return self.is_victory() and not self.is_action() and self.is_treasure()
+        return IS_PURE_VICTORY[self.id]
 
     def is_curse(self) -> bool:
-        return self.vp < 0
+        return IS_CURSE[self.id]
 
-    def is_treasure(self):
-        return self.treasure > 0
+    def is_treasure(self) -> bool:
+        return IS_TREASURE[self.id]
 
     def is_action(self) -> bool:
-        return any(
-            [
-                self.coins,
-                self.cards,
-                self.actions,
-                self.buys,
-                self.effect,
-            ]
-        )
+        return IS_ACTION[self.id]
 
     def is_attack(self) -> bool:
-        return self._isAttack
+        return IS_ATTACK[self.id]
 
     def is_defense(self) -> bool:
-        return self._isDefense
+        return IS_DEFENSE[self.id]
 
     def perform_action(self, game):
-        assert self.is_action()
-        if self.cards:
-            game = game.current_draw_cards(self.cards)
-        if (self.coins or self.actions or self.buys):
-            game = game.change_current_state(
-              delta_coins=self.coins,
-              delta_actions=self.actions,
-              delta_buys=self.buys
-            )
-        for action in self.effect:
-            game = action(game)
+        """
+        Put this action into effect, letting players make any decisions it
+        involves.
+        """
+        assert IS_ACTION[self.id]
+        game = game.replace_current_state(game.state().resolve_vanilla_action(self))
+        if IS_VANILLA[self.id]:
+            return game
+        return play_steps(self.effect_steps(game))
+
+    def effect_steps(self, game) -> STEPS:
+        """
+        Step generator running this card's effects (but not its draws and
+        counters, see PlayerState.resolve_vanilla_action).
+        """
+        for effect in self.effect:
+            result = effect(game)
+            if isinstance(result, Game):
+                game = result
+            else:
+                game = yield from result
         return game
 
     def __str__(self) -> str:
@@ -129,31 +254,326 @@ NO_CARD = None
 DEFAULT_HAND_SIZE = 5
 STARTING_HAND = (Copper,)*7 + (Estate,)*3
 
+CardCounts = Dict[Card, int]
+
+def count_cards(cards: Sequence[Card]) -> CardCounts:
+    """
+    Build a count vector (a dictionary mapping each distinct card to the
+    number of copies) from a sequence of cards.
+    """
+    counts: CardCounts = {}
+    for card in cards:
+        counts[card] = counts.get(card, 0) + 1
+    return counts
+
+def add_counts(counts: CardCounts, cards: Sequence[Card]) -> CardCounts:
+    "Return a new count vector with some cards added."
+    newcounts = counts.copy()
+    for card in cards:
+        newcounts[card] = newcounts.get(card, 0) + 1
+    return newcounts
+
+def merge_counts(counts: CardCounts, other: CardCounts) -> CardCounts:
+    "Return a new count vector holding the cards of both count vectors."
+    if not other:
+        return counts
+    newcounts = counts.copy()
+    for card, count in other.items():
+        newcounts[card] = newcounts.get(card, 0) + count
+    return newcounts
+
+def remove_count(counts: CardCounts, card: Card) -> CardCounts:
+    """
+    Return a new count vector with a single copy of a card removed. Cards
+    that run out are dropped, so the vector only holds cards that are there.
+    """
+    newcounts = counts.copy()
+    left = newcounts[card] - 1
+    assert left >= 0, (card, counts)
+    if left:
+        newcounts[card] = left
+    else:
+        del newcounts[card]
+    return newcounts
+
+def expand_counts(counts: CardCounts) -> Tuple[Card, ...]:
+    "List every card in a count vector, grouped by card."
+    cards: List[Card] = []
+    for card, count in counts.items():
+        cards.extend((card,) * count)
+    return tuple(cards)
+
+def deck_signature(counts: CardCounts) -> Tuple[Tuple[int, int], ...]:
+    "A canonical, hashable form of a count vector: its (card id, count) pairs in card id order."
+    return tuple(sorted((card.id, count) for card, count in counts.items() if count))
+
+class HandSample(object):
+    """
+    The hands simulated so far out of n for a deck with certain cards on top
+    (see PlayerState.hand_sample): how many ended with each (coins, buys),
+    and the stream the rest are simulated with. A sample can be left off
+    and taken up again later, and still holds the hands simulating all n in
+    one go would.
+    """
+    def __init__(self, n: int, stream: RandomStream) -> None:
+        self.n = n
+        self.stream: Optional[RandomStream] = stream
+        self.hands: Dict[Tuple[int, int], int] = {}
+        self.count = 0
+
+    def complete(self) -> bool:
+        return self.count >= self.n
+
+    def simulate(self, state: 'PlayerState', cards: Sequence['Card'] = ()) -> Tuple[int, int]:
+        "Simulate the next hand of the deck of a state with the cards on top, and add it."
+        hand = state.simulate_hand(cards, self.stream)
+        self.hands[hand] = self.hands.get(hand, 0) + 1
+        self.count += 1
+        if self.count >= self.n:
+            # keep no stream in complete samples
+            self.stream = None
+        return hand
+
+    def total(self, value: Callable[[int, int], float]) -> float:
+        "The total of a function of (coins, buys) over the hands so far."
+        return sum(value(coins, buys) * count for (coins, buys), count in self.hands.items())
+
+class HandCache(object):
+    """
+    A bounded cache of the hands simulated by PlayerState.simulate_hands.
+    The hands a deck makes depend only on the cards in it, the cards put on
+    top of it and the player's decisions, so the cache keeps a HandSample of
+    them under the deck signature, the cards on top and the number of hands.
+    A sample is cached as soon as it is started, and holds however many
+    hands were simulated when its simulation was cut short. The cache holds
+    at most `size` entries, and evicts the least recently used.
+
+    handvalues.cached_exact_hands also keeps the exact distributions it works
+    out in a HandCache, as probabilities of each (coins, buys).
+
+    The hands depend on the player, so a cache should only be used for the
+    simulations of one player. The hands of a deck are simulated on a stream
+    of their own, identified by the cache's seed and the key (see stream),
+    rather than on the player's random stream. So the cached hands are the
+    ones simulating them again would give, and games come out the same
+    whatever was cached before them.
+    """
+    def __init__(self, size: int = 1024, seed: Any = 0) -> None:
+        self.size = size
+        self.seed = seed
+        self.entries: 'OrderedDict[Any, Any]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Any) -> Any:
+        distribution = self.entries.get(key)
+        if distribution is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return distribution
+
+    def put(self, key: Any, distribution: Any) -> None:
+        self.entries[key] = distribution
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def stream(self, key: Any) -> RandomStream:
+        "The random stream the hands under a key are simulated with."
+        return random_stream(self.seed, 'hands', *key)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self) -> str:
+        return 'HandCache(%d/%d entries, %d hits, %d misses)' % (len(self.entries), self.size, self.hits, self.misses)
+
+class Journal(object):
+    """
+    The undo journal of a game that is played in place (see Game.setup).
+
+    In-place games mutate their Game and PlayerState objects instead of
+    building new ones. While at least one checkpoint is open, every mutation
+    records the value it overwrote, so that the game can be rolled back to
+    the checkpoint. With no open checkpoint nothing is recorded, which keeps
+    bulk runs free of journaling overhead.
+
+    Rolling back does not rewind the random streams of the game.
+    """
+    def __init__(self) -> None:
+        self.entries: List[Tuple[Any, Any, Any]] = []
+        self.open_checkpoints = 0
+
+    def checkpoint(self) -> int:
+        "Open a checkpoint and return its mark."
+        self.open_checkpoints += 1
+        return len(self.entries)
+
+    def record(self, container, key) -> None:
+        "Remember the current value of container[key] before it changes."
+        if self.open_checkpoints:
+            self.entries.append((container, key, container[key]))
+
+    def rollback(self, mark: int) -> None:
+        "Undo every change made since the checkpoint, and close it."
+        assert self.open_checkpoints > 0, 'No checkpoint to roll back to'
+        entries = self.entries
+        while len(entries) > mark:
+            container, key, value = entries.pop()
+            container[key] = value
+        self.release(mark)
+
+    def release(self, mark: int) -> None:
+        "Close a checkpoint, keeping the changes made since."
+        assert self.open_checkpoints > 0, 'No checkpoint to release'
+        self.open_checkpoints -= 1
+        if not self.open_checkpoints:
+            del self.entries[:]
+
+class DeckStats(NamedTuple):
+    """
+    Running totals over a whole deck, maintained incrementally as cards are
+    gained and trashed so that deck-wide metrics are constant-time reads.
+    """
+    vp: int
+    money: int    # treasure plus +coins
+    draws: int    # +cards on action cards
+    actions: int  # number of action cards
+    size: int
+
+    @staticmethod
+    def of(counts: CardCounts) -> 'DeckStats':
+        "Compute the statistics of a count vector from scratch."
+        return DeckStats(0, 0, 0, 0, 0).add(expand_counts(counts))
+
+    def add(self, cards: Sequence[Card]) -> 'DeckStats':
+        vp, money, draws, actions, size = self
+        for card in cards:
+            card_id = card.id
+            vp += CARD_VP[card_id]
+            money += CARD_TREASURE[card_id] + CARD_COINS[card_id]
+            if IS_ACTION[card_id]:
+                draws += CARD_CARDS[card_id]
+                actions += 1
+            size += 1
+        return DeckStats(vp, money, draws, actions, size)
+
+    def remove(self, card: Card) -> 'DeckStats':
+        card_id = card.id
+        is_action = IS_ACTION[card_id]
+        return DeckStats(
+            self.vp - CARD_VP[card_id],
+            self.money - CARD_TREASURE[card_id] - CARD_COINS[card_id],
+            self.draws - (CARD_CARDS[card_id] if is_action else 0),
+            self.actions - (1 if is_action else 0),
+            self.size - 1,
+        )
+
 class PlayerState(object):
     """
     A PlayerState represents all the game state that is particular to a player,
     including the number of actions, buys, and +coins they have.
+
+    Only the hand and the drawpile are ordered. The discard pile, the tableau
+    and the deck as a whole are count vectors (see count_cards), so that
+    questions about the whole deck take time proportional to the number of
+    distinct cards rather than to the size of the deck.
+
+    The draw pile is the drawpile tuple, the cards known to be on top in
+    order, followed by the shuffled_counts count vector, the rest of the pile
+    in an order that has not been decided yet. Reshuffling just turns the
+    discard pile into shuffled_counts, and drawing samples from it one card
+    at a time, which gives the same cards as shuffling and drawing from the
+    top without ever building the permutation.
+
+    PlayerStates are normally immutable: every transition returns a new state.
+    States of in-place games carry the game's Journal, and their transitions
+    mutate and return the state itself instead.
+
+    Each state carries the random stream its deck is shuffled with (rng), and
+    the one its player's simulations are shuffled with (sim_rng), so that
+    however much a bot simulates, the real shuffles of its seat stay the same.
     """
-    def __init__(self, player, hand, drawpile, discard, tableau, actions: int = 0, buys: int = 0, coins: int = 0) -> None:
+    def __init__(self, player, hand, drawpile, discard_counts, tableau_counts, actions: int = 0, buys: int = 0, coins: int = 0, deck_counts: Optional[CardCounts] = None, stats: Optional[DeckStats] = None, journal: Optional[Journal] = None, rng: RandomStream = GLOBAL_STREAM, sim_rng: RandomStream = GLOBAL_STREAM, shuffled_counts: Optional[CardCounts] = None) -> None:
         self.player = player
+        self.journal = journal
+        self.rng = rng
+        self.sim_rng = sim_rng
         self.actions = actions;   assert isinstance(self.actions, int)
         self.buys = buys;         assert isinstance(self.buys, int)
         self.coins = coins;       assert isinstance(self.coins, int)
         self.hand = hand;         assert isinstance(self.hand, tuple)
         self.drawpile = drawpile; assert isinstance(self.drawpile, tuple)
-        self.discard = discard;   assert isinstance(self.discard, tuple)
-        self.tableau = tableau;   assert isinstance(self.tableau, tuple)
+        self.discard_counts = discard_counts; assert isinstance(self.discard_counts, dict)
+        self.tableau_counts = tableau_counts; assert isinstance(self.tableau_counts, dict)
+        self.shuffled_counts = {} if shuffled_counts is None else shuffled_counts
+        if deck_counts is None:
+            deck_counts = merge_counts(
+                merge_counts(
+                    merge_counts(count_cards(self.hand + self.drawpile), self.discard_counts),
+                    self.tableau_counts,
+                ),
+                self.shuffled_counts,
+            )
+        self.deck_counts = deck_counts
+        if stats is None:
+            stats = DeckStats.of(deck_counts)
+        self.stats = stats
+        if CHECK_DECK_STATS:
+            self.check_stats()
         # TODO: duration cards
 
+    def _update(self, **changes) -> 'PlayerState':
+        """
+        Return the state with some attributes replaced: a new state, or this
+        very state (journaling the old values) if it belongs to an in-place
+        game.
+        """
+        journal = self.journal
+        if journal is None:
+            state = PlayerState.__new__(PlayerState)
+            state.__dict__.update(self.__dict__)
+        else:
+            state = self
+            if journal.open_checkpoints:
+                for key in changes:
+                    journal.record(self.__dict__, key)
+        state.__dict__.update(changes)
+        if CHECK_DECK_STATS:
+            state.check_stats()
+        return state
+
+    def check_stats(self) -> None:
+        "Make sure the running deck statistics match the deck."
+        expected = DeckStats.of(self.deck_counts)
+        assert self.stats == expected, (self.stats, expected)
+
+    @property
+    def discard(self) -> Tuple[Card, ...]:
+        return expand_counts(self.discard_counts)
+
+    @property
+    def tableau(self) -> Tuple[Card, ...]:
+        return expand_counts(self.tableau_counts)
+
     @staticmethod
-    def initial_state(player):
+    def initial_state(player, journal: Optional[Journal] = None, rng: RandomStream = GLOBAL_STREAM, sim_rng: RandomStream = GLOBAL_STREAM, starting_deck: Sequence[Card] = STARTING_HAND):
         # put it all in the discard pile so it auto-shuffles, then draw
         return PlayerState(
             player,
             hand=(),
             drawpile=(),
-            discard=STARTING_HAND,
-            tableau=(),
+            discard_counts=count_cards(starting_deck),
+            tableau_counts={},
+            journal=journal,
+            rng=rng,
+            sim_rng=sim_rng,
         ).next_turn()
 
     def change(self, delta_actions: int = 0, delta_buys: int = 0, delta_cards: int = 0, delta_coins: int = 0):
@@ -161,9 +581,11 @@ class PlayerState(object):
         Change the number of actions, buys, cards, or coins available on this
         turn.
         """
-        state= PlayerState(self.player, self.hand, self.drawpile, self.discard,
-                           self.tableau, self.actions+delta_actions,
-                           self.buys+delta_buys, self.coins+delta_coins)
+        state = self._update(
+            actions=self.actions+delta_actions,
+            buys=self.buys+delta_buys,
+            coins=self.coins+delta_coins,
+        )
         assert delta_cards >= 0
         if delta_cards > 0:
             return state.draw(delta_cards)
@@ -171,37 +593,35 @@ class PlayerState(object):
             return state
 
     def deck_size(self) -> int:
-        return len(self.all_cards())
+        return self.stats.size
 
     def __len__(self) -> int:
         return self.deck_size()
 
-    def all_cards(self) -> List[Card]:
-        return self.hand + self.tableau + self.drawpile + self.discard
-
-    def card_counts(self) -> Dict[Card, int]:
-        on_name = lambda x: x.name
+    def all_cards(self) -> Tuple[Card, ...]:
+        return expand_counts(self.deck_counts)
 
+    def card_counts(self) -> Dict[str, int]:
         return {
-            key: len(list(group))
-            for (key, group) in groupby(
-                sorted(
-                    self.all_cards(),
-                    key=on_name,
-                ),
-                key=on_name,
+            card.name: count
+            for (card, count) in sorted(
+                self.deck_counts.items(),
+                key=lambda item: item[0].name,
             )
         }
 
     def hand_value(self) -> int:
         """How many coins can the player spend?"""
-        return self.coins + sum(card.treasure for card in self.hand)
+        return self.coins + sum([CARD_TREASURE[card.id] for card in self.hand])
 
     def hand_size(self) -> int:
         return len(self.hand)
 
     def is_defended(self) -> bool:
-        return any(card.is_defense() for card in self.hand)
+        for card in self.hand:
+            if IS_DEFENSE[card.id]:
+                return True
+        return False
 
     def get_reactions(self):
         """
@@ -214,61 +634,93 @@ class PlayerState(object):
         Returns a new PlayerState in which n cards have been drawn (shuffling
         if necessary).
         """
-        if len(self.drawpile) >= n:
-            return PlayerState(
-              self.player, self.hand+self.drawpile[:n], self.drawpile[n:],
-              self.discard, self.tableau, self.actions, self.buys, self.coins
-            )
-        elif self.discard:
-            got = self.drawpile
-            newdraw = list(self.discard)
-            random.shuffle(newdraw)
-
-            state2 = PlayerState(
-              self.player, self.hand+got, tuple(newdraw), (), self.tableau,
-              self.actions, self.buys, self.coins
-            )
-            return state2.draw(n-len(got))
-        else:
-            return PlayerState(
-              self.player, self.hand+self.drawpile, (), (), self.tableau,
-              self.actions, self.buys, self.coins
-            )
+        return self._update(**self._draw_changes(self.hand, n))
+
+    def _draw_changes(self, hand, n) -> Dict[str, Any]:
+        """
+        Work out the changes to draw n cards into a given hand, for
+        _update().
+        """
+        drawpile = self.drawpile
+        if len(drawpile) >= n:
+            return dict(hand=hand+drawpile[:n], drawpile=drawpile[n:])
+        # Draw the known cards, then sample the rest from shuffled_counts,
+        # reshuffling the discard pile into it if it runs out.
+        n -= len(drawpile)
+        drawn = list(hand + drawpile)
+        counts = self.shuffled_counts.copy()
+        discard_counts = self.discard_counts
+        rng = self.rng
+        buffer = rng.buffer
+        mask = rng.WORD - 1
+        bits = rng.BITS
+        size = sum(counts.values())
+        while n:
+            if not size:
+                if not discard_counts:
+                    break
+                # in card id order, so that the same random words draw the
+                # same cards from the same counts (see RandomStream)
+                counts = {card: discard_counts[card] for card in sorted(discard_counts, key=card_id)}
+                discard_counts = {}
+                size = sum(counts.values())
+            # RandomStream.below(size), inlined
+            if not buffer:
+                rng.refill()
+            scaled = buffer.pop() * size
+            if (scaled & mask) < size and (scaled & mask) < (mask + 1 - size) % size:
+                continue
+            index = scaled >> bits
+            for card in counts:
+                count = counts[card]
+                if index < count:
+                    break
+                index -= count
+            if count == 1:
+                del counts[card]
+            else:
+                counts[card] = count - 1
+            drawn.append(card)
+            size -= 1
+            n -= 1
+        return dict(
+            hand=tuple(drawn),
+            drawpile=(),
+            shuffled_counts=counts,
+            discard_counts=discard_counts,
+        )
+
+    def draw_pile_size(self) -> int:
+        "How many cards are left to draw before reshuffling?"
+        return len(self.drawpile) + sum(self.shuffled_counts.values())
 
     def next_turn(self):
         """
         First, discard everything. Then, get 5 (DEFAULT_HAND_SIZE) cards, 1 action, and 1 buy.
         """
-        return PlayerState(
-          self.player, (), self.drawpile, self.discard+self.hand+self.tableau,
-          (), actions=1, buys=1, coins=0
+        return self._update(
+            hand=(),
+            discard_counts=merge_counts(add_counts(self.discard_counts, self.hand), self.tableau_counts),
+            tableau_counts={},
+            actions=1,
+            buys=1,
+            coins=0,
         ).draw(DEFAULT_HAND_SIZE)
 
     def gain(self, card):
         "Gain a single card."
-        return PlayerState(
-            self.player,
-            self.hand,
-            self.drawpile,
-            self.discard + (card,),
-            self.tableau,
-            self.actions,
-            self.buys,
-            self.coins
+        return self._update(
+            discard_counts=add_counts(self.discard_counts, (card,)),
+            deck_counts=add_counts(self.deck_counts, (card,)),
+            stats=self.stats.add((card,)),
         )
 
     def gain_cards(self, cards):
         "Gain multiple cards."
-        self.player.log.info('Player {0} gains {1}'.format(self.player, ','.join(map(str, cards))))
-        return PlayerState(
-            self.player,
-            self.hand,
-            self.drawpile,
-            self.discard + cards,
-            self.tableau,
-            self.actions,
-            self.buys,
-            self.coins,
+        return self._update(
+            discard_counts=add_counts(self.discard_counts, cards),
+            deck_counts=add_counts(self.deck_counts, cards),
+            stats=self.stats.add(cards),
         )
 
     def play_card(self, card):
@@ -279,14 +731,12 @@ class PlayerState(object):
         play_action(card).
         """
 
-        index = list(self.hand).index(card)
+        index = self.hand.index(card)
         newhand = self.hand[:index] + self.hand[index+1:]
-        result = PlayerState(
-            self.player, newhand, self.drawpile, self.discard,
-            self.tableau+(card,), self.actions, self.buys, self.coins
+        return self._update(
+            hand=newhand,
+            tableau_counts=add_counts(self.tableau_counts, (card,)),
         )
-        assert len(self) == len(result)
-        return result
 
     def play_action(self, card):
         """
@@ -298,34 +748,68 @@ class PlayerState(object):
         """
         return self.play_card(card).change(delta_actions=-1)
 
+    def play_vanilla_action(self, card):
+        """
+        Play an action card and resolve its vanilla part, all in a single
+        transition. This is the same as play_action followed by
+        resolve_vanilla_action.
+        """
+        index = self.hand.index(card)
+        changes = self._vanilla_changes(card, self.hand[:index] + self.hand[index+1:])
+        changes['tableau_counts'] = add_counts(self.tableau_counts, (card,))
+        changes['actions'] -= 1
+        return self._update(**changes)
+
+    def resolve_vanilla_action(self, card):
+        """
+        Put the vanilla part of an action card into effect: draw its cards
+        and add its actions, buys and coins, in a single transition. For cards
+        without a custom effect, that is the whole card.
+        """
+        return self._update(**self._vanilla_changes(card, self.hand))
+
+    def _vanilla_changes(self, card, hand) -> Dict[str, Any]:
+        card_id = card.id
+        if CARD_CARDS[card_id]:
+            changes = self._draw_changes(hand, CARD_CARDS[card_id])
+        else:
+            changes = dict(hand=hand)
+        changes['actions'] = self.actions + CARD_ACTIONS[card_id]
+        changes['buys'] = self.buys + CARD_BUYS[card_id]
+        changes['coins'] = self.coins + CARD_COINS[card_id]
+        return changes
+
     def discard_card(self, card):
         """
         Discard a single card from the hand.
         """
-        index = list(self.hand).index(card)
+        index = self.hand.index(card)
         newhand = self.hand[:index] + self.hand[index+1:]
-        return PlayerState(
-          self.player, newhand, self.drawpile, self.discard+(card,),
-          self.tableau, self.actions, self.buys, self.coins
+        return self._update(
+            hand=newhand,
+            discard_counts=add_counts(self.discard_counts, (card,)),
         )
 
-    def trash_card(self, card, game):
+    def trash_card(self, card):
         """
         Remove a card from the game.
         """
-        index = list(self.hand).index(card)
+        index = self.hand.index(card)
         newhand = self.hand[:index] + self.hand[index + 1:]
-        return PlayerState(
-          self.player, newhand, self.drawpile, self.discard,
-          self.tableau, self.actions, self.buys, self.coins
+        return self._update(
+            hand=newhand,
+            deck_counts=remove_count(self.deck_counts, card),
+            stats=self.stats.remove(card),
         )
 
     def actionable(self):
         """Are there actions left to take with this hand?"""
-        return (
-            self.actions > 0
-            and any(card.is_action() for card in self.hand)
-        )
+        if self.actions <= 0:
+            return False
+        for card in self.hand:
+            if IS_ACTION[card.id]:
+                return True
+        return False
 
     def buyable(self):
         """Can this hand still buy a card?"""
@@ -346,74 +830,115 @@ class PlayerState(object):
 
     def score(self) -> int:
         """How many points is this deck worth?"""
-        return sum(card.vp for card in self.all_cards())
+        return self.stats.vp
 
     def simulate(self):
         return self.simulation_state()
 
     def simulate_from_here(self):
-        newdraw = list(self.drawpile)
-        random.shuffle(newdraw)
-        return PlayerState(self.player, self.hand, tuple(newdraw),
-                           self.discard, self.tableau, self.actions,
-                           self.buys, self.coins)
-
-    def simulation_state(self, cards=()):
+        # forget the order of the known cards on top of the draw pile
+        sim_rng = self.sim_rng
+        return PlayerState(self.player, self.hand, (),
+                           self.discard_counts, self.tableau_counts, self.actions,
+                           self.buys, self.coins, self.deck_counts, self.stats,
+                           rng=sim_rng, sim_rng=sim_rng,
+                           shuffled_counts=add_counts(self.shuffled_counts, self.drawpile))
+
+    def simulation_state(self, cards=(), sim_rng: Optional[RandomStream] = None):
         """
         Get a state with a freshly-shuffled deck, a new turn, and certain cards
         on top of the deck. Generally useful for simulating the effect of
-        gaining a new card.
+        gaining a new card. The deck is shuffled with sim_rng, or the
+        player's simulation stream.
         """
-        state = PlayerState(self.player, (), cards, self.all_cards(), (),
-                            1, 1, 0)
+        if sim_rng is None:
+            sim_rng = self.sim_rng
+        state = PlayerState(self.player, (), cards, self.deck_counts, {},
+                            1, 1, 0, add_counts(self.deck_counts, cards),
+                            self.stats.add(cards), rng=sim_rng, sim_rng=sim_rng)
         return state.draw(DEFAULT_HAND_SIZE)
 
-    def simulate_hands(self, n=100, cards=()):
+    def simulate_hands(self, n=100, cards=(), cache: Optional[HandCache] = None):
         """
         Simulate n hands with certain cards in them, yielding the number of
         coins and buys they end with.
+
+        With a HandCache, the hands of a deck that were simulated before are
+        taken from the cache instead (grouped by outcome, not in the order
+        they were drawn), and only the rest are simulated (see hand_sample).
         """
-        for i in range(n):
-            # make sure there are cards to gain, even though we haven't
-            # kept track of the real game state
-            game = Game(
-                [self.simulation_state(cards)],
-                {Province: 12, Duchy: 12, Estate: 12, Copper: 12, Silver: 12, Gold: 12},
-                simulated=True,
-                trash=[],
-                total_card_count=None,
-            )
-            coins, buys = game.simulate_turn()
-            yield coins, buys
+        if cache is None:
+            for i in range(n):
+                yield self.simulate_hand(cards)
+            return
+        sample = self.hand_sample(n, cards, cache)
+        for hand, count in list(sample.hands.items()):
+            for _ in range(count):
+                yield hand
+        while not sample.complete():
+            yield sample.simulate(self, cards)
+
+    def hand_sample(self, n=100, cards=(), cache: Optional[HandCache] = None) -> HandSample:
+        """
+        The HandSample of n hands with certain cards in them: the one in the
+        cache, or a new one (put in the cache, if any) to simulate them with.
+        Without a cache, the hands are simulated on the player's simulation
+        stream.
+        """
+        if cache is None:
+            return HandSample(n, self.sim_rng)
+        key = (deck_signature(self.deck_counts), tuple(card.id for card in cards), n)
+        sample = cache.get(key)
+        if sample is None:
+            sample = HandSample(n, cache.stream(key))
+            cache.put(key, sample)
+        return sample
+
+    def simulate_hand(self, cards=(), sim_rng: Optional[RandomStream] = None) -> Tuple[int, int]:
+        """
+        Simulate a hand with certain cards in it, shuffled with sim_rng or the
+        player's simulation stream, and return the coins and buys it ends with.
+        """
+        if sim_rng is None:
+            sim_rng = self.sim_rng
+        # make sure there are cards to gain, even though we haven't
+        # kept track of the real game state
+        game = Game(
+            [self.simulation_state(cards, sim_rng)],
+            SIMULATION_SUPPLY,
+            simulated=True,
+            trash=EMPTY_PLIST,
+            total_card_count=None,
+            rng=sim_rng,
+        )
+        return game.simulate_turn()
 
     def money_density(self, account_for_draws: bool = True) -> float:
-        all_cards = self.all_cards()
+        stats = self.stats
         return (
-            sum(card.coins + card.treasure for card in all_cards)
+            stats.money
             /
-            sum(1 - (card.cards if account_for_draws else 0) for card in all_cards) # Draw cards makes money density higher
+            (stats.size - (stats.draws if account_for_draws else 0)) # Draw cards makes money density higher
         )
 
     def mean_hand_size(self) -> float:
         '''
         Return expected number of cards per hand (assuming that all actions can be played)
         '''
-        all_actions = [card for card in self.all_cards() if card.is_action()]
-        return DEFAULT_HAND_SIZE + sum(card.cards for card in all_actions) / (len(self.all_cards()) / DEFAULT_HAND_SIZE)
+        return DEFAULT_HAND_SIZE + self.stats.draws / (self.stats.size / DEFAULT_HAND_SIZE)
 
     def action_density(self) -> float:
         '''
         Return expected number of action cards per hand.
         '''
-        all_actions = [card for card in self.all_cards() if card.is_action()]
-        return len(all_actions) * DEFAULT_HAND_SIZE / len(self.all_cards())
+        return self.stats.actions * DEFAULT_HAND_SIZE / self.stats.size
 
     def action_engine_lifetime(self) -> float:
         '''
         Returns the expected lifetime of an (action) engine.
         A running engine is an engine drawing (at least) as many cards as it consumes.
         '''
-        mean_draw_per_action = [card for card in self.all_cards() if card.is_action()]
+        mean_draw_per_action = [card for card in self.deck_counts if IS_ACTION[card.id]]
 
     def mean_money_per_turn(self) -> float:
         return self.mean_hand_size() * self.money_density(account_for_draws=False)
@@ -428,39 +953,208 @@ VICTORY_CARDS = {
     6: 18
 }
 
+class Supply(object):
+    """
+    The piles of cards on the table: a persistent mapping from cards to the
+    number of copies left.
+
+    The index of the supply (its cards sorted by cost, their slots, and
+    their costs) is built once and shared by every version of the supply;
+    the counts live in a PVector, so taking a card copies only a small part
+    of the supply. The number of empty piles is kept up to date as cards are
+    taken, so checking for the end of the game is constant-time.
+    """
+    def __init__(self, cards: Tuple[Card, ...], slots: Dict[Card, int], costs: List[int], counts: PVector, empty_piles: int) -> None:
+        self.cards = cards
+        self.slots = slots
+        self.costs = costs
+        self.counts = counts
+        self.empty_piles = empty_piles
+
+    @staticmethod
+    def of(card_counts: Dict[Card, int]) -> 'Supply':
+        "Build a supply from a dictionary of pile counts."
+        cards = tuple(sorted(card_counts, key=lambda card: (CARD_COST[card.id], card.name)))
+        return Supply(
+            cards,
+            {card: slot for (slot, card) in enumerate(cards)},
+            [CARD_COST[card.id] for card in cards],
+            PVector.of(card_counts[card] for card in cards),
+            sum(1 for card in cards if card_counts[card] == 0),
+        )
+
+    def take(self, card: Card) -> 'Supply':
+        "Return the supply with one copy of a card removed."
+        slot = self.slots[card]
+        count = self.counts[slot] - 1
+        assert count >= 0, (card, count)
+        return Supply(
+            self.cards, self.slots, self.costs, self.counts.set(slot, count),
+            self.empty_piles + 1 if count == 0 else self.empty_piles,
+        )
+
+    def available(self) -> List[Card]:
+        "List the cards that are left, by increasing cost."
+        return [card for (card, count) in zip(self.cards, self.counts) if count > 0]
+
+    def buyable(self, coins: int) -> List[Card]:
+        "List the cards that are left and cost at most some coins, by increasing cost."
+        end = bisect_right(self.costs, coins)
+        counts = self.counts
+        return [self.cards[slot] for slot in range(end) if counts[slot] > 0]
+
+    def __getitem__(self, card: Card) -> int:
+        return self.counts[self.slots[card]]
+
+    def get(self, card: Card, default: Optional[int] = None) -> Optional[int]:
+        slot = self.slots.get(card)
+        return default if slot is None else self.counts[slot]
+
+    def __contains__(self, card: Card) -> bool:
+        return card in self.slots
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def keys(self):
+        return self.cards
+
+    def values(self):
+        return iter(self.counts)
+
+    def items(self):
+        return zip(self.cards, self.counts)
+
+    def __repr__(self) -> str:
+        return 'Supply(%s)' % dict(self.items())
+
+# The supply of the games built by PlayerState.simulate_hands
+SIMULATION_SUPPLY = Supply.of({Province: 12, Duchy: 12, Estate: 12, Copper: 12, Silver: 12, Gold: 12})
+
 class Game(object):
-    def __init__(self, playerstates, card_counts, turn=0, simulated=False, trash: List[Card] = [], total_card_count: Optional[int] = None):
+    """
+    The state of a whole game: every player's state, the supply and the trash.
+    All three are persistent containers (a PVector, a Supply and a PList), so
+    that forking a game is O(1) and forks share everything they have in
+    common.
+
+    Games are normally immutable: every transition returns a new Game. A game
+    set up with in_place=True has a Journal and is mutated instead, which
+    saves rebuilding Game and PlayerState objects at every step. Use
+    checkpoint() and rollback() to return to an earlier point of such a game.
+
+    A game owns a random stream (rng), derived from its seed and game index
+    when it was set up with them. Forks share the streams of their game, so
+    replaying a game means setting it up again rather than forking it.
+    """
+    def __init__(self, playerstates, card_counts, turn=0, simulated=False, trash: Sequence[Card] = (), total_card_count: Optional[int] = None, journal: Optional[Journal] = None, events: Optional[EventBus] = None, rng: RandomStream = GLOBAL_STREAM, seed: Any = None, game_index: int = 0):
+        if not isinstance(playerstates, PVector):
+            playerstates = PVector.of(playerstates)
+        if not isinstance(card_counts, Supply):
+            card_counts = Supply.of(card_counts)
+        if not isinstance(trash, PList):
+            trash = EMPTY_PLIST.extend(trash)
         self.playerstates = playerstates
         self.card_counts = card_counts
         self.turn = turn
         self.player_turn = turn % len(playerstates)
         self.round = turn // len(playerstates)
         self.simulated = simulated
-        logid = 'Game'
-        if self.simulated:
-            logid = 'Simulation'
-        self.log = logging.getLogger(logid)
-        if self.simulated:
-            self.log.setLevel(logging.WARN)
-        else:
-            self.log.setLevel(logging.INFO)
+        if events is None:
+            events = SIMULATION_EVENTS if simulated else EVENTS
+        self.events = events
         self.trash = trash
         self.total_card_count = sum(self.card_counts.values()) if total_card_count is None else total_card_count
+        self.journal = journal
+        self.rng = rng
+        self.seed = seed
+        self.game_index = game_index
+
+    def _update(self, **changes) -> 'Game':
+        """
+        Return the game with some attributes replaced: a new game, or this
+        very game (journaling the old values) if it is played in place.
+        """
+        if 'turn' in changes:
+            turn = changes['turn']
+            changes['player_turn'] = turn % len(self.playerstates)
+            changes['round'] = turn // len(self.playerstates)
+        journal = self.journal
+        if journal is None:
+            game = Game.__new__(Game)
+            game.__dict__.update(self.__dict__)
+        else:
+            game = self
+            if journal.open_checkpoints:
+                for key in changes:
+                    journal.record(self.__dict__, key)
+        game.__dict__.update(changes)
+        return game
+
+    def checkpoint(self) -> int:
+        """
+        Open a checkpoint in an in-place game. Returns a mark for rollback()
+        or release().
+        """
+        assert self.journal is not None, 'Only in-place games can be rolled back'
+        return self.journal.checkpoint()
+
+    def rollback(self, mark: int) -> 'Game':
+        "Return an in-place game to the state it had at a checkpoint."
+        self.journal.rollback(mark)
+        return self
+
+    def release(self, mark: int) -> None:
+        "Close a checkpoint of an in-place game without rolling back."
+        self.journal.release(mark)
 
     def copy(self) -> 'Game':
         "Make an exact copy of this game state."
-        return Game(
-            self.playerstates[:],
-            self.card_counts,
-            turn=self.turn,
-            simulated=self.simulated,
-            trash=self.trash,
-            total_card_count=self.total_card_count,
-        )
+        return self.fork()
+
+    def fork(self) -> 'Game':
+        """
+        Make an independent copy of this game that can be played on without
+        affecting the original. Forking an immutable game is O(1); forking an
+        in-place game also copies each PlayerState object, and gives the fork
+        a journal of its own.
+        """
+        if self.journal is None:
+            return self._update()
+        journal = Journal()
+        game = Game.__new__(Game)
+        game.__dict__.update(self.__dict__)
+        game.journal = journal
+        states = []
+        for state in self.playerstates:
+            newstate = PlayerState.__new__(PlayerState)
+            newstate.__dict__.update(state.__dict__)
+            newstate.journal = journal
+            states.append(newstate)
+        game.playerstates = PVector.of(states)
+        return game
 
     @staticmethod
-    def setup(players, var_cards: List[Card] = (), simulated: bool = False):
-        "Set up the game."
+    def setup(players, var_cards: List[Card] = (), simulated: bool = False, in_place: bool = False, events: Optional[EventBus] = None, seed: Any = None, game_index: int = 0, shuffle_seats: bool = True, starting_deck: Sequence[Card] = STARTING_HAND):
+        """
+        Set up the game. With in_place=True, the game is mutated in place as it
+        is played instead of producing a new Game at every step. Events are
+        published to the given bus, by default events.EVENTS (or
+        events.SIMULATION_EVENTS for simulated games).
+
+        All the randomness of the game (seating, shuffles and the simulations
+        of its bots) comes from streams derived from the master seed and the
+        game index, so the same seed, index and players give the same game.
+        Without a seed, one is drawn from the global random module and kept
+        in game.seed. The players are seated in a random order, or in the
+        given order if shuffle_seats is False.
+
+        Every player starts with starting_deck, 7 Coppers and 3 Estates by
+        default. Larger starting decks do not come out of the supply.
+        """
         counts = {
             Estate: VICTORY_CARDS[len(players)],
             Duchy: VICTORY_CARDS[len(players)],
@@ -473,15 +1167,39 @@ class Game(object):
         for card in var_cards:
             counts[card] = 10 #TODO: This formula needs to be adjusted for treasure cards
 
-        playerstates = [PlayerState.initial_state(p) for p in players]
-        random.shuffle(playerstates)
+        if seed is None:
+            seed = random.getrandbits(64)
+        rng = random_stream(seed, game_index, 'game')
+        seating = list(players)
+        if shuffle_seats:
+            rng.shuffle(seating)
+
+        journal = Journal() if in_place else None
+        playerstates = [
+            PlayerState.initial_state(
+                player,
+                journal,
+                rng=random_stream(seed, game_index, 'seat', seat),
+                sim_rng=random_stream(seed, game_index, 'simulation', seat),
+                starting_deck=starting_deck,
+            )
+            for seat, player in enumerate(seating)
+        ]
+        # assert_no_cards_missing counts the starting decks as
+        # STARTING_HAND, so account for the extra cards of larger ones
+        total_card_count = sum(counts.values()) + (len(starting_deck) - len(STARTING_HAND)) * len(players)
         return Game(
             playerstates,
             counts,
             turn=0,
             simulated=simulated,
-            trash=[],
-            total_card_count=None,
+            trash=EMPTY_PLIST,
+            total_card_count=total_card_count,
+            journal=journal,
+            events=events,
+            rng=rng,
+            seed=seed,
+            game_index=game_index,
         )
 
     def state(self):
@@ -520,48 +1238,31 @@ class Game(object):
         """
         List all the cards that can currently be bought.
         """
-        return sorted(
-            [
-                card
-                for (card, count) in self.card_counts.items()
-                if count > 0
-            ],
-            key=lambda card: (card.cost, card.name),
-        )
+        return self.card_counts.available()
 
     def remove_card(self, card: Card) -> 'Game':
         """
         Remove a single card from the table.
         """
-        new_counts = self.card_counts.copy()
-        new_counts[card] -= 1
-        assert new_counts[card] >= 0, (card, new_counts[card])
-        return Game(
-            self.playerstates[:],
-            new_counts,
-            turn=self.player_turn,
-            simulated=self.simulated,
-            trash=self.trash + [card],
-            total_card_count=self.total_card_count,
-        )
+        return self._update(card_counts=self.card_counts.take(card))
 
     def replace_states(self, newstates):
         """
         Do something with the current player's state and make a new overall
         game state from it.
         """
-        newgame = self.copy()
-        newgame.playerstates = newstates
-        return newgame
+        if not isinstance(newstates, PVector):
+            newstates = PVector.of(newstates)
+        return self._update(playerstates=newstates)
 
     def replace_current_state(self, newstate):
         """
         Do something with the current player's state and make a new overall
         game state from it.
         """
-        newgame = self.copy()
-        newgame.playerstates[self.player_turn] = newstate
-        return newgame
+        if self.playerstates[self.player_turn] is newstate:
+            return self
+        return self._update(playerstates=self.playerstates.set(self.player_turn, newstate))
 
     def change_current_state(self, **changes):
         """
@@ -576,11 +1277,7 @@ class Game(object):
         Make a numerical change to the states of all non-current players, the
         same way as change_current_state.
         """
-        newgame = self.copy()
-        for i in range(self.num_players()):
-            if i == self.player_turn: continue
-            newgame.playerstates[i] = newgame.playerstates[i].change(**changes)
-        return newgame
+        return self.transform_other_states(lambda state: state.change(**changes))
 
     def transform_other_states(self, func, attack=False):
         """
@@ -590,11 +1287,10 @@ class Game(object):
         counter that requires them to make a decision. Implement attacks using
         the attack_with_decision method instead.
         """
-        newgame = self.copy()
-        for i in range(self.num_players()):
-            if i == self.player_turn: continue
-            newgame.playerstates[i] = func(newgame.playerstates[i])
-        return newgame
+        return self.replace_states(PVector.of(
+            state if i == self.player_turn else func(state)
+            for (i, state) in enumerate(self.playerstates)
+        ))
 
     def next_mini_turn(self):
         """
@@ -604,21 +1300,21 @@ class Game(object):
         This is useful when players need to make decisions in the middle of
         another player's turn, creating what we call here a "mini-turn".
         """
-        return Game(
-            self.playerstates[:],
-            self.card_counts,
-            turn=self.turn + 1,
-            simulated=self.simulated,
-            trash=self.trash,
-            total_card_count=self.total_card_count,
-        )
+        return self._update(turn=self.turn + 1)
 
-    def everyone_else_makes_a_decision(self, decision_template, attack=False):
+    def everyone_else_makes_a_decision(self, decision_template, attack=False) -> STEPS:
+        """
+        Step generator in which every other player, in turn, makes the
+        decision built by decision_template.
+        """
+        player_turn = self.player_turn
         newgame = self.next_mini_turn()
-        while newgame.player_turn != self.player_turn:
+        while newgame.player_turn != player_turn:
             if attack:
-                if newgame.state().is_defended():
-                    self.log.info('Player {0} is defended'.format(newgame.state().player))
+                defended = newgame.state().is_defended()
+                if Attack in self.events.handlers:
+                    self.events.publish(Attack(newgame, self.current_player(), newgame.current_player(), defended))
+                if defended:
                     newgame = newgame.next_mini_turn()
                     continue
                 reactions = newgame.state().get_reactions()
@@ -626,12 +1322,12 @@ class Game(object):
                     newgame = reaction(newgame)
             decision = decision_template(newgame)
             turn = newgame.player_turn
-            game2 = newgame.current_player().make_decision(self, decision)
+            game2 = yield decision
             assert game2.player_turn == turn
             newgame = game2.next_mini_turn()
         return newgame
 
-    def attack_with_decision(self, decision):
+    def attack_with_decision(self, decision) -> STEPS:
         return self.everyone_else_makes_a_decision(decision, attack=True)
 
     def run_decisions(self):
@@ -639,14 +1335,24 @@ class Game(object):
         Run through all the decisions the current player has to make, and
         return the resulting state.
         """
-        state = self.state()
-        decisiontype = state.next_decision()
-        if decisiontype is None:
-            return self
-        else:
-            decision = decisiontype(self)
-            newgame = self.current_player().make_decision(self, decision)
-            return newgame.run_decisions()
+        return play_steps(self.decision_steps())
+
+    def decision_steps(self) -> STEPS:
+        """
+        Step generator going through all the decisions of the current
+        player's turn, including those that played actions give rise to.
+        """
+        game = self
+        while True:
+            decisiontype = game.state().next_decision()
+            if decisiontype is None:
+                return game
+            decision = decisiontype(game)
+            game = yield decision
+            if decisiontype is ActDecision:
+                card = decision.played
+                if card is not NO_CARD and not IS_VANILLA[card.id]:
+                    game = yield from card.effect_steps(game)
 
     def simulated_copy(self):
         """
@@ -657,7 +1363,7 @@ class Game(object):
         """
         return Game(
             [
-                state.simulated_from_here() if state is self.state() else state.simulate()
+                state.simulate_from_here() if state is self.state() else state.simulate()
                 for state in self.playerstates
             ],
             self.card_counts,
@@ -665,6 +1371,7 @@ class Game(object):
             simulated=True,
             trash=self.trash,
             total_card_count=self.total_card_count,
+            rng=self.state().sim_rng,
         )
 
     def simulate_turn(self):
@@ -673,71 +1380,55 @@ class Game(object):
         return the number of coins and buys they end up with. Useful for
         the BigMoney strategy.
         """
-        if not self.simulated: self = self.simulated_copy()
-        state = self.state()
-        decisiontype = state.next_decision()
-        if decisiontype is None:
-            assert False, "BuyDecision never happened this turn"
-        if decisiontype is BuyDecision:
-            return (state.hand_value(), state.buys)
-        decision = decisiontype(self)
-        newgame = self.current_player().make_decision(decision)
-        return newgame.simulate_turn()
+        state = self.simulate_partial_turn()
+        return (state.hand_value(), state.buys)
 
     def simulate_partial_turn(self):
         """
         Run through all the decisions the current player has to make, and
         return the state where the player buys stuff.
         """
-        if not self.simulated: self = self.simulated_copy()
-        state = self.state()
-        decisiontype = state.next_decision()
-        if decisiontype is None:
+        game = self if self.simulated else self.simulated_copy()
+        steps = game.decision_steps()
+        try:
+            decision = next(steps)
+            while not isinstance(decision, BuyDecision):
+                decision = steps.send(decision.player().make_decision(decision.game, decision))
+        except StopIteration:
             assert False, "BuyDecision never happened this turn"
-        if decisiontype is BuyDecision:
-            return state
-        decision = decisiontype(self)
-        newgame = self.current_player().make_decision(decision)
-        return newgame.simulate_partial_turn()
+        return decision.state()
 
     def take_turn(self):
         """
         Play an entire turn, including drawing cards at the end. Return
         the game state where it is the next player's turn.
         """
-        self.log.info("")
-        self.log.info("Round %d / player %d: %s (vp=%d, money_density=%.1f, action_density=%.1f, mean_money=%.1f)" % (
-            self.round + 1,
-            self.player_turn + 1,
-            self.current_player().name,
-            self.state().score(),
-            self.state().money_density(),
-            self.state().action_density(),
-            self.state().mean_money_per_turn(),
-        ))
+        return play_steps(self.turn_steps())
 
-        if False:
-            self.log.info("%d provinces left" % self.card_counts[Province])
-
-        # Run AI hooks that need to happen before the turn.
-        self.current_player().before_turn(self)
-        endturn = self.run_decisions()
+    def turn_steps(self) -> STEPS:
+        """
+        Step generator playing an entire turn, like take_turn.
+        """
+        if TurnStart in self.events.handlers:
+            self.events.publish(TurnStart(self))
 
+        # An in-place game is changed by the turn, so remember who is playing.
+        player = self.current_player()
+        player_turn = self.player_turn
         next_turn = (self.turn + 1)
 
-        newgame = Game(
-            endturn.playerstates[:],
-            endturn.card_counts,
-            turn=next_turn,
-            simulated=self.simulated,
-            trash=[],
-            total_card_count=None,
-        )
-        # mutate the new game object since nobody cares yet
-        newgame.playerstates[self.player_turn] = newgame.playerstates[self.player_turn].next_turn()
+        # Run AI hooks that need to happen before the turn.
+        player.before_turn(self)
+        endturn = yield from self.decision_steps()
+
+        newstates = endturn.playerstates
+        newstate = newstates[player_turn].next_turn()
+        if newstate is not newstates[player_turn]:
+            newstates = newstates.set(player_turn, newstate)
+        newgame = endturn._update(playerstates=newstates, turn=next_turn)
 
         # Run AI hooks that need to happen after the turn.
-        self.current_player().after_turn(newgame)
+        player.after_turn(newgame)
         #self.assert_no_cards_missing()
         return newgame
 
@@ -745,15 +1436,10 @@ class Game(object):
         "Returns True if the game is over."
         if self.card_counts[Province] == 0:
             return True
+        elif self.num_players() > 4:
+            return self.card_counts.empty_piles >= 4
         else:
-            zeros = 0
-            for count in list(self.card_counts.values()):
-                if count == 0: zeros += 1
-
-            if self.num_players() > 4:
-                return (zeros >= 4)
-            else:
-                return (zeros >= 3)
+            return self.card_counts.empty_piles >= 3
 
     def assert_no_cards_missing(self) -> None:
         '''
@@ -763,49 +1449,114 @@ class Game(object):
         assert (
             len(self.trash)
             +
-            sum(len(state.all_cards()) for state in self.playerstates)
+            sum(state.deck_size() for state in self.playerstates)
             +
             sum(self.card_counts.values())
             -
             len(STARTING_HAND) * len(self.playerstates)
         ) == self.total_card_count, (
             self.total_card_count,
-            len(self.trash) + sum(len(state.all_cards()) for state in self.playerstates) + sum(self.card_counts.values()) - len(STARTING_HAND) * len(self.playerstates),
+            len(self.trash) + sum(state.deck_size() for state in self.playerstates) + sum(self.card_counts.values()) - len(STARTING_HAND) * len(self.playerstates),
             self.trash,
             [state.all_cards() for state in self.playerstates],
         )
 
-    def run(self, max_rounds: int = 300) -> Dict[Any, int]:
+    def run(self, max_rounds: int = 300) -> List[Tuple[Any, int]]:
         """
-        Play a game of Dominion. Return a dictionary mapping players to scores.
+        Play a game of Dominion. Return a list of (player, score) pairs.
         """
-        game = self
-        while not game.over():
-            game = game.take_turn()
-            assert game.round < max_rounds, 'Game has entered infinite loop?'
-        scores = [(state.player, state.score()) for state in game.playerstates]
-        self.log.info(
-            "End of game (finished_piles: {0})".format(
-                [card for (card, count) in game.card_counts.items() if count == 0],
-            )
-        )
+        return GameStepper(self, max_rounds).run()
 
+    def finish(self) -> List[Tuple[Any, int]]:
+        "Wrap up a finished game and return a list of (player, score) pairs."
+        scores = [(state.player, state.score()) for state in self.playerstates]
         self.assert_no_cards_missing()
-
-        self.log.info(
-            'Finish decks: {0}'.format(
-                {
-                    state.player: state.card_counts()
-                    for state in game.playerstates
-                }
-            ),
-        )
-        self.log.info("Scores: %s" % scores)
+        if GameEnd in self.events.handlers:
+            self.events.publish(GameEnd(self, scores))
         return scores
 
     def __repr__(self) -> str:
         return 'Game%s[%s]' % (str(self.playerstates), str(self.turn))
 
+def play_steps(steps: STEPS) -> Game:
+    """
+    Drive a step generator to its end, letting the player of each decision
+    make it, and return the resulting game.
+    """
+    try:
+        decision = next(steps)
+        while True:
+            decision = steps.send(decision.player().make_decision(decision.game, decision))
+    except StopIteration as stop:
+        return stop.value
+
+class GameStepper(object):
+    """
+    Plays a game one decision at a time, without recursion.
+
+    `decision` is the decision that is pending, or None once the game is
+    over. Callers can make it themselves with choose(move), or let its
+    player make it with step(); step_turn() and run() go on until the end of
+    the turn or of the game. Many steppers can be interleaved in one process,
+    and a stepper can simply be dropped to stop its game early.
+    """
+    def __init__(self, game: Game, max_rounds: int = 300) -> None:
+        self.game = game
+        self.max_rounds = max_rounds
+        self.decision: Optional[Decision] = None
+        self.scores: Optional[List[Tuple[Any, int]]] = None
+        self.turns = 0
+        self._turn_steps: Optional[STEPS] = None
+        self._advance(None)
+
+    def finished(self) -> bool:
+        return self.decision is None
+
+    def _advance(self, game: Optional[Game]) -> None:
+        """
+        Send the result of the pending decision (if any) to the engine, and
+        go on to the next decision, starting new turns as needed.
+        """
+        while True:
+            try:
+                if self._turn_steps is None:
+                    if self.game.over():
+                        self.decision = None
+                        self.scores = self.game.finish()
+                        return
+                    self._turn_steps = self.game.turn_steps()
+                    self.decision = next(self._turn_steps)
+                else:
+                    self.decision = self._turn_steps.send(game)
+                self.game = self.decision.game
+                return
+            except StopIteration as stop:
+                self.game = stop.value
+                self._turn_steps = None
+                self.turns += 1
+                assert self.game.round < self.max_rounds, 'Game has entered infinite loop?'
+
+    def choose(self, move) -> None:
+        "Make the pending decision with the given move."
+        self._advance(self.decision.choose(move))
+
+    def step(self) -> None:
+        "Let the player of the pending decision make it."
+        decision = self.decision
+        self._advance(decision.player().make_decision(decision.game, decision))
+
+    def step_turn(self) -> None:
+        "Let the players make decisions until the current turn is over."
+        turns = self.turns
+        while self.turns == turns and self.decision is not None:
+            self.step()
+
+    def run(self) -> List[Tuple[Any, int]]:
+        "Let the players play the game to the end, and return the scores."
+        while self.decision is not None:
+            self.step()
+        return self.scores
+
 class Decision(object):
     def __init__(self, game: Game) -> None:
         self.game = game
@@ -822,12 +1573,19 @@ class GainDecision(Decision):
         self.card = card
 
     def choose(self, card):
-        if self.game.card_counts[card] > 0:
-            self.game.card_counts[card] -= 1
-            return self.game.replace_current_state(
-                self.game.state().gain_cards((self.card,)),
+        # Choosing NO_CARD, or a card whose pile is empty, gains nothing (and
+        # publishes a Gain of no cards, so that every decision publishes its
+        # event).
+        if card is not NO_CARD and self.game.card_counts[card] > 0:
+            newgame = self.game.remove_card(card)
+            if Gain in newgame.events.handlers:
+                newgame.events.publish(Gain(newgame, self.player(), (card,)))
+            return newgame.replace_current_state(
+                newgame.state().gain_cards((card,)),
             )
         else:
+            if Gain in self.game.events.handlers:
+                self.game.events.publish(Gain(self.game, self.player(), ()))
             return self.game
 
 class MultiDecision(Decision):
@@ -837,19 +1595,26 @@ class MultiDecision(Decision):
         super().__init__(game)
 
 class ActDecision(Decision):
+    """
+    Choose an action to play. Choosing plays the card and resolves its
+    vanilla part; the engine then runs its effects (see Card.effect_steps).
+    """
+    played: Optional[Card] = NO_CARD
+
     def choices(self) -> List[Optional[Card]]:
-        return [NO_CARD] + [card for card in self.state().hand if card.is_action()]
+        return [NO_CARD] + [card for card in self.state().hand if IS_ACTION[card.id]]
 
     def choose(self, card):
-        self.game.log.info("%s plays %s" % (self.player().name, card))
+        if Play in self.game.events.handlers:
+            self.game.events.publish(Play(self.game, self.player(), card))
+        self.played = card
         if card is NO_CARD:
             newgame = self.game.change_current_state(
               delta_actions=-self.state().actions
             )
             return newgame
         else:
-            newgame = card.perform_action(self.game.current_play_action(card))
-            return newgame
+            return self.game.replace_current_state(self.state().play_vanilla_action(card))
 
     def __str__(self) -> str:
         return "ActDecision (%d actions, %d buys, +%d coins)" %\
@@ -865,22 +1630,15 @@ class BuyDecision(Decision):
     def choices(self) -> List[Optional[Card]]:
         assert self.coins() >= 0
         value = self.coins()
-        return [NO_CARD] + [card for card in self.game.card_choices() if card.cost <= value] 
+        return [NO_CARD] + self.game.card_counts.buyable(value)
 
     def choose(self, card):
         assert card is NO_CARD or isinstance(card, Card), card
         if card is not NO_CARD:
             assert card.cost <= self.coins(), 'This card is too expensive (cost={0}, coins={1})'.format(card.cost, self.coins())
             assert self.game.card_counts[card] > 0, 'This card ({0}) has run out...'.format(card)
-        self.game.log.info(
-            "{player} buys {cards} (coins={coins}, buys={buys}, hand={hand})".format(
-                player=self.player().name,
-                cards=card,
-                coins=self.coins(),
-                buys=self.buys(),
-                hand=self.state().hand,
-            ),
-        )
+        if Buy in self.game.events.handlers:
+            self.game.events.publish(Buy(self.game, self.player(), card, self.coins(), self.buys(), self.state().hand))
         state = self.state()
         if card is NO_CARD:
             newgame = self.game.change_current_state(
@@ -900,15 +1658,17 @@ class TrashDecision(MultiDecision):
     def choices(self) -> List[Card]:
         return sorted(
             self.state().hand,
-            key=lambda card: (not card.is_curse(), card.cost), # Trash curses, then cheapest cards
+            key=lambda card: (not IS_CURSE[card.id], CARD_COST[card.id]), # Trash curses, then cheapest cards
         )
 
     def choose(self, choices):
-        self.game.log.info("%s trashes %s" % (self.player().name, choices))
+        if Trash in self.game.events.handlers:
+            self.game.events.publish(Trash(self.game, self.player(), choices))
         state = self.state()
         for card in choices:
             state = state.trash_card(card)
-        return self.game.replace_current_state(state)
+        newgame = self.game._update(trash=self.game.trash.extend(choices))
+        return newgame.replace_current_state(state)
 
     def __str__(self) -> str:
         return "TrashDecision(%s, %s, %s)" % (self.state().hand, self.min, self.max)
@@ -929,11 +1689,12 @@ class DiscardDecision(MultiDecision):
     def choices(self) -> List[Card]:
         return sorted(
             self.state().hand,
-            key=lambda card: (not card.is_curse(), not card.is_pure_victory(), card.cost), # Discard curses, then (pure) victory cards, then cheapest cards
+            key=lambda card: (not IS_CURSE[card.id], not IS_PURE_VICTORY[card.id], CARD_COST[card.id]), # Discard curses, then (pure) victory cards, then cheapest cards
         )
 
     def choose(self, choices: List[Card]):
-        self.game.log.info("%s discards %s" % (self.player().name, choices))
+        if Discard in self.game.events.handlers:
+            self.game.events.publish(Discard(self.game, self.player(), choices))
         state = self.state()
         for card in choices:
             state = state.discard_card(card)
@@ -0,0 +1,270 @@
+"""
+Exact hand-value distributions for decks without custom effects.
+
+PlayerState.simulate_hands estimates the (coins, buys) a deck ends its turn
+with by playing out sampled hands. When every action in the deck is vanilla
+(it only draws cards and adds actions, buys and coins), and actions are
+played in a fixed order of priority, that distribution can be computed
+exactly instead: the hand is a multivariate hypergeometric draw from the
+deck's counts, every action played draws another one from what is left, and
+enumerating those draws gives the probability of every outcome.
+
+The cards other than actions do not change how a turn goes, only how much
+treasure it ends with, and which of them are drawn does not depend on the
+actions played. So the turn is first played out with the actions told apart
+and the other cards counted together; the treasure of the other cards drawn
+then only depends on how many were drawn. A money deck with a few kinds of
+actions takes about a millisecond to work out.
+
+Decks with any action that has a custom effect (see Card.effect), and decks
+with too many ways to play out (see MAX_STATES), are not handled here;
+hand_distribution samples their hands instead.
+"""
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from game import Card, CardCounts, HandCache, DEFAULT_HAND_SIZE
+from game import IS_ACTION, IS_VANILLA, CARD_TREASURE, CARD_CARDS, CARD_ACTIONS, CARD_BUYS, CARD_COINS, deck_signature
+
+Distribution = Dict[Tuple[int, int], float]
+
+# Decks with many kinds of actions that draw have a lot of ways to play out.
+# Past this many states of a turn, working out the distribution takes longer
+# than sampling a hundred hands, and exact_hands gives up.
+MAX_STATES = 2000
+
+def comb(n: int, k: int) -> int:
+    "The number of ways to choose k things out of n (math.comb needs Python 3.8)."
+    if k < 0 or k > n:
+        return 0
+    k = min(k, n - k)
+    result = 1
+    for i in range(1, k + 1):
+        result = result * (n - k + i) // i
+    return result
+
+def draws(pool: Tuple[int, ...], n: int):
+    """
+    Yield every way to draw n cards (or all of them, if there are fewer) from
+    a pool of card counts, as the counts drawn and their probability.
+    """
+    size = sum(pool)
+    if n >= size:
+        yield pool, 1.0
+        return
+    total = comb(size, n)
+    kinds = len(pool)
+    drawn = [0] * kinds
+    # the cards left in the pool after each kind, to prune draws that cannot
+    # be completed
+    after = [0] * kinds
+    for i in range(kinds - 2, -1, -1):
+        after[i] = after[i + 1] + pool[i + 1]
+
+    def fill(i, left, ways):
+        if i == kinds - 1:
+            drawn[i] = left
+            yield tuple(drawn), ways * comb(pool[i], left) / total
+            return
+        for count in range(max(0, left - after[i]), min(pool[i], left) + 1):
+            drawn[i] = count
+            yield from fill(i + 1, left - count, ways * comb(pool[i], count))
+
+    yield from fill(0, n, 1)
+
+def enumerable(counts: CardCounts, cards: Sequence[Card] = (), priority: Optional[Callable[[Card], Any]] = None) -> bool:
+    "Can exact_hands work out the distribution of this deck?"
+    if len(cards) > DEFAULT_HAND_SIZE:
+        return False
+    for card in list(counts) + list(cards):
+        if IS_ACTION[card.id] and (priority is None or not IS_VANILLA[card.id]):
+            return False
+    return True
+
+class TooManyStates(Exception):
+    pass
+
+def exact_hands(counts: CardCounts, cards: Sequence[Card] = (), priority: Optional[Callable[[Card], Any]] = None, max_states: int = MAX_STATES) -> Optional[Distribution]:
+    """
+    The exact distribution of the (coins, buys) a turn ends with, for a
+    player whose deck holds the given counts, with some cards put on top of
+    it (like PlayerState.simulation_state). Actions are played while there
+    are actions left, highest priority first (ties go to the lowest card id).
+
+    Returns None if the deck or the cards have actions with custom effects
+    (or any actions, without a priority), if more cards than a hand are put
+    on top, or if working it out takes more than max_states turn states.
+    """
+    if not enumerable(counts, cards, priority):
+        return None
+    actions = sorted({card for card in list(counts) + list(cards) if IS_ACTION[card.id]}, key=lambda card: (-priority(card), card.id))
+    kind = {card: i for i, card in enumerate(actions)}
+    draws_of = [CARD_CARDS[card.id] for card in actions]
+    actions_of = [CARD_ACTIONS[card.id] for card in actions]
+    buys_of = [CARD_BUYS[card.id] for card in actions]
+    coins_of = [CARD_COINS[card.id] for card in actions]
+    action_kinds = len(actions)
+
+    # The pool holds the counts of the actions left to draw, and then the
+    # number of other cards left. Which other cards are drawn does not change
+    # how the turn goes, so play() only keeps track of how many are, and
+    # their treasure is worked out at the end.
+    pool = [0] * (action_kinds + 1)
+    treasure_counts: Dict[int, int] = {}
+    for card, count in counts.items():
+        if IS_ACTION[card.id]:
+            pool[kind[card]] += count
+        else:
+            pool[action_kinds] += count
+            treasure = CARD_TREASURE[card.id]
+            treasure_counts[treasure] = treasure_counts.get(treasure, 0) + count
+    others = pool[action_kinds]
+    hand = [0] * action_kinds
+    coins = 0
+    for card in cards:
+        if IS_ACTION[card.id]:
+            hand[kind[card]] += 1
+        else:
+            coins += CARD_TREASURE[card.id]
+
+    memo: Dict[Any, Dict[Tuple[int, int, int], float]] = {}
+
+    def play(pool, hand, actions_left, pending) -> Dict[Tuple[int, int, int], float]:
+        """
+        The distribution of the coins and buys the rest of the turn adds, and
+        of the other cards left in the pool at its end, with `pending` cards
+        still to draw. Cards are drawn one at a time, so that the ways of
+        drawing the same cards meet in the memo.
+        """
+        size = sum(pool) if pending else 0
+        if not size:
+            playable = None
+            if actions_left > 0:
+                playable = next((i for i in range(action_kinds) if hand[i]), None)
+            if playable is None:
+                return {(0, 0, pool[-1]): 1.0}
+        key = (pool, hand, actions_left, pending)
+        outcome = memo.get(key)
+        if outcome is not None:
+            return outcome
+        outcome = {}
+        if size:
+            for j, count in enumerate(pool):
+                if not count:
+                    continue
+                newpool = pool[:j] + (count - 1,) + pool[j + 1:]
+                newhand = hand[:j] + (hand[j] + 1,) + hand[j + 1:] if j < action_kinds else hand
+                probability = count / size
+                for result, p in play(newpool, newhand, actions_left, pending - 1).items():
+                    outcome[result] = outcome.get(result, 0.0) + probability * p
+        else:
+            i = playable
+            hand = hand[:i] + (hand[i] - 1,) + hand[i + 1:]
+            for (coins, buys, left), p in play(pool, hand, actions_left + actions_of[i] - 1, draws_of[i]).items():
+                result = (coins + coins_of[i], buys + buys_of[i], left)
+                outcome[result] = outcome.get(result, 0.0) + p
+        memo[key] = outcome
+        if len(memo) > max_states:
+            raise TooManyStates
+        return outcome
+
+    try:
+        played = play(tuple(pool), tuple(hand), 1, DEFAULT_HAND_SIZE - len(cards))
+    except TooManyStates:
+        return None
+    turns: Dict[Tuple[int, int, int], float] = {}
+    for (added_coins, added_buys, left), p in played.items():
+        result = (coins + added_coins, 1 + added_buys, left)
+        turns[result] = turns.get(result, 0.0) + p
+
+    # the treasure of the other cards drawn, by how many there are
+    values = sorted(treasure_counts)
+    treasure_pool = tuple(treasure_counts[value] for value in values)
+    treasures: Dict[int, Dict[int, float]] = {}
+    distribution: Distribution = {}
+    for (coins, buys, left), probability in turns.items():
+        drawn_others = others - left
+        if drawn_others not in treasures:
+            treasures[drawn_others] = {}
+            for drawn, p in draws(treasure_pool, drawn_others):
+                treasure = sum(value * count for value, count in zip(values, drawn))
+                treasures[drawn_others][treasure] = treasures[drawn_others].get(treasure, 0.0) + p
+        for treasure, p in treasures[drawn_others].items():
+            result = (coins + treasure, buys)
+            distribution[result] = distribution.get(result, 0.0) + probability * p
+    return distribution
+
+def known_turn(cards: Sequence[Card], priority: Optional[Callable[[Card], Any]] = None) -> Optional[Tuple[int, int]]:
+    """
+    The (coins, buys) a turn ends with when the cards it draws are known: a
+    hand of the first cards, and then the rest in order, as actions draw
+    them. Actions are played like BigMoney.make_act_decision does.
+
+    Returns None if the turn would play an action with a custom effect (or
+    any action, without a priority), or draw past the known cards.
+    """
+    if len(cards) < DEFAULT_HAND_SIZE:
+        return None
+    hand = list(cards[:DEFAULT_HAND_SIZE])
+    position = DEFAULT_HAND_SIZE
+    actions = buys = 1
+    coins = 0
+    while actions > 0:
+        best = None
+        for card in hand:
+            if IS_ACTION[card.id]:
+                if priority is None:
+                    return None
+                # the last of the best, like a stable sort of the choices
+                if best is None or priority(card) >= priority(best):
+                    best = card
+        if best is None or priority(best) < 0:
+            break
+        if not IS_VANILLA[best.id] or position + CARD_CARDS[best.id] > len(cards):
+            return None
+        hand.remove(best)
+        hand.extend(cards[position:position + CARD_CARDS[best.id]])
+        position += CARD_CARDS[best.id]
+        actions += CARD_ACTIONS[best.id] - 1
+        buys += CARD_BUYS[best.id]
+        coins += CARD_COINS[best.id]
+    return coins + sum(CARD_TREASURE[card.id] for card in hand), buys
+
+def sampled_hands(state, cards: Sequence[Card] = (), n: int = 100, cache: Optional[HandCache] = None) -> Distribution:
+    "The distribution of n hands sampled by PlayerState.simulate_hands."
+    distribution: Distribution = {}
+    for hand in state.simulate_hands(n, cards, cache):
+        distribution[hand] = distribution.get(hand, 0.0) + 1.0 / n
+    return distribution
+
+def cached_exact_hands(state, cards: Sequence[Card] = (), priority: Optional[Callable[[Card], Any]] = None, cache: Optional[HandCache] = None, compute: bool = True) -> Optional[Distribution]:
+    """
+    exact_hands for the deck of a state, kept in a cache (under None hands,
+    next to the sampled hands of PlayerState.simulate_hands). Decks too big to
+    work out are cached as an empty distribution, so they are not tried twice.
+    With compute=False, only a cached distribution is returned.
+    """
+    if not enumerable(state.deck_counts, cards, priority):
+        return None
+    if cache is None:
+        return exact_hands(state.deck_counts, cards, priority) if compute else None
+    key = (deck_signature(state.deck_counts), tuple(card.id for card in cards), None)
+    distribution = cache.get(key)
+    if distribution is None and compute:
+        distribution = exact_hands(state.deck_counts, cards, priority)
+        cache.put(key, {} if distribution is None else distribution)
+    return distribution or None
+
+def hand_distribution(state, cards: Sequence[Card] = (), priority: Optional[Callable[[Card], Any]] = None, n: int = 100, cache: Optional[HandCache] = None) -> Distribution:
+    """
+    The distribution of the (coins, buys) the player of a state ends a turn
+    with, after putting some cards on top of the deck: exact if the deck
+    allows it, or else from n sampled hands. A cache keeps both.
+    """
+    distribution = cached_exact_hands(state, cards, priority, cache)
+    if distribution is None:
+        return sampled_hands(state, cards, n, cache)
+    return distribution
+
+def expected_value(distribution: Distribution, value: Callable[[int, int], float]) -> float:
+    "The expected value of a function of (coins, buys) over a distribution."
+    return sum(probability * value(coins, buys) for (coins, buys), probability in distribution.items())
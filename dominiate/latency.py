@@ -0,0 +1,197 @@
+"""
+Decision latency profiling, and time budgets for bots.
+
+A LatencyProfiler wraps bots in ProfiledBots, which stand in for them in
+games and time every call to make_decision, before_turn and after_turn. The
+times go into histograms per bot and per kind of call: the type of the
+decision (BuyDecision, ActDecision, TrashDecision, DiscardDecision,
+GainDecision), or 'before_turn' and 'after_turn'. Calls made while another
+call of the same bot is running (the decisions of the games a bot simulates)
+count towards that call only. The time the engine takes to apply the move a
+bot chose (Decision.choose) is not the bot's: it goes into an 'engine'
+histogram of the bot instead.
+
+With a time budget, every outermost call sets the deadline of the bot (see
+Player.time_left), so that bots that can stop thinking early do so, and the
+calls that overrun the budget are counted. Python cannot interrupt a bot, so
+a bot that never looks at its deadline still takes as long as it takes.
+
+Profiled bots measure the process they play in: use them with workers=1.
+"""
+from math import ceil, log2
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from game import BuyDecision, ActDecision, TrashDecision, DiscardDecision, GainDecision
+
+DECISION_TYPES = (BuyDecision, ActDecision, TrashDecision, DiscardDecision, GainDecision)
+
+# The kind of call of the engine applying the moves of a bot.
+ENGINE = 'engine'
+
+# Histogram buckets double from 1 microsecond: bucket i holds the times up
+# to 2**i microseconds, and the last bucket everything above.
+SMALLEST = 1e-6
+BUCKETS = 32
+
+class Histogram(object):
+    "A latency histogram with logarithmic buckets."
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.overruns = 0
+
+    def add(self, seconds: float) -> None:
+        bucket = 0 if seconds <= SMALLEST else min(ceil(log2(seconds / SMALLEST)), BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        "An upper bound on the given percentile (0 to 1) of the times."
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(SMALLEST * 2 ** bucket, self.max)
+        return self.max
+
+def decision_type(decision: Any) -> str:
+    for cls in DECISION_TYPES:
+        if isinstance(decision, cls):
+            return cls.__name__
+    return type(decision).__name__
+
+class LatencyProfiler(object):
+    """
+    Latency histograms of the bots it wraps, keyed by (bot name, kind of
+    call), and an optional time budget in seconds for every decision.
+    """
+    def __init__(self, budget: Optional[float] = None) -> None:
+        self.budget = budget
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def wrap(self, bots: Sequence[Any]) -> List['ProfiledBot']:
+        return [ProfiledBot(bot, self) for bot in bots]
+
+    def record(self, bot: Any, kind: str, seconds: float) -> None:
+        key = (bot.name, kind)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.add(seconds)
+        if self.budget is not None and seconds > self.budget and kind != ENGINE:
+            histogram.overruns += 1
+
+    def bot_time(self, name: str) -> float:
+        "The total seconds spent in the calls of the named bot."
+        return sum(histogram.total for (bot, kind), histogram in self.histograms.items() if bot == name and kind != ENGINE)
+
+    def engine_time(self) -> float:
+        "The total seconds the engine spent applying the moves of the bots."
+        return sum(histogram.total for (bot, kind), histogram in self.histograms.items() if kind == ENGINE)
+
+    def report(self, elapsed: Optional[float] = None) -> str:
+        """
+        A table of the histograms. Given the elapsed time of the games, it
+        also gives the share of that time every bot took, and the engine took
+        applying their moves.
+        """
+        lines = ['{0:<40} {1:<16} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} {7:>8}'.format(
+            'bot', 'call', 'calls', 'mean', 'p50', 'p99', 'max', 'overruns',
+        )]
+        for (bot, kind), histogram in sorted(self.histograms.items()):
+            lines.append('{0:<40} {1:<16} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} {7:>8}'.format(
+                bot[:40], kind, histogram.count,
+                format_seconds(histogram.mean()),
+                format_seconds(histogram.percentile(0.5)),
+                format_seconds(histogram.percentile(0.99)),
+                format_seconds(histogram.max),
+                histogram.overruns,
+            ))
+        if elapsed:
+            for bot in sorted({bot for bot, kind in self.histograms}):
+                lines.append('{0}: {1:.1%} of {2:.2f}s'.format(bot, self.bot_time(bot) / elapsed, elapsed))
+            lines.append('engine (applying moves): {0:.1%} of {1:.2f}s'.format(self.engine_time() / elapsed, elapsed))
+        return '\n'.join(lines)
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return '{0:.1f}us'.format(seconds * 1e6)
+    if seconds < 1:
+        return '{0:.2f}ms'.format(seconds * 1e3)
+    return '{0:.2f}s'.format(seconds)
+
+class ProfiledBot(object):
+    """
+    Stands in for a bot, timing its calls for a LatencyProfiler. Everything
+    else is passed on to the bot.
+    """
+    def __init__(self, bot: Any, profiler: LatencyProfiler) -> None:
+        self.bot = bot
+        self.profiler = profiler
+        self.depth = 0
+
+    def __getattr__(self, name: str) -> Any:
+        if name == 'bot':
+            # not set yet, while unpickling
+            raise AttributeError(name)
+        return getattr(self.bot, name)
+
+    def __str__(self) -> str:
+        return str(self.bot)
+
+    def __repr__(self) -> str:
+        return repr(self.bot)
+
+    def _call(self, kind: str, method: Any, *args, decision: Any = None) -> Any:
+        if self.depth:
+            return method(*args)
+        bot = self.bot
+        budget = self.profiler.budget
+        engine = 0.0
+        if decision is not None:
+            # the bot makes the decision by calling its choose method: time
+            # the engine applying the move apart
+            choose = decision.choose
+
+            def timed_choose(move):
+                nonlocal engine
+                start = perf_counter()
+                try:
+                    return choose(move)
+                finally:
+                    engine += perf_counter() - start
+
+            decision.choose = timed_choose
+        start = perf_counter()
+        if budget is not None:
+            bot.deadline = start + budget
+        self.depth += 1
+        try:
+            return method(*args)
+        finally:
+            self.depth -= 1
+            bot.deadline = None
+            seconds = perf_counter() - start
+            if decision is not None:
+                del decision.choose
+                self.profiler.record(bot, ENGINE, engine)
+            self.profiler.record(bot, kind, seconds - engine)
+
+    def make_decision(self, game, decision):
+        return self._call(decision_type(decision), self.bot.make_decision, game, decision, decision=decision)
+
+    def before_turn(self, game) -> None:
+        self._call('before_turn', self.bot.before_turn, game)
+
+    def after_turn(self, game) -> None:
+        self._call('after_turn', self.bot.after_turn, game)
@@ -0,0 +1,349 @@
+"""
+Memory profiling of games.
+
+profile_games plays games between bots and measures, for every turn:
+
+- allocations: how many Game, PlayerState and Decision objects the turn
+  created, counted by temporarily wrapping the methods that create them,
+  which also note the engine call site that asked for each object;
+- retained bytes: the size of everything the game holds on to at the end
+  of the turn, by type (Game, PlayerState, Decision, tuple, dict, list, the
+  persistent containers, and other), found by walking the objects reachable
+  from the game; cards, players, event buses and classes are shared between
+  games and not counted;
+- traced bytes: the memory allocated since the game started and still in
+  use, according to tracemalloc, in a separate run of the same game without
+  the bookkeeping of the profiler.
+
+It also gives the peak traced memory of every game, the peak resident memory
+of every worker process, and the call sites in the engine holding the most
+memory at the end of turns (from tracemalloc snapshots, every few turns as
+they are slow). Everything runs much slower than usual.
+"""
+import os
+import resource
+import sys
+import tracemalloc
+import types
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from gc import get_referents
+from multiprocessing import Pool
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+from game import Game, PlayerState, Decision, GameStepper, Card, Supply
+from persistent import PVector, PList
+from events import EventBus
+from players import Player
+from cards import BASE_ACTIONS
+
+COUNTED_TYPES = (Game, PlayerState, Decision)
+
+# Types of objects that are shared between games rather than part of one.
+SHARED_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    Card, Player, EventBus, int, float, str, bool, type(None),
+)
+
+TOP_SITES = 10
+
+ENGINE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def type_category(obj: Any) -> str:
+    for cls in COUNTED_TYPES:
+        if isinstance(obj, cls):
+            return cls.__name__
+    if isinstance(obj, (PVector, PList, Supply)):
+        return 'persistent'
+    if isinstance(obj, (tuple, dict, list)):
+        return type(obj).__name__
+    return 'other'
+
+def retained_bytes(game: Game) -> Counter:
+    "The bytes of the objects reachable from the game, by type category."
+    sizes: Counter = Counter()
+    seen = {id(game)}
+    pending = [game]
+    while pending:
+        obj = pending.pop()
+        sizes[type_category(obj)] += sys.getsizeof(obj)
+        for referent in get_referents(obj):
+            if id(referent) not in seen and not isinstance(referent, SHARED_TYPES):
+                seen.add(id(referent))
+                pending.append(referent)
+    return sizes
+
+def call_site(depth: int = 2) -> str:
+    """
+    The file, line and function of a caller, depth frames up from the caller
+    of this, skipping the constructors of subclasses on the way.
+    """
+    frame = sys._getframe(depth)
+    while frame.f_code.co_name == '__init__' and frame.f_back is not None:
+        frame = frame.f_back
+    return '{0}:{1} {2}'.format(os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+
+class AllocationCounter(object):
+    """
+    Counts the Game, PlayerState and Decision objects created while it is
+    installed, in total and by the engine call site that created them.
+
+    Engine objects are created by their constructors, and Game and
+    PlayerState objects also by _update (unless the game is played in
+    place) and Game.fork. The counter wraps those methods while installed.
+    """
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self.sites: Counter = Counter()
+        self.originals: List[Tuple[type, str, Any]] = []
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counts[name] += n
+        self.sites[(name, call_site(3))] += n
+
+    def install(self) -> None:
+        count = self.count
+
+        def counting_init(cls: type, name: str) -> Any:
+            original = cls.__init__
+
+            def __init__(self, *args, **kwargs):
+                count(name)
+                original(self, *args, **kwargs)
+            return __init__
+
+        def counting_update(cls: type, name: str) -> Any:
+            original = cls._update
+
+            def _update(self, **changes):
+                updated = original(self, **changes)
+                if updated is not self:
+                    count(name)
+                return updated
+            return _update
+
+        def counting_fork(original: Any) -> Any:
+            def fork(self):
+                if self.journal is not None:
+                    count('Game')
+                    count('PlayerState', len(self.playerstates))
+                return original(self)
+            return fork
+
+        self._wrap(Game, '__init__', counting_init(Game, 'Game'))
+        self._wrap(PlayerState, '__init__', counting_init(PlayerState, 'PlayerState'))
+        self._wrap(Decision, '__init__', counting_init(Decision, 'Decision'))
+        self._wrap(Game, '_update', counting_update(Game, 'Game'))
+        self._wrap(PlayerState, '_update', counting_update(PlayerState, 'PlayerState'))
+        self._wrap(Game, 'fork', counting_fork(Game.fork))
+
+    def _wrap(self, cls: type, name: str, wrapper: Any) -> None:
+        self.originals.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, wrapper)
+
+    def uninstall(self) -> None:
+        for cls, name, original in reversed(self.originals):
+            setattr(cls, name, original)
+        self.originals = []
+
+class TurnMemory(NamedTuple):
+    allocations: Dict[str, int]
+    retained: Dict[str, int]
+    traced_bytes: int
+
+class GameMemory(NamedTuple):
+    game_index: int
+    turns: List[TurnMemory]
+    peak_bytes: int
+
+class MemoryReport(NamedTuple):
+    """
+    The memory use of a number of games: every turn of every game, the
+    allocation sites, the retention sites summed over a number of snapshots,
+    and the peak memory of each worker (by process id), as traced by
+    tracemalloc and as resident memory.
+    """
+    games: List[GameMemory]
+    allocation_sites: Counter
+    retained_sites: Counter
+    snapshots: int
+    worker_peaks: Dict[int, Tuple[int, int]]
+
+    def merge(self, other: 'MemoryReport') -> 'MemoryReport':
+        peaks = dict(self.worker_peaks)
+        for pid, (traced, resident) in other.worker_peaks.items():
+            old_traced, old_resident = peaks.get(pid, (0, 0))
+            peaks[pid] = (max(traced, old_traced), max(resident, old_resident))
+        return MemoryReport(
+            self.games + other.games,
+            self.allocation_sites + other.allocation_sites,
+            self.retained_sites + other.retained_sites,
+            self.snapshots + other.snapshots,
+            peaks,
+        )
+
+    def __str__(self) -> str:
+        turns = [turn for game in self.games for turn in game.turns]
+        lines = ['{0} games, {1} turns'.format(len(self.games), len(turns))]
+        if not turns:
+            return lines[0]
+        lines.append('Per turn:            {0:>12} {1:>14}'.format('allocated', 'retained bytes'))
+        for category in sorted({key for turn in turns for key in list(turn.allocations) + list(turn.retained)}):
+            lines.append('  {0:<18} {1:>12.1f} {2:>14,.0f}'.format(
+                category,
+                sum(turn.allocations.get(category, 0) for turn in turns) / len(turns),
+                sum(turn.retained.get(category, 0) for turn in turns) / len(turns),
+            ))
+        lines.append('  {0:<18} {1:>12} {2:>14,.0f}'.format(
+            'traced', '', sum(turn.traced_bytes for turn in turns) / len(turns),
+        ))
+        peaks = [game.peak_bytes for game in self.games]
+        lines.append('Peak traced memory per game: mean {0:,.0f} bytes, max {1:,} bytes'.format(sum(peaks) / len(peaks), max(peaks)))
+        for pid, (traced, resident) in sorted(self.worker_peaks.items()):
+            lines.append('Worker {0}: peak traced memory of a game {1:,} bytes, peak resident memory {2:,} bytes'.format(pid, traced, resident))
+        lines.append('Top allocation sites (objects per game):')
+        for (category, site), count in self.allocation_sites.most_common(TOP_SITES):
+            lines.append('  {0:>10.1f} {1:<12} {2}'.format(count / len(self.games), category, site))
+        lines.append('Top retention sites (bytes held at the end of a sampled turn):')
+        for site, size in self.retained_sites.most_common(TOP_SITES):
+            lines.append('  {0:>10,.0f} {1}'.format(size / max(self.snapshots, 1), site))
+        return '\n'.join(lines)
+
+def reset_peak() -> None:
+    """
+    Make the peak of the memory traced by tracemalloc (which must be tracing)
+    the memory traced now. Python 3.8 and older have no tracemalloc.reset_peak,
+    and there tracing is restarted instead, which also forgets every block
+    traced so far.
+    """
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        frames = tracemalloc.get_traceback_limit()
+        tracemalloc.stop()
+        tracemalloc.start(frames)
+
+def play_traced(bots: Sequence[Any], var_cards: Sequence[Card], seed: Any, game_index: int, in_place: bool = True) -> Tuple[List[int], int]:
+    """
+    Play a game under tracemalloc (which must be tracing) alone, and return
+    the bytes allocated since its start and still in use at the end of every
+    turn, and at the peak.
+
+    This resets the peak of the traced memory (see reset_peak), so before
+    Python 3.9 a caller that was tracing already loses its traces.
+    """
+    reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    stepper = GameStepper(Game.setup(bots, var_cards, in_place=in_place, seed=seed, game_index=game_index))
+    traced = []
+    while not stepper.finished():
+        stepper.step_turn()
+        traced.append(tracemalloc.get_traced_memory()[0] - start)
+    return traced, tracemalloc.get_traced_memory()[1] - start
+
+def profile_game(bots: Sequence[Any], var_cards: Sequence[Card], seed: Any, game_index: int, in_place: bool = True, snapshot_every: int = 5) -> Tuple[GameMemory, Counter, Counter, int]:
+    """
+    Measure the memory of a game turn by turn, with tracemalloc tracing.
+    Returns the measurements, the allocation sites, the retention sites
+    summed over the snapshots, and the number of snapshots.
+
+    The game is played twice from its seed: once under tracemalloc alone, so
+    that the traced memory leaves out the bookkeeping of the profiler, and
+    once with an AllocationCounter installed.
+    """
+    traced, peak = play_traced(bots, var_cards, seed, game_index, in_place)
+
+    counter = AllocationCounter()
+    retained_sites: Counter = Counter()
+    snapshots = 0
+    snapshot_filters = [
+        tracemalloc.Filter(True, os.path.join(ENGINE_DIRECTORY, '*')),
+        tracemalloc.Filter(False, __file__),
+    ]
+    counter.install()
+    try:
+        stepper = GameStepper(Game.setup(bots, var_cards, in_place=in_place, seed=seed, game_index=game_index))
+        turns: List[TurnMemory] = []
+        previous: Counter = Counter()
+        while not stepper.finished():
+            turn = stepper.turns
+            stepper.step_turn()
+            turns.append(TurnMemory(
+                dict(counter.counts - previous),
+                dict(retained_bytes(stepper.game)),
+                traced[turn] if turn < len(traced) else 0,
+            ))
+            previous = Counter(counter.counts)
+            if turn % snapshot_every == 0:
+                snapshots += 1
+                snapshot = tracemalloc.take_snapshot().filter_traces(snapshot_filters)
+                for stat in snapshot.statistics('lineno'):
+                    frame = stat.traceback[0]
+                    retained_sites['{0}:{1}'.format(os.path.basename(frame.filename), frame.lineno)] += stat.size
+    finally:
+        counter.uninstall()
+    return GameMemory(game_index, turns, peak), counter.sites, retained_sites, snapshots
+
+def profile_games(bots: Sequence[Any], indices: Sequence[int], seed: Any, var_cards: Sequence[Card] = BASE_ACTIONS, in_place: bool = True, snapshot_every: int = 5) -> MemoryReport:
+    """
+    Profile the games of the given indices in this process. Tracing is
+    started for them unless it is already on (but see play_traced).
+    """
+    games = []
+    allocation_sites: Counter = Counter()
+    retained_sites: Counter = Counter()
+    snapshots = 0
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        worker_peak = 0
+        for game_index in indices:
+            game, allocated, retained, taken = profile_game(bots, var_cards, seed, game_index, in_place, snapshot_every)
+            games.append(game)
+            allocation_sites.update(allocated)
+            retained_sites.update(retained)
+            snapshots += taken
+            worker_peak = max(worker_peak, game.peak_bytes)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    resident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return MemoryReport(games, allocation_sites, retained_sites, snapshots, {os.getpid(): (worker_peak, resident)})
+
+def _profile_chunk(args: Tuple[Sequence[Any], Sequence[int], Any, Sequence[Card], bool, int]) -> MemoryReport:
+    return profile_games(*args)
+
+def profile_games_parallel(bots: Sequence[Any], n: int, seed: Any, var_cards: Sequence[Card] = BASE_ACTIONS, in_place: bool = True, workers: int = 1, snapshot_every: int = 5) -> MemoryReport:
+    "Profile games 0 to n-1, spread over a pool of workers."
+    chunks = [list(range(i, n, workers)) for i in range(workers)]
+    args = [(bots, chunk, seed, var_cards, in_place, snapshot_every) for chunk in chunks if chunk]
+    if workers > 1:
+        with Pool(workers) as pool:
+            reports = pool.map(_profile_chunk, args)
+    else:
+        reports = [_profile_chunk(chunk_args) for chunk_args in args]
+    report = reports[0]
+    for other in reports[1:]:
+        report = report.merge(other)
+    return report
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+
+    parser.add_argument('--games', type=int, default=4)
+    parser.add_argument('--seed', default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--persistent', action='store_true', help='Profile persistent games instead of in-place ones')
+    parser.add_argument('--snapshot-every', type=int, default=5, help='Turns between tracemalloc snapshots')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    from basic_ai import Terminal_Draw_Big_Money
+    from cards import Witch, Militia
+
+    args = parse_args()
+    bots = [Terminal_Draw_Big_Money([Witch]), Terminal_Draw_Big_Money([Militia])]
+    print(profile_games_parallel(bots, args.games, args.seed, in_place=not args.persistent, workers=args.workers, snapshot_every=args.snapshot_every))
@@ -0,0 +1,92 @@
+"""
+Common random numbers for comparing bots.
+
+compare_bots_paired plays games in groups of one game per seating rotation
+of the bots (for two bots, a pair of seat-swapped games). The games of a
+group share their seed and kingdom, and every seat draws from its own
+shuffle stream, so where the decks of two bots agree they draw the same
+cards. Luck then largely cancels out within a group, and estimates taken
+over the group means vary less than estimates over independent games.
+
+The report compares the standard errors of both kinds of estimates; the
+variance reduction is the factor by which independent games would need to
+be more numerous to reach the same precision.
+"""
+from statistics import mean, variance
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+from game import Card
+from cards import BASE_ACTIONS
+from parallel import Comparison, GameResult, run_tasks, chunk_tasks, DEFAULT_CHUNK_SIZE
+
+class PairedReport(NamedTuple):
+    """
+    The outcome of paired games, from the point of view of the first bot:
+    its win rate and its score minus the mean score of the other bots, each
+    with its standard error over the groups (paired) and the standard error
+    the same number of independent games would have had.
+    """
+    comparison: Comparison
+    groups: int
+    win_rate: float
+    win_rate_error: float
+    independent_win_rate_error: float
+    score_margin: float
+    score_margin_error: float
+    independent_score_margin_error: float
+
+    def win_rate_variance_reduction(self) -> float:
+        return variance_ratio(self.independent_win_rate_error, self.win_rate_error)
+
+    def score_margin_variance_reduction(self) -> float:
+        return variance_ratio(self.independent_score_margin_error, self.score_margin_error)
+
+    def __str__(self) -> str:
+        return (
+            '{0}: win rate {1:.3f} +- {2:.3f} (independent games: +- {3:.3f}, variance reduction x{4:.2f}), '
+            'score margin {5:.2f} +- {6:.2f} (independent games: +- {7:.2f}, variance reduction x{8:.2f}) '
+            'over {9} groups of {10} games'
+        ).format(
+            self.comparison.bots[0].name,
+            self.win_rate, self.win_rate_error, self.independent_win_rate_error,
+            self.win_rate_variance_reduction(),
+            self.score_margin, self.score_margin_error, self.independent_score_margin_error,
+            self.score_margin_variance_reduction(),
+            self.groups, len(self.comparison.bots),
+        )
+
+def variance_ratio(independent_error: float, paired_error: float) -> float:
+    if not paired_error:
+        return float('inf') if independent_error else 1.0
+    return (independent_error / paired_error) ** 2
+
+def standard_error(values: List[float]) -> float:
+    return (variance(values) / len(values)) ** 0.5 if len(values) > 1 else 0.0
+
+def compare_bots_paired(bots: Sequence[Any], groups: int, seed: Any, var_cards: Sequence[Card] = BASE_ACTIONS, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE) -> PairedReport:
+    "Play groups of seat-rotated games with common random numbers between the bots."
+    k = len(bots)
+    comparison = Comparison(bots)
+    tasks = chunk_tasks(tuple(range(k)), groups * k, seed, chunk_size, paired=True)
+    wins: List[float] = []
+    margins: List[float] = []
+    by_group: Dict[int, List[GameResult]] = {}
+    for task, results in run_tasks(bots, var_cards, tasks, workers):
+        for result in results:
+            comparison.add(result)
+            wins.append(1.0 if result.winner == 0 else 0.0)
+            margins.append(result.scores[0] - mean(result.scores[1:]))
+            by_group.setdefault(result.game_index // k, []).append(result)
+
+    group_wins = [mean(1.0 if r.winner == 0 else 0.0 for r in by_group[g]) for g in sorted(by_group)]
+    group_margins = [mean(r.scores[0] - mean(r.scores[1:]) for r in by_group[g]) for g in sorted(by_group)]
+    return PairedReport(
+        comparison,
+        groups,
+        mean(wins),
+        standard_error(group_wins),
+        standard_error(wins),
+        mean(margins),
+        standard_error(group_margins),
+        standard_error(margins),
+    )
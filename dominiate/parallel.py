@@ -0,0 +1,202 @@
+"""
+Play many games between bots on a pool of worker processes.
+
+Game i of a run is set up from the master seed and game index i (see
+Game.setup), so it is the same game whichever worker plays it. Games are
+handed out in chunks of consecutive indices, and results come back in index
+order, so a run gives identical results for any number of workers.
+
+Bots are sent to each worker once, and every worker plays with its own
+copies. Bots that learn from the games they play would therefore see
+different games with different numbers of workers.
+"""
+from collections import Counter
+from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from game import Game, GameStepper, Card
+from cards import BASE_ACTIONS
+from replay import RecordingStepper
+
+# Two-player games take a few milliseconds, so tasks need to hold a few of
+# them to outweigh the cost of sending them to a worker.
+DEFAULT_CHUNK_SIZE = 16
+
+class GameResult(NamedTuple):
+    """
+    The outcome of one game. Scores, seats and final decks are given in the
+    order of the bots, and winner is the index of the winning bot: the best
+    score, ties going to the earliest seat.
+    """
+    game_index: int
+    scores: Tuple[int, ...]
+    seats: Tuple[int, ...]
+    winner: int
+    turns: int
+    decks: Tuple[Dict[Card, int], ...] = ()
+    replay: bytes = b''
+
+class Comparison(object):
+    """
+    Win counts and score distributions of the bots over a number of games.
+    """
+    def __init__(self, bots: Sequence[Any]) -> None:
+        self.bots = list(bots)
+        self.games = 0
+        self.wins = [0] * len(bots)
+        self.scores: List[Counter] = [Counter() for bot in bots]
+
+    def add(self, result: GameResult) -> None:
+        self.games += 1
+        self.wins[result.winner] += 1
+        for counter, score in zip(self.scores, result.scores):
+            counter[score] += 1
+
+    def merge(self, other: 'Comparison') -> None:
+        assert len(other.bots) == len(self.bots)
+        self.games += other.games
+        for i in range(len(self.bots)):
+            self.wins[i] += other.wins[i]
+            self.scores[i].update(other.scores[i])
+
+    def win_counts(self) -> dict:
+        "Wins by bot, the way compare_bots reports them."
+        return dict(zip(self.bots, self.wins))
+
+    def mean_scores(self) -> List[float]:
+        return [
+            sum(score * count for score, count in counter.items()) / max(self.games, 1)
+            for counter in self.scores
+        ]
+
+def play_game(bots: Sequence[Any], var_cards: Sequence[Card], seed: Any, game_index: int, rotate: bool = False, paired: bool = False, record: bool = False) -> GameResult:
+    """
+    Play game game_index between the bots. By default the bots are seated
+    in a random order; with rotate=True, game i seats them in their order
+    rotated by i places, so that every bot takes every seat in turn.
+
+    With paired=True, the games also come in groups of len(bots) that share
+    their random streams: game i is set up as game i // len(bots) of the
+    seed, so every seat shuffles the same way whichever bot sits in it
+    (common random numbers).
+
+    With record=True, the result carries the replay log of the game (see
+    replay.py).
+    """
+    if rotate or paired:
+        shift = game_index % len(bots)
+        seating = list(bots[shift:]) + list(bots[:shift])
+    else:
+        seating = list(bots)
+    streams = game_index // len(bots) if paired else game_index
+    game = Game.setup(seating, var_cards, in_place=True, seed=seed, game_index=streams, shuffle_seats=not (rotate or paired))
+    stepper = RecordingStepper(game, var_cards) if record else GameStepper(game)
+    results = stepper.run()
+    scores = [0] * len(bots)
+    seats = [0] * len(bots)
+    decks: List[Dict[Card, int]] = [{}] * len(bots)
+    for seat, (bot, score) in enumerate(results):
+        scores[bots.index(bot)] = score
+        seats[bots.index(bot)] = seat
+        decks[bots.index(bot)] = dict(stepper.game.playerstates[seat].deck_counts)
+    best = max(score for (bot, score) in results)
+    winner = next(bots.index(bot) for (bot, score) in results if score == best)
+    replay = bytes(stepper.log) if record else b''
+    return GameResult(game_index, tuple(scores), tuple(seats), winner, stepper.turns, tuple(decks), replay)
+
+class GameTask(NamedTuple):
+    """
+    A chunk of games to play: games start to stop-1 between the bots at the
+    given indices (a table), set up from the given seed.
+    """
+    table: Tuple[int, ...]
+    seed: Any
+    start: int
+    stop: int
+    rotate: bool = False
+    paired: bool = False
+    record: bool = False
+
+def chunk_tasks(table: Tuple[int, ...], n: int, seed: Any, chunk_size: int = DEFAULT_CHUNK_SIZE, rotate: bool = False, first: int = 0, paired: bool = False, record: bool = False) -> List[GameTask]:
+    "Split games first to n-1 of a table into tasks of chunk_size games."
+    return [
+        GameTask(table, seed, start, min(start + chunk_size, n), rotate, paired, record)
+        for start in range(first, n, chunk_size)
+    ]
+
+def play_task(bots: Sequence[Any], var_cards: Sequence[Card], task: GameTask) -> List[GameResult]:
+    table = [bots[i] for i in task.table]
+    return [
+        play_game(table, var_cards, task.seed, i, task.rotate, task.paired, task.record)
+        for i in range(task.start, task.stop)
+    ]
+
+# The bots and kingdom of a worker process, set by _init_worker.
+_worker_setup: Optional[Tuple[List[Any], List[Card]]] = None
+
+def _init_worker(bots: List[Any], var_cards: List[Card]) -> None:
+    global _worker_setup
+    _worker_setup = (bots, var_cards)
+
+def _play_task(task: GameTask) -> List[GameResult]:
+    bots, var_cards = _worker_setup
+    return play_task(bots, var_cards, task)
+
+class GamePool(object):
+    """
+    Plays tasks between a fixed list of bots, on a pool of worker processes
+    if workers is above 1 or else in this process. Use it as a context
+    manager to keep the same workers for many calls to run().
+    """
+    def __init__(self, bots: Sequence[Any], var_cards: Sequence[Card], workers: int = 1) -> None:
+        self.bots = list(bots)
+        self.var_cards = list(var_cards)
+        self.workers = workers
+        self.pool: Optional[Any] = None
+
+    def __enter__(self) -> 'GamePool':
+        if self.workers > 1:
+            self.pool = Pool(self.workers, initializer=_init_worker, initargs=(self.bots, self.var_cards))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def run(self, tasks: Sequence[GameTask]) -> Iterator[Tuple[GameTask, List[GameResult]]]:
+        """
+        Play the tasks and yield each task with its results, in the order of
+        the tasks, as they come in.
+        """
+        if self.pool is None:
+            for task in tasks:
+                yield task, play_task(self.bots, self.var_cards, task)
+        else:
+            yield from zip(tasks, self.pool.imap(_play_task, tasks))
+
+def run_tasks(bots: Sequence[Any], var_cards: Sequence[Card], tasks: Sequence[GameTask], workers: int = 1) -> Iterator[Tuple[GameTask, List[GameResult]]]:
+    "Play the tasks on a GamePool of their own."
+    with GamePool(bots, var_cards, workers) as pool:
+        yield from pool.run(tasks)
+
+def stream_games(bots: Sequence[Any], n: int, seed: Any, var_cards: Sequence[Card] = BASE_ACTIONS, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[GameResult]:
+    """
+    Play games 0 to n-1 between the bots, on a pool of workers if workers
+    is above 1, and yield their results in game index order as they come in.
+    """
+    tasks = chunk_tasks(tuple(range(len(bots))), n, seed, chunk_size)
+    for task, results in run_tasks(bots, var_cards, tasks, workers):
+        yield from results
+
+def compare_bots_parallel(bots: Sequence[Any], n: int, seed: Any, var_cards: Sequence[Card] = BASE_ACTIONS, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE, store: Optional[Any] = None) -> Comparison:
+    """
+    Play n games between the bots and merge their results. With a store
+    (see results.py), every game is also appended to it.
+    """
+    comparison = Comparison(bots)
+    for result in stream_games(bots, n, seed, var_cards, workers, chunk_size):
+        comparison.add(result)
+        if store is not None:
+            store.append(result, seed, var_cards, bots)
+    return comparison
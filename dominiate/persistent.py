@@ -0,0 +1,121 @@
+"""
+Persistent (immutable, structurally shared) containers for game states.
+
+Updating one of these containers returns a new container that shares
+everything but the changed path with the old one, so forked games cost
+memory in proportion to their differences rather than to their size.
+"""
+from typing import Any, Iterable, Iterator, List, Optional
+
+BITS = 3
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+class PVector(object):
+    """
+    A persistent vector: a trie of tuples with WIDTH entries per node.
+
+    set() copies only the nodes on the path to the changed entry, that is
+    O(WIDTH * log_WIDTH(n)) references. Vectors of up to WIDTH entries are a
+    single tuple.
+    """
+    def __init__(self, root: tuple, size: int, shift: int) -> None:
+        self.root = root
+        self.size = size
+        self.shift = shift
+
+    @staticmethod
+    def of(items: Iterable[Any]) -> 'PVector':
+        "Build a vector holding the given items."
+        nodes = tuple(items)
+        size = len(nodes)
+        shift = 0
+        while len(nodes) > WIDTH:
+            nodes = tuple(
+                nodes[i:i + WIDTH]
+                for i in range(0, len(nodes), WIDTH)
+            )
+            shift += BITS
+        return PVector(nodes, size, shift)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: int) -> Any:
+        if not self.shift:
+            return self.root[index]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        node = self.root
+        shift = self.shift
+        while shift:
+            node = node[(index >> shift) & MASK]
+            shift -= BITS
+        return node[index & MASK]
+
+    def set(self, index: int, value: Any) -> 'PVector':
+        "Return a new vector with one entry replaced."
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        if not self.shift:
+            root = self.root
+            return PVector(root[:index] + (value,) + root[index + 1:], self.size, 0)
+        return PVector(self._set(self.root, self.shift, index, value), self.size, self.shift)
+
+    def _set(self, node: tuple, shift: int, index: int, value: Any) -> tuple:
+        slot = (index >> shift) & MASK
+        if shift:
+            value = self._set(node[slot], shift - BITS, index, value)
+        return node[:slot] + (value,) + node[slot + 1:]
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._iter(self.root, self.shift)
+
+    def _iter(self, node: tuple, shift: int) -> Iterator[Any]:
+        if shift:
+            for child in node:
+                yield from self._iter(child, shift - BITS)
+        else:
+            yield from node
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+class PList(object):
+    """
+    A persistent stack. Pushing is O(1) and shares the whole older stack.
+    Iteration goes from the oldest item to the newest.
+    """
+    def __init__(self, head: Any = None, rest: Optional['PList'] = None) -> None:
+        self.head = head
+        self.rest = rest
+        self.size = 0 if rest is None else rest.size + 1
+
+    def push(self, item: Any) -> 'PList':
+        return PList(item, self)
+
+    def extend(self, items: Iterable[Any]) -> 'PList':
+        plist = self
+        for item in items:
+            plist = PList(item, plist)
+        return plist
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Any]:
+        items: List[Any] = []
+        node = self
+        while node.rest is not None:
+            items.append(node.head)
+            node = node.rest
+        return reversed(items)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+EMPTY_PLIST = PList()
@@ -1,13 +1,29 @@
 import logging
+from time import perf_counter
 from typing import Dict, Optional, List
 
 from game import Game, BuyDecision, ActDecision, TrashDecision, DiscardDecision, MultiDecision, GainDecision, INF, NO_CARD
+from game import CARD_TREASURE, CARD_COINS, CARD_ACTIONS, CARD_CARDS, IS_ACTION, IS_PURE_VICTORY
 from cards import Card, Copper, Silver, Gold, Curse, Estate, Duchy, Province
 
 class Player(object):
+    # The perf_counter() time by which the decision being made should be
+    # made, when it has a time budget (see latency.py).
+    deadline: Optional[float] = None
+
     def __init__(self, *args) -> None:
         raise NotImplementedError("Player is an abstract class")
 
+    def time_left(self) -> float:
+        """
+        The seconds left to make the current decision, or INF if it has no
+        time budget. Bots that can think for longer or shorter, such as
+        HillClimbBot, stop when this runs out.
+        """
+        if self.deadline is None:
+            return INF
+        return self.deadline - perf_counter()
+
     def make_decision(self, decision, state) -> None:
         assert state.player is self # pragma: no cover
         raise NotImplementedError
@@ -140,11 +156,25 @@ class BigMoney(AIPlayer):
         else:
             return [None, Silver, Gold, Province]
 
+    def buy_priority(self, decision, card: Optional[Card]) -> float:
+        """
+        Assign a numerical priority to each card that can be bought: its
+        place in buy_priority_order, or -1 if it is not there.
+        """
+        order = self.buy_priority_order(decision.game, decision)
+        if card in order:
+            return order.index(card)
+        return -1
+
     def make_buy_decision(self, game, decision) -> Optional[Card]:
         """
         Choose a card to buy.
+
+        By default, this chooses the card with the highest buy_priority.
         """
-        return self.buy_priority_order(game, decision)
+        choices = decision.choices()
+        choices.sort(key=lambda card: self.buy_priority(decision, card))
+        return choices[-1]
 
     def act_priority(self, decision, card: Card) -> int:
         """
@@ -169,8 +199,8 @@ class BigMoney(AIPlayer):
 
     def make_trash_decision_incremental(self, decision, choices, allow_none=True) -> Optional[Card]:
         "Choose a single card to trash."
-        deck = decision.state().all_cards()
-        money = sum([card.treasure + card.coins for card in deck])
+        deck_counts = decision.state().deck_counts
+        money = sum([(CARD_TREASURE[card.id] + CARD_COINS[card.id]) * count for (card, count) in deck_counts.items()])
         if Curse in choices:
             return Curse
         elif Copper in choices and money > 3:
@@ -202,21 +232,17 @@ class BigMoney(AIPlayer):
                 decision, choices,
                 allow_none = (len(chosen) >= decision.min)
             )
-            print(latest)
             if latest is not NO_CARD:
                 choices.remove(latest)
                 chosen.append(latest)
         return chosen
 
     def make_discard_decision_incremental(self, decision, choices: List[Card], allow_none: bool = True) -> Optional[Card]:
-        actions_sorted = [card for card in choices if card.is_action()]
-        actions_sorted.sort(key=lambda a: a.actions)
-        plus_actions = sum([ca.actions for ca in actions_sorted])
+        actions_sorted = [card for card in choices if IS_ACTION[card.id]]
+        actions_sorted.sort(key=lambda a: CARD_ACTIONS[a.id])
+        plus_actions = sum([CARD_ACTIONS[ca.id] for ca in actions_sorted])
         wasted_actions = len(actions_sorted) - plus_actions - decision.state().actions
-        victory_cards = [
-            card for card in choices
-            if card.is_victory() and not card.is_action() and not card.is_treasure()
-        ]
+        victory_cards = [card for card in choices if IS_PURE_VICTORY[card.id]]
         if wasted_actions > 0:
             return actions_sorted[0]
         elif len(victory_cards):
@@ -227,7 +253,7 @@ class BigMoney(AIPlayer):
             return NO_CARD
         else:
             priority_order = sorted(choices,
-              key=lambda ca: (ca.actions, ca.cards, ca.coins, ca.treasure))
+              key=lambda ca: (CARD_ACTIONS[ca.id], CARD_CARDS[ca.id], CARD_COINS[ca.id], CARD_TREASURE[ca.id]))
             return priority_order[0]
 
     def make_discard_decision(self, decision) -> List[Card]:
@@ -0,0 +1,268 @@
+"""
+Compact binary replay logs.
+
+A game is fully determined by its seed, game index, kingdom and seating
+(see Game.setup) and by the moves its players make, so a replay log stores
+just those. Every integer is a varint (7 bits per byte, low bits first),
+and every string is its length followed by its UTF-8 bytes:
+
+    MAGIC
+    seed (as a string), game index
+    number of kingdom cards, kingdom card names
+    number of players, player names in seat order
+    moves, until the end of the log
+
+A move is what the player chose at a decision, as published on the event bus
+of the game (every decision publishes one Play, Buy, Gain, Trash or Discard
+event when it is made, see events.py). Single cards (actions, buys, gains)
+are written as one number: 0 for no card, or 1 + the index of the card in the
+sorted supply of the game. Lists of cards (trashes, discards) are written as
+their length followed by the card numbers. Most moves take one byte, and a
+two-player game takes a few hundred bytes.
+
+A Replay plays the moves back through a GameStepper, without the bots, and
+can stop at the start of any turn. ReplayFile keeps many logs in one file.
+"""
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from game import Game, GameStepper, Card, CARDS, NO_CARD, MultiDecision
+from events import EventBus, EVENT_TYPES, Play, Buy, Gain, Trash, Discard
+from players import Player
+
+MAGIC = b'DRP1'
+
+def write_varint(out: bytearray, value: int) -> None:
+    assert value >= 0
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    "Read a varint at the offset, and return it with the offset after it."
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def write_string(out: bytearray, text: str) -> None:
+    encoded = text.encode('utf-8')
+    write_varint(out, len(encoded))
+    out.extend(encoded)
+
+def read_string(data: bytes, offset: int) -> Tuple[str, int]:
+    length, offset = read_varint(data, offset)
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+def supply_cards(game: Game) -> List[Card]:
+    "The cards of the supply of a game, in the order replay logs number them."
+    return sorted(game.card_counts, key=lambda card: card.name)
+
+class ReplayPlayer(Player):
+    "Stands in for a bot in a replayed game."
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+class RecordingStepper(GameStepper):
+    """
+    A GameStepper that records the moves of the players into a replay log,
+    available as `log` once the game is over.
+
+    The game is given a bus of its own, `events`, which records the moves
+    from the events of the decisions, and passes the events on to the bus the
+    game was set up with. Only the types of events that bus had handlers for
+    when the stepper was made are passed on, so that nothing else is built.
+    """
+    def __init__(self, game: Game, kingdom: Sequence[Card], max_rounds: int = 300) -> None:
+        self.log = bytearray(MAGIC)
+        write_string(self.log, str(game.seed))
+        write_varint(self.log, game.game_index)
+        write_varint(self.log, len(kingdom))
+        for card in kingdom:
+            write_string(self.log, card.name)
+        write_varint(self.log, len(game.playerstates))
+        for state in game.playerstates:
+            write_string(self.log, str(state.player))
+        self.card_numbers = {card: i + 1 for i, card in enumerate(supply_cards(game))}
+        self.events = EventBus()
+        for event_type in EVENT_TYPES:
+            if event_type in game.events.handlers:
+                self.events.subscribe(event_type, game.events.publish)
+        self.events.subscribe(Play, self.record_card)
+        self.events.subscribe(Buy, self.record_card)
+        self.events.subscribe(Gain, self.record_gain)
+        self.events.subscribe(Trash, self.record_cards)
+        self.events.subscribe(Discard, self.record_cards)
+        super().__init__(game._update(events=self.events), max_rounds)
+
+    def write_card(self, card: Optional[Card]) -> None:
+        write_varint(self.log, 0 if card is NO_CARD else self.card_numbers[card])
+
+    def record_card(self, event: Any) -> None:
+        self.write_card(event.card)
+
+    def record_gain(self, event: Gain) -> None:
+        self.write_card(event.cards[0] if event.cards else NO_CARD)
+
+    def record_cards(self, event: Any) -> None:
+        write_varint(self.log, len(event.cards))
+        for card in event.cards:
+            self.write_card(card)
+
+class Replay(object):
+    """
+    A game read back from its replay log. game_at(turn) rebuilds the game
+    as it was at the start of a turn (0 being the first turn), and final()
+    as it ended.
+    """
+    def __init__(self, log: bytes) -> None:
+        if log[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a replay log')
+        self.log = log
+        offset = len(MAGIC)
+        self.seed, offset = read_string(log, offset)
+        self.game_index, offset = read_varint(log, offset)
+        count, offset = read_varint(log, offset)
+        cards_by_name = {card.name: card for card in CARDS}
+        self.kingdom: List[Card] = []
+        for _ in range(count):
+            name, offset = read_string(log, offset)
+            if name not in cards_by_name:
+                raise ValueError('Unknown card {0!r} in replay log'.format(name))
+            self.kingdom.append(cards_by_name[name])
+        count, offset = read_varint(log, offset)
+        self.players: List[str] = []
+        for _ in range(count):
+            name, offset = read_string(log, offset)
+            self.players.append(name)
+        self.moves_offset = offset
+
+    def setup(self, in_place: bool = True, events: Optional[EventBus] = None) -> Game:
+        "The game at its start, with stand-ins for the players."
+        return Game.setup(
+            [ReplayPlayer(name) for name in self.players],
+            self.kingdom,
+            in_place=in_place,
+            events=EventBus() if events is None else events,
+            seed=self.seed,
+            game_index=self.game_index,
+            shuffle_seats=False,
+        )
+
+    def steps(self, in_place: bool = True, events: Optional[EventBus] = None) -> Iterator[GameStepper]:
+        """
+        Replay the game, and yield its stepper at the start of every turn and
+        at the end. An in-place game is changed as the replay goes on.
+        """
+        stepper = GameStepper(self.setup(in_place, events))
+        cards = [NO_CARD] + supply_cards(stepper.game)
+        log = self.log
+        offset = self.moves_offset
+        turns = -1
+        while stepper.decision is not None:
+            if stepper.turns != turns:
+                turns = stepper.turns
+                yield stepper
+            if isinstance(stepper.decision, MultiDecision):
+                count, offset = read_varint(log, offset)
+                move = []
+                for _ in range(count):
+                    number, offset = read_varint(log, offset)
+                    move.append(cards[number])
+            else:
+                number, offset = read_varint(log, offset)
+                move = cards[number]
+            stepper.choose(move)
+        if offset != len(log):
+            raise ValueError('Replay log has moves after the end of the game')
+        yield stepper
+
+    def game_at(self, turn: int, in_place: bool = True, events: Optional[EventBus] = None) -> Game:
+        "The game at the start of the given turn, or at its end if it is over by then."
+        for stepper in self.steps(in_place, events):
+            if stepper.turns >= turn:
+                break
+        return stepper.game
+
+    def final(self, events: Optional[EventBus] = None) -> Tuple[Game, List[Tuple[Any, int]]]:
+        "The game as it ended, and its scores."
+        for stepper in self.steps(True, events):
+            pass
+        return stepper.game, stepper.scores
+
+def record_game(bots: Sequence[Any], var_cards: Sequence[Card], seed: Any, game_index: int = 0, shuffle_seats: bool = True) -> Tuple[List[Tuple[Any, int]], bytes]:
+    "Play a game between the bots, and return its scores and replay log."
+    game = Game.setup(bots, var_cards, in_place=True, seed=seed, game_index=game_index, shuffle_seats=shuffle_seats)
+    stepper = RecordingStepper(game, var_cards)
+    return stepper.run(), bytes(stepper.log)
+
+class ReplayFile(object):
+    """
+    Many replay logs in one file, each preceded by its length. Open it with
+    mode 'ab' to append logs, or 'rb' to read them.
+    """
+    def __init__(self, path: str, mode: str = 'rb') -> None:
+        assert mode in ('rb', 'ab')
+        self.path = path
+        self.file: BinaryIO = open(path, mode)
+        self.index: Optional[Dict[Tuple[str, int], List[int]]] = None
+
+    def __enter__(self) -> 'ReplayFile':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def append(self, log: bytes) -> None:
+        header = bytearray()
+        write_varint(header, len(log))
+        self.file.write(header)
+        self.file.write(log)
+
+    def _read_log(self) -> Optional[bytes]:
+        "Read the log at the current position, or None at the end of the file."
+        length = 0
+        shift = 0
+        while True:
+            byte = self.file.read(1)
+            if not byte:
+                assert not shift, 'Truncated replay file'
+                return None
+            length |= (byte[0] & 0x7f) << shift
+            if byte[0] < 0x80:
+                return self.file.read(length)
+            shift += 7
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        "Yield the offset and log of every replay in the file."
+        self.file.seek(0)
+        while True:
+            offset = self.file.tell()
+            log = self._read_log()
+            if log is None:
+                return
+            yield offset, log
+
+    def find(self, seed: Any, game_index: int) -> List[Replay]:
+        """
+        The replays of the games set up from the seed and game index (several
+        for the seat-rotated games of compare_bots_paired).
+        """
+        if self.index is None:
+            self.index = {}
+            for offset, log in self:
+                replay = Replay(log)
+                self.index.setdefault((replay.seed, replay.game_index), []).append(offset)
+        replays = []
+        for offset in self.index.get((str(seed), game_index), ()):
+            self.file.seek(offset)
+            replays.append(Replay(self._read_log()))
+        return replays
@@ -0,0 +1,282 @@
+"""
+An append-only, columnar store of game results.
+
+A ResultStore is a directory of segments, one compressed NumPy archive per
+batch of games, and a manifest that describes them. Every segment holds the
+same columns, one array per column with a row per game:
+
+- game_index, seed, kingdom, players, winner, turns: one value per game.
+  Seeds and kingdoms are stored as indices into the lists of distinct seeds
+  and kingdoms of the manifest.
+- bot, seat, score: one value per player, in the order of the bots, padded
+  with -1 (bot, seat) or 0 (score) up to the largest table of the segment.
+  Bots are indices into the list of bot names of the manifest.
+- deck: the final deck counts of every player, with a third axis over the
+  cards listed in the deck_cards array of the segment, which are indices
+  into the list of card names of the manifest.
+
+Appended results are kept in memory until batch_size of them are waiting,
+and then written as a new segment; flush() writes them early. Files are
+never modified once written, and the manifest is replaced atomically after
+each segment, so a store that is being written to can be read at any time.
+Only one process should write to a store at a time.
+
+Scans go segment by segment and only decompress the columns they need.
+The manifest keeps the bots, seeds and kingdoms of every segment, so scans
+filtered on those skip whole segments without opening them.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from game import Card
+from parallel import GameResult
+
+DEFAULT_BATCH_SIZE = 65536
+
+MANIFEST = 'manifest.json'
+
+GAME_COLUMNS = ('game_index', 'seed', 'kingdom', 'players', 'winner', 'turns')
+PLAYER_COLUMNS = ('bot', 'seat', 'score')
+COLUMNS = GAME_COLUMNS + PLAYER_COLUMNS + ('deck',)
+
+class BotStats(NamedTuple):
+    "The totals of one bot over the games of a scan."
+    games: int
+    wins: int
+    score: int
+    turns: int
+
+    def win_rate(self) -> float:
+        return self.wins / self.games if self.games else 0.0
+
+    def mean_score(self) -> float:
+        return self.score / self.games if self.games else 0.0
+
+    def mean_turns(self) -> float:
+        return self.turns / self.games if self.games else 0.0
+
+class ResultStore(object):
+    """
+    A results store in the directory at path, created if needed. Use it as
+    a context manager to flush the last results on exit.
+    """
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        else:
+            manifest = dict(bots=[], cards=[], seeds=[], kingdoms=[], segments=[])
+        self.bots: List[str] = manifest['bots']
+        self.cards: List[str] = manifest['cards']
+        self.seeds: List[str] = manifest['seeds']
+        self.kingdoms: List[List[int]] = manifest['kingdoms']
+        self.segments: List[Dict[str, Any]] = manifest['segments']
+        self._ids: Dict[str, Dict[Any, int]] = {
+            'bots': {name: i for i, name in enumerate(self.bots)},
+            'cards': {name: i for i, name in enumerate(self.cards)},
+            'seeds': {seed: i for i, seed in enumerate(self.seeds)},
+            'kingdoms': {tuple(kingdom): i for i, kingdom in enumerate(self.kingdoms)},
+        }
+        self._pending: List[Any] = []
+
+    def __enter__(self) -> 'ResultStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+    def __len__(self) -> int:
+        "The number of games written to the store."
+        return sum(segment['rows'] for segment in self.segments)
+
+    def _id(self, table: str, key: Any) -> int:
+        ids = self._ids[table]
+        if key not in ids:
+            ids[key] = len(ids)
+            getattr(self, table).append(list(key) if table == 'kingdoms' else key)
+        return ids[key]
+
+    def kingdom_id(self, kingdom: Sequence[Card]) -> int:
+        "The index of a kingdom, whatever the order of its cards."
+        return self._id('kingdoms', tuple(sorted(self._id('cards', card.name) for card in kingdom)))
+
+    def append(self, result: GameResult, seed: Any, kingdom: Sequence[Card], bots: Sequence[Any]) -> None:
+        """
+        Add the result of a game between the bots (or bot names), set up from
+        the seed with the kingdom cards, and write a segment if a batch is
+        full.
+        """
+        assert len(bots) == len(result.scores)
+        self._pending.append((
+            result,
+            self._id('seeds', str(seed)),
+            self.kingdom_id(kingdom),
+            [self._id('bots', str(bot)) for bot in bots],
+            [{self._id('cards', card.name): count for card, count in deck.items()} for deck in result.decks],
+        ))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        "Write the pending results as a new segment."
+        if not self._pending:
+            return
+        rows = len(self._pending)
+        seats = max(len(result.scores) for result, *_ in self._pending)
+        deck_cards = sorted({card for *_, decks in self._pending for deck in decks for card in deck})
+        column_of = {card: i for i, card in enumerate(deck_cards)}
+        columns = dict(
+            game_index=np.empty(rows, np.int64),
+            seed=np.empty(rows, np.int32),
+            kingdom=np.empty(rows, np.int32),
+            players=np.empty(rows, np.int8),
+            winner=np.empty(rows, np.int8),
+            turns=np.empty(rows, np.int16),
+            bot=np.full((rows, seats), -1, np.int32),
+            seat=np.full((rows, seats), -1, np.int8),
+            score=np.zeros((rows, seats), np.int16),
+            deck=np.zeros((rows, seats, len(deck_cards)), np.uint8),
+            deck_cards=np.array(deck_cards, np.int32),
+        )
+        for row, (result, seed, kingdom, bots, decks) in enumerate(self._pending):
+            n = len(bots)
+            columns['game_index'][row] = result.game_index
+            columns['seed'][row] = seed
+            columns['kingdom'][row] = kingdom
+            columns['players'][row] = n
+            columns['winner'][row] = result.winner
+            columns['turns'][row] = result.turns
+            columns['bot'][row, :n] = bots
+            columns['seat'][row, :n] = result.seats
+            columns['score'][row, :n] = result.scores
+            for player, deck in enumerate(decks):
+                for card, count in deck.items():
+                    columns['deck'][row, player, column_of[card]] = count
+
+        name = 'segment-{0:06d}.npz'.format(len(self.segments))
+        temporary = os.path.join(self.path, name + '.tmp')
+        with open(temporary, 'wb') as segment_file:
+            np.savez_compressed(segment_file, **columns)
+        os.replace(temporary, os.path.join(self.path, name))
+        self.segments.append(dict(
+            file=name,
+            rows=rows,
+            bots=sorted({bot for _, _, _, bots, _ in self._pending for bot in bots}),
+            seeds=sorted({seed for _, seed, _, _, _ in self._pending}),
+            kingdoms=sorted({kingdom for _, _, kingdom, _, _ in self._pending}),
+        ))
+        self._pending = []
+        self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        manifest = dict(bots=self.bots, cards=self.cards, seeds=self.seeds, kingdoms=self.kingdoms, segments=self.segments)
+        temporary = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(temporary, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temporary, os.path.join(self.path, MANIFEST))
+
+    def scan(
+        self,
+        columns: Sequence[str] = COLUMNS,
+        bot: Optional[str] = None,
+        seed: Any = None,
+        kingdom: Optional[Sequence[Card]] = None,
+        players: Optional[int] = None,
+        where: Optional[Callable[[Any], np.ndarray]] = None,
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Yield the given columns of the games that match the filters, one
+        segment at a time: games with the named bot, from the seed, with the
+        kingdom, with that many players, and for which where(segment) is
+        true. The segment passed to where maps column names to arrays, which
+        are only read when used; it should return a boolean array with a
+        value per game.
+
+        The deck column is returned with its third axis over all the cards
+        of the store (store.cards).
+        """
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError('Unknown columns: {0}'.format(', '.join(sorted(unknown))))
+        bot_id = self._ids['bots'].get(bot, -2) if bot is not None else None
+        seed_id = self._ids['seeds'].get(str(seed), -2) if seed is not None else None
+        kingdom_id = None
+        if kingdom is not None:
+            cards = [self._ids['cards'].get(card.name, -2) for card in kingdom]
+            kingdom_id = self._ids['kingdoms'].get(tuple(sorted(cards)), -2)
+
+        for segment in self.segments:
+            if bot_id is not None and bot_id not in segment['bots']:
+                continue
+            if seed_id is not None and seed_id not in segment['seeds']:
+                continue
+            if kingdom_id is not None and kingdom_id not in segment['kingdoms']:
+                continue
+            with np.load(os.path.join(self.path, segment['file'])) as data:
+                mask = np.ones(segment['rows'], bool)
+                if bot_id is not None:
+                    mask &= (data['bot'] == bot_id).any(axis=1)
+                if seed_id is not None:
+                    mask &= data['seed'] == seed_id
+                if kingdom_id is not None:
+                    mask &= data['kingdom'] == kingdom_id
+                if players is not None:
+                    mask &= data['players'] == players
+                if where is not None:
+                    mask &= where(data)
+                if not mask.any():
+                    continue
+                selected = {column: data[column][mask] for column in columns if column != 'deck'}
+                if 'deck' in columns:
+                    deck = data['deck'][mask]
+                    selected['deck'] = np.zeros(deck.shape[:2] + (len(self.cards),), np.uint8)
+                    selected['deck'][:, :, data['deck_cards']] = deck
+            yield selected
+
+    def bot_stats(self, **filters) -> Dict[str, BotStats]:
+        """
+        The games, wins, total score and total turns of every bot over the
+        games that match the filters (see scan).
+        """
+        n = len(self.bots)
+        games = np.zeros(n, np.int64)
+        wins = np.zeros(n, np.int64)
+        score = np.zeros(n, np.int64)
+        turns = np.zeros(n, np.int64)
+        for chunk in self.scan(('bot', 'score', 'winner', 'turns'), **filters):
+            bots = chunk['bot']
+            playing = bots >= 0
+            rows = np.nonzero(playing)[0]
+            ids = bots[playing]
+            games += np.bincount(ids, minlength=n)
+            score += np.bincount(ids, weights=chunk['score'][playing], minlength=n).astype(np.int64)
+            turns += np.bincount(ids, weights=chunk['turns'][rows], minlength=n).astype(np.int64)
+            winners = bots[np.arange(len(bots)), chunk['winner']]
+            wins += np.bincount(winners, minlength=n)
+        return {
+            name: BotStats(int(games[i]), int(wins[i]), int(score[i]), int(turns[i]))
+            for i, name in enumerate(self.bots)
+            if games[i]
+        }
+
+    def mean_decks(self, bot: str, **filters) -> Dict[str, float]:
+        "The mean final deck of the named bot over the games that match the filters."
+        bot_id = self._ids['bots'].get(bot, -2)
+        total = np.zeros(len(self.cards), np.int64)
+        games = 0
+        for chunk in self.scan(('bot', 'deck'), bot=bot, **filters):
+            playing = chunk['bot'] == bot_id
+            total += chunk['deck'][playing].sum(axis=0, dtype=np.int64)
+            games += int(playing.sum())
+        return {
+            name: float(total[i]) / games
+            for i, name in enumerate(self.cards)
+            if total[i]
+        }
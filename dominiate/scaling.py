@@ -0,0 +1,168 @@
+"""
+A scaling benchmark: how fast whole games are played as the number of
+players, the size of the kingdom and the size of the decks grow.
+
+Every configuration plays the same games (games 0 to games-1 of a fixed
+seed) between Big Money bots with Smithy, Witch, Militia and Moat, in
+place, and measures games/sec. A few more games are then played under
+tracemalloc, for the peak memory of one game. Kingdoms are the first
+kingdom_size cards of KINGDOM, which start with the cards the bots buy. Decks
+start with deck_size cards, 7 Coppers for every 3 Estates.
+
+By default the benchmark varies one dimension at a time around BASE; --grid
+plays every combination instead. Every run is appended to a history file
+(one JSON object per line). Runs can be checked against a baseline saved
+with --save-baseline: a configuration whose games/sec dropped, or whose peak
+memory grew, by more than the threshold is flagged as a regression, and
+the benchmark exits with status 1.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from itertools import product
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from game import Game, GameStepper, Card, Copper, Estate, VICTORY_CARDS
+from cards import BASE_ACTIONS, Smithy, Witch, Militia, Moat
+from basic_ai import Terminal_Draw_Big_Money
+from memory import reset_peak
+
+SEED = 'scaling'
+
+BOT_CARDS = [Smithy, Witch, Militia, Moat]
+KINGDOM = BOT_CARDS + [card for card in BASE_ACTIONS if card not in BOT_CARDS]
+
+PLAYERS = tuple(range(2, max(VICTORY_CARDS) + 1))
+KINGDOM_SIZES = (len(BOT_CARDS), 8, len(KINGDOM))
+DECK_SIZES = (10, 30, 60)
+
+DEFAULT_HISTORY = 'scaling_history.jsonl'
+DEFAULT_BASELINE = 'scaling_baseline.json'
+DEFAULT_THRESHOLD = 0.1
+
+class Config(NamedTuple):
+    players: int
+    kingdom_size: int
+    deck_size: int
+
+    def key(self) -> str:
+        return 'players={0} kingdom={1} deck={2}'.format(*self)
+
+BASE = Config(2, len(KINGDOM), 10)
+
+class Measurement(NamedTuple):
+    games_per_sec: float
+    peak_bytes: int
+
+def configs(grid: bool = False) -> List[Config]:
+    "The configurations to measure: one dimension at a time around BASE, or every combination."
+    if grid:
+        return [Config(*values) for values in product(PLAYERS, KINGDOM_SIZES, DECK_SIZES)]
+    found = [BASE]
+    for players in PLAYERS:
+        found.append(BASE._replace(players=players))
+    for kingdom_size in KINGDOM_SIZES:
+        found.append(BASE._replace(kingdom_size=kingdom_size))
+    for deck_size in DECK_SIZES:
+        found.append(BASE._replace(deck_size=deck_size))
+    return sorted(set(found))
+
+def starting_deck(size: int) -> List[Card]:
+    coppers = round(size * 0.7)
+    return [Copper] * coppers + [Estate] * (size - coppers)
+
+def play(config: Config, game_index: int) -> None:
+    bots = [Terminal_Draw_Big_Money([BOT_CARDS[i % len(BOT_CARDS)]]) for i in range(config.players)]
+    game = Game.setup(
+        bots,
+        KINGDOM[:config.kingdom_size],
+        in_place=True,
+        seed=SEED,
+        game_index=game_index,
+        starting_deck=starting_deck(config.deck_size),
+    )
+    GameStepper(game).run()
+
+def measure(config: Config, games: int = 20, memory_games: int = 2) -> Measurement:
+    # one untimed game to warm up
+    play(config, games)
+    start = time.perf_counter()
+    for i in range(games):
+        play(config, i)
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for i in range(memory_games):
+            reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            play(config, i)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return Measurement(games / elapsed, peak)
+
+def regressions(results: Dict[str, Measurement], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    "Describe the configurations that got slower, or used more memory, than the baseline by more than the threshold."
+    found = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        if result.games_per_sec < before['games_per_sec'] * (1 - threshold):
+            found.append('{0}: {1:.1f} games/sec, down from {2:.1f}'.format(key, result.games_per_sec, before['games_per_sec']))
+        if result.peak_bytes > before['peak_bytes'] * (1 + threshold):
+            found.append('{0}: peak memory {1:,} bytes, up from {2:,}'.format(key, result.peak_bytes, before['peak_bytes']))
+    return found
+
+def run(configurations: Sequence[Config], games: int = 20, memory_games: int = 2) -> Dict[str, Measurement]:
+    results = {}
+    for config in configurations:
+        results[config.key()] = measurement = measure(config, games, memory_games)
+        print('{0:<32} {1:>8.1f} games/sec {2:>12,} peak bytes'.format(config.key(), *measurement))
+    return results
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+
+    parser.add_argument('--grid', action='store_true', help='Measure every combination of the dimensions')
+    parser.add_argument('--games', type=int, default=20, help='Timed games per configuration')
+    parser.add_argument('--memory-games', type=int, default=2, help='Games per configuration played under tracemalloc')
+    parser.add_argument('--label', default=None, help='Label of the run in the history, e.g. a commit')
+    parser.add_argument('--history', default=DEFAULT_HISTORY)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Save this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative change flagged as a regression')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run(configs(args.grid), args.games, args.memory_games)
+    record = dict(
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        label=args.label,
+        games=args.games,
+        results={key: measurement._asdict() for key, measurement in results.items()},
+    )
+    with open(args.history, 'a') as history_file:
+        history_file.write(json.dumps(record) + '\n')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(record, baseline_file, indent=2)
+    else:
+        try:
+            with open(args.baseline) as baseline_file:
+                baseline: Optional[Dict[str, Any]] = json.load(baseline_file)
+        except FileNotFoundError:
+            baseline = None
+        if baseline is not None:
+            found = regressions(results, baseline['results'], args.threshold)
+            for regression in found:
+                print('REGRESSION ' + regression)
+            if found:
+                sys.exit(1)
@@ -0,0 +1,131 @@
+"""
+Sequential significance testing for matchups.
+
+Instead of playing a fixed number of games, compare_bots_sequential plays
+batches of games and, after each batch, tests the win rate of the first bot
+against its fair share (1 / number of bots). It stops as soon as the test
+is conclusive, or when it reaches max_games:
+
+- method='interval' keeps a Wilson confidence interval on the win rate, and
+  stops when the interval is narrower than 2 * precision, or, without a
+  precision, when it excludes the fair share. Looking at the interval after
+  every batch makes it somewhat more likely to exclude the fair share by
+  chance than its confidence level says.
+- method='sprt' runs Wald's sequential probability ratio test of a win rate
+  of fair share - delta against fair share + delta, with error rates alpha
+  and beta, which remain valid however often the test is checked.
+
+Games are the games 0, 1, 2... of the master seed, whatever the number of
+workers, so a run always stops after the same number of games.
+"""
+from math import erf, log, sqrt
+from typing import Any, NamedTuple, Optional, Sequence, Tuple
+
+from game import Card
+from cards import BASE_ACTIONS
+from parallel import Comparison, GamePool, chunk_tasks, DEFAULT_CHUNK_SIZE
+
+METHODS = ('interval', 'sprt')
+
+def normal_quantile(p: float) -> float:
+    "The p quantile of the standard normal distribution, by bisection on its CDF."
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if (1 + erf(middle / sqrt(2))) / 2 < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+def wilson_interval(wins: int, games: int, confidence: float = 0.95) -> Tuple[float, float]:
+    "The Wilson score interval for a win rate of wins / games."
+    if not games:
+        return (0.0, 1.0)
+    z = normal_quantile((1 + confidence) / 2)
+    rate = wins / games
+    center = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    half_width = z * sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return (max(center - half_width, 0.0), min(center + half_width, 1.0))
+
+class SequentialReport(NamedTuple):
+    """
+    The outcome of a sequential matchup: the merged results, the win rate
+    of the first bot with its confidence interval, and why it stopped.
+    """
+    comparison: Comparison
+    win_rate: float
+    interval: Tuple[float, float]
+    conclusion: str
+
+    @property
+    def games(self) -> int:
+        return self.comparison.games
+
+    def __str__(self) -> str:
+        low, high = self.interval
+        return '{0}: win rate {1:.3f} [{2:.3f}, {3:.3f}] after {4} games ({5})'.format(
+            self.comparison.bots[0].name, self.win_rate, low, high, self.games, self.conclusion,
+        )
+
+def compare_bots_sequential(
+    bots: Sequence[Any],
+    seed: Any,
+    var_cards: Sequence[Card] = BASE_ACTIONS,
+    method: str = 'interval',
+    confidence: float = 0.95,
+    precision: Optional[float] = None,
+    delta: float = 0.05,
+    alpha: float = 0.05,
+    beta: float = 0.05,
+    batch_size: int = 100,
+    max_games: int = 10000,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> SequentialReport:
+    "Play batches of games between the bots until the test on the first bot's win rate is conclusive."
+    if method not in METHODS:
+        raise ValueError('Unknown method {0!r}'.format(method))
+    fair = 1 / len(bots)
+    p0, p1 = fair - delta, fair + delta
+    if not 0 < p0 < p1 < 1:
+        raise ValueError('delta must be between 0 and {0:.3f}'.format(fair))
+    upper, lower = log((1 - beta) / alpha), log(beta / (1 - alpha))
+
+    comparison = Comparison(bots)
+    table = tuple(range(len(bots)))
+    conclusion = 'game cap reached'
+    with GamePool(bots, var_cards, workers) as pool:
+        while comparison.games < max_games:
+            stop = min(comparison.games + batch_size, max_games)
+            tasks = chunk_tasks(table, stop, seed, chunk_size, first=comparison.games)
+            for task, results in pool.run(tasks):
+                for result in results:
+                    comparison.add(result)
+
+            wins, games = comparison.wins[0], comparison.games
+            if method == 'sprt':
+                llr = wins * log(p1 / p0) + (games - wins) * log((1 - p1) / (1 - p0))
+                if llr >= upper:
+                    conclusion = 'SPRT favours {0:.3f} over {1:.3f}'.format(p1, p0)
+                    break
+                if llr <= lower:
+                    conclusion = 'SPRT favours {0:.3f} over {1:.3f}'.format(p0, p1)
+                    break
+            else:
+                low, high = wilson_interval(wins, games, confidence)
+                if precision is not None:
+                    if high - low <= 2 * precision:
+                        conclusion = 'precision reached'
+                        break
+                elif not low <= fair <= high:
+                    conclusion = 'significant at {0:.0%}'.format(confidence)
+                    break
+
+    wins, games = comparison.wins[0], comparison.games
+    return SequentialReport(
+        comparison,
+        wins / games if games else 0.0,
+        wilson_interval(wins, games, confidence),
+        conclusion,
+    )
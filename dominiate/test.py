@@ -1,33 +1,45 @@
 from logging import DEBUG
-from random import shuffle
+from random import getrandbits
 from collections import defaultdict
 from argparse import ArgumentParser, Namespace
 from cProfile import runctx as profile_run
 from pstats import Stats
 from os import devnull
 from contextlib import redirect_stdout
+from time import perf_counter
 
 from game import *
 from players import *
 from basic_ai import *
 from combobot import *
-from cards import BASE_ACTIONS
-
-def compare_bots(bots, n: int = 2):
-    scores = {bot: 0 for bot in bots}
-    for i in range(n):
-        shuffle(bots)
-        game = Game.setup(bots, BASE_ACTIONS)
-        results = game.run()
-        maxscore = 0
-        for (bot, score) in results:
-            if score > maxscore:
-                maxscore = score
-        for (bot, score) in results:
-            if score == maxscore:
-                scores[bot] += 1
-                break
-    return scores
+from cards import BASE_ACTIONS, Village
+from events import EventLogger
+from parallel import compare_bots_parallel, DEFAULT_CHUNK_SIZE
+from sequential import compare_bots_sequential
+from paired import compare_bots_paired
+from latency import LatencyProfiler
+
+def compare_bots(bots, n: int = 2, seed=None, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE, store=None):
+    """
+    Play n games between the bots and count the wins of each. Game i is set
+    up from the master seed and game index i, so the same seed always gives
+    the same results, whatever the number of worker processes the games are
+    spread over (see parallel.py). With a store (see results.py), the full
+    results of the games are also appended to it.
+    """
+    if seed is None:
+        seed = getrandbits(32)
+    comparison = compare_bots_parallel(bots, n, seed, BASE_ACTIONS, workers, chunk_size, store)
+    return comparison.win_counts()
+
+def compare_bots_adaptive(bots, seed=None, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE, **options):
+    """
+    Play batches of games between the bots until the win rate of the first
+    bot is known well enough (see sequential.py), and return the report.
+    """
+    if seed is None:
+        seed = getrandbits(32)
+    return compare_bots_sequential(bots, seed, BASE_ACTIONS, workers=workers, chunk_size=chunk_size, **options)
 
 def test_game():
     player1 = BigMoney()
@@ -37,15 +49,65 @@ def test_game():
     results = game.run()
     return results
 
+def test_terminal_draw_act_decision():
+    """
+    Terminal draw bots play their terminal draws from the hand, and nothing
+    else, even when the rest of their deck holds other terminal draws.
+    """
+    bot = Terminal_Draw_Big_Money([Smithy, Moat])
+    game = Game.setup([bot, BigMoney()], BASE_ACTIONS, seed=0, shuffle_seats=False)
+    state = game.state()
+
+    def act_decision(hand):
+        discard = {Smithy: 1, Copper: 5}
+        return ActDecision(game.replace_current_state(PlayerState(
+            bot, hand, (), discard, {}, 1, 1, 0, rng=state.rng, sim_rng=state.sim_rng,
+        )))
+
+    assert bot.make_act_decision(act_decision((Moat, Copper, Copper, Estate, Estate))) is Moat
+    assert bot.make_act_decision(act_decision((Village, Copper, Copper, Estate, Estate))) is NO_CARD
+    assert bot.make_act_decision(act_decision((Copper, Copper, Copper, Estate, Estate))) is NO_CARD
+
+def test_hand_cache_reproducible():
+    """
+    The hands cached for a deck are the ones simulating it again would give,
+    even when they were left off part way, and simulating them does not draw
+    from the player's random stream.
+    """
+    def state():
+        return Game.setup([BigMoney(), BigMoney()], BASE_ACTIONS, seed=0).state()
+
+    cache = HandCache()
+    cached = state()
+    missed = list(cached.simulate_hands(20, (Smithy,), cache))
+    hit = list(cached.simulate_hands(20, (Smithy,), cache))
+    again = list(state().simulate_hands(20, (Smithy,), HandCache()))
+    assert sorted(missed) == sorted(hit) == sorted(again)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cached.sim_rng.below(1 << 30) == state().sim_rng.below(1 << 30)
+
+    sample = cached.hand_sample(20, (Silver,), cache)
+    for _ in range(5):
+        sample.simulate(cached, (Silver,))
+    resumed = list(cached.simulate_hands(20, (Silver,), cache))
+    assert sorted(resumed) == sorted(state().simulate_hands(20, (Silver,), HandCache()))
+
 def parse_args() -> Namespace:
     parser = ArgumentParser()
 
     parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--adaptive', action='store_true', help='Play each matchup until its win rate is significant')
+    parser.add_argument('--paired', action='store_true', help='Play seat-swapped pairs of games with common random numbers')
+    parser.add_argument('--latency', action='store_true', help='Profile the decision latency of the bots')
+    parser.add_argument('--budget', type=float, default=None, help='Time budget of every decision, in seconds, with --latency')
 
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
+    EventLogger().attach()
 
     if args.profile:
         profile_file = '.profile'
@@ -60,11 +122,27 @@ if __name__ == '__main__':
         stats = Stats(profile_file).sort_stats('cumtime')
         stats.print_stats()
 
+    if args.adaptive:
+        for bots in ([WitchBot(), SmithyBot()], [MoatBot(), SmithyBot()], [MoatBot(), WitchBot()], [WitchBot(), MilitiaBot()]):
+            print(compare_bots_adaptive(bots, seed=0, workers=args.workers, chunk_size=args.chunk_size, batch_size=50, max_games=2000))
+
+    if args.paired:
+        for bots in ([SmithyBot(), SmithyBot(2, 5)], [WitchBot(), MilitiaBot()]):
+            print(compare_bots_paired(bots, 100, 0, BASE_ACTIONS, workers=args.workers, chunk_size=args.chunk_size))
+
+    if args.latency:
+        profiler = LatencyProfiler(args.budget)
+        start = perf_counter()
+        compare_bots(profiler.wrap([WitchBot(), MilitiaBot(), ChapelBot()]), n=20, seed=0)
+        print(profiler.report(perf_counter() - start))
+
+    test_terminal_draw_act_decision()
+    test_hand_cache_reproducible()
     #test_game()
     #print(compare_bots([ChapelBot(), ChapelBot()], n=2))
-    print(compare_bots([WitchBot(), SmithyBot()], n=2))
-    print(compare_bots([MoatBot(), SmithyBot()], n=2))
-    print(compare_bots([MoatBot(), WitchBot()], n=2))
-    print(compare_bots([WitchBot(), MilitiaBot()], n=2))
+    print(compare_bots([WitchBot(), SmithyBot()], n=2, workers=args.workers, chunk_size=args.chunk_size))
+    print(compare_bots([MoatBot(), SmithyBot()], n=2, workers=args.workers, chunk_size=args.chunk_size))
+    print(compare_bots([MoatBot(), WitchBot()], n=2, workers=args.workers, chunk_size=args.chunk_size))
+    print(compare_bots([WitchBot(), MilitiaBot()], n=2, workers=args.workers, chunk_size=args.chunk_size))
     #compare_bots([BigMoney(), SmithyBot(), HillClimbBot(2, 3, 40)])
     #compare_bots([smithyComboBot, chapelComboBot, HillClimbBot(2, 3, 40)])
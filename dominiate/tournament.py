@@ -0,0 +1,207 @@
+"""
+Tournaments between pools of bots.
+
+A Tournament builds a pool of bots from bot factories, and plays tables of
+2 to 6 of them in round-robin, gauntlet or Swiss format. Every table plays
+games_per_table games with its bots rotating through the seats (see
+parallel.play_game), and all the games of a stage are spread over the same
+pool of workers. The results add up to a pairwise win matrix: how often each
+bot finished ahead of each other bot it sat with. Given a ResultStore (see
+results.py), the tournament also appends every game to it, and given a
+ReplayFile (see replay.py), the replay log of every game.
+"""
+from argparse import ArgumentParser, Namespace
+from itertools import combinations
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from game import Card
+from cards import BASE_ACTIONS
+from parallel import GameResult, chunk_tasks, run_tasks, DEFAULT_CHUNK_SIZE
+
+MIN_SEATS = 2
+MAX_SEATS = 6
+
+FORMATS = ('round-robin', 'gauntlet', 'swiss')
+
+class Tournament(object):
+    """
+    A pool of bots and the results of the tables they have played.
+
+    beats[i][j] counts the games in which bot i finished ahead of bot j (a
+    better score, or the same score from an earlier seat, as compare_bots
+    decides wins), and met[i][j] the games they played together. wins[i]
+    and games[i] count the games bot i won and played.
+    """
+    def __init__(self, factories: Sequence[Callable[[], Any]], seats: int = 2, games_per_table: Optional[int] = None, var_cards: Sequence[Card] = BASE_ACTIONS, seed: Any = 0, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE, store: Optional[Any] = None, replays: Optional[Any] = None) -> None:
+        if not MIN_SEATS <= seats <= MAX_SEATS:
+            raise ValueError('Tables seat {0} to {1} players, not {2}'.format(MIN_SEATS, MAX_SEATS, seats))
+        self.bots = [factory() for factory in factories]
+        if len(self.bots) < seats:
+            raise ValueError('{0} bots cannot fill a table of {1}'.format(len(self.bots), seats))
+        self.seats = seats
+        # a multiple of the table size, so that every bot gets every seat
+        # equally often
+        self.games_per_table = seats * 10 if games_per_table is None else games_per_table
+        self.var_cards = list(var_cards)
+        self.seed = seed
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.store = store
+        self.replays = replays
+        n = len(self.bots)
+        self.beats = [[0] * n for _ in range(n)]
+        self.met = [[0] * n for _ in range(n)]
+        self.wins = [0] * n
+        self.games = [0] * n
+        self.stages: List[Tuple[str, List[Tuple[int, ...]]]] = []
+
+    def play(self, name: str, tables: Sequence[Tuple[int, ...]]) -> None:
+        """
+        Play a stage: games_per_table games at each table, all scheduled on
+        the same workers. The seed of each table depends on the stage number,
+        so the same tournament always plays the same games.
+        """
+        stage = len(self.stages)
+        tasks = []
+        for table in tables:
+            seed = '{0}/{1}/{2}'.format(self.seed, stage, '-'.join(map(str, table)))
+            tasks.extend(chunk_tasks(table, self.games_per_table, seed, self.chunk_size, rotate=True, record=self.replays is not None))
+        for task, results in run_tasks(self.bots, self.var_cards, tasks, self.workers):
+            for result in results:
+                self.record(task.table, result)
+                if self.store is not None:
+                    self.store.append(result, task.seed, self.var_cards, [self.bots[i] for i in task.table])
+                if self.replays is not None:
+                    self.replays.append(result.replay)
+        self.stages.append((name, list(tables)))
+
+    def record(self, table: Tuple[int, ...], result: GameResult) -> None:
+        for a, i in enumerate(table):
+            self.games[i] += 1
+            for b, j in enumerate(table):
+                if a == b:
+                    continue
+                self.met[i][j] += 1
+                if (result.scores[a], -result.seats[a]) > (result.scores[b], -result.seats[b]):
+                    self.beats[i][j] += 1
+        self.wins[table[result.winner]] += 1
+
+    def round_robin(self) -> None:
+        "Play every table of `seats` bots of the pool."
+        self.play('round-robin', list(combinations(range(len(self.bots)), self.seats)))
+
+    def gauntlet(self, challenger: int) -> None:
+        "Play the challenger (an index in the pool) against every table of the rest of the pool."
+        field = [i for i in range(len(self.bots)) if i != challenger]
+        tables = [(challenger,) + others for others in combinations(field, self.seats - 1)]
+        self.play('gauntlet', tables)
+
+    def swiss(self, rounds: int) -> None:
+        "Play rounds of Swiss pairings (see swiss_tables)."
+        for _ in range(rounds):
+            self.play('swiss', self.swiss_tables())
+
+    def swiss_tables(self) -> List[Tuple[int, ...]]:
+        """
+        Seat the bots with the bots closest to them in the standings, avoiding
+        bots they have already met where possible. The bots at the bottom of
+        the standings that do not fill a table sit the round out.
+        """
+        unseated = self.standings()
+        tables = []
+        while len(unseated) >= self.seats:
+            first = unseated.pop(0)
+            new = [i for i in unseated if not self.met[first][i]]
+            old = [i for i in unseated if self.met[first][i]]
+            others = (new + old)[:self.seats - 1]
+            for i in others:
+                unseated.remove(i)
+            tables.append((first,) + tuple(sorted(others)))
+        return tables
+
+    def win_rate(self, i: int) -> float:
+        return self.wins[i] / self.games[i] if self.games[i] else 0.0
+
+    def standings(self) -> List[int]:
+        "The bots by decreasing win rate."
+        return sorted(range(len(self.bots)), key=lambda i: (-self.win_rate(i), i))
+
+    def win_matrix(self) -> List[List[Optional[float]]]:
+        """
+        The pairwise win matrix: how often bot i finished ahead of bot j, or
+        None if they never met.
+        """
+        n = len(self.bots)
+        return [
+            [
+                self.beats[i][j] / self.met[i][j] if self.met[i][j] else None
+                for j in range(n)
+            ]
+            for i in range(n)
+        ]
+
+    def report(self) -> str:
+        matrix = self.win_matrix()
+        lines = ['{0:>3} {1:<40} {2:>6} {3:>6}  {4}'.format(
+            '#', 'bot', 'games', 'wins', ' '.join('{0:>5}'.format(j) for j in range(len(self.bots))),
+        )]
+        for i in self.standings():
+            cells = ' '.join(
+                '{0:>5}'.format('-' if rate is None else '{0:.2f}'.format(rate))
+                for rate in matrix[i]
+            )
+            lines.append('{0:>3} {1:<40} {2:>6} {3:>6}  {4}'.format(
+                i, self.bots[i].name[:40], self.games[i], self.wins[i], cells,
+            ))
+        return '\n'.join(lines)
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser()
+
+    parser.add_argument('--format', choices=FORMATS, default='round-robin')
+    parser.add_argument('--seats', type=int, default=2)
+    parser.add_argument('--games', type=int, default=None, help='Games per table')
+    parser.add_argument('--rounds', type=int, default=3, help='Rounds of Swiss pairings')
+    parser.add_argument('--challenger', type=int, default=0, help='Index of the gauntlet challenger')
+    parser.add_argument('--seed', default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--store', default=None, help='Directory of a results store to append the games to')
+    parser.add_argument('--replays', default=None, help='File to append the replay logs of the games to')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    from basic_ai import Terminal_Draw_Big_Money
+    from cards import Smithy, Witch, Moat, Militia, Laboratory, Market
+    from results import ResultStore
+    from replay import ReplayFile
+
+    args = parse_args()
+    store = ResultStore(args.store) if args.store else None
+    replays = ReplayFile(args.replays, 'ab') if args.replays else None
+    factories = [
+        lambda card=card: Terminal_Draw_Big_Money([card])
+        for card in (Smithy, Witch, Moat, Militia, Laboratory, Market)
+    ] + [Terminal_Draw_Big_Money]
+    tournament = Tournament(
+        factories,
+        seats=args.seats,
+        games_per_table=args.games,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        store=store,
+        replays=replays,
+    )
+    if args.format == 'round-robin':
+        tournament.round_robin()
+    elif args.format == 'gauntlet':
+        tournament.gauntlet(args.challenger)
+    else:
+        tournament.swiss(args.rounds)
+    if store is not None:
+        store.flush()
+    if replays is not None:
+        replays.close()
+    print(tournament.report())